@@ -13,7 +13,8 @@ def on_tapis_client_instantiation(client, **kwargs):
     # using this library. this helps prevent circular imports in services that need, for example, to import the config object
     # at initialization. 
     from functools import partial
-    from tapisservice.auth import get_service_tokens, refresh_service_tokens, set_refresh_token, preprocess_service_request
+    from tapisservice.auth import get_service_tokens, refresh_service_tokens, set_refresh_token, preprocess_service_request, \
+        start_service_token_refresher
     from tapisservice.tenants import tenant_cache
 
     from tapisservice.logs import get_logger
@@ -51,6 +52,16 @@ def on_tapis_client_instantiation(client, **kwargs):
     client.get_tokens = partial(get_service_tokens, client)
     client.refresh_service_tokens = partial(refresh_service_tokens, client)
     client.set_refresh_token = partial(set_refresh_token, client)
+    client.start_service_token_refresher = partial(start_service_token_refresher, client)
+    # per-tenant locks serializing service token refreshes, and the optional background refresher.
+    client.service_token_locks = {}
+    # per-tenant stores of the service tokens shared by the workers of the node; see tapisservice.auth.
+    client.shared_token_stores = {}
+    client.service_token_refresher = None
+    # per-site connection pools of the client's requests_session; see tapisservice.sessions.
+    from tapisservice.sessions import get_site_pool_stats
+    client.site_pool_adapters = {}
+    client.get_site_pool_stats = partial(get_site_pool_stats, client)
 
     # set the preprocess_service_request to be a pre-request callable.
     client.plugin_on_call_pre_request_callables.append(preprocess_service_request)
@@ -1,20 +1,369 @@
 import base64
+import collections
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+import functools
+import hashlib
 import json
-from lib2to3.pgen2 import token
 import re
-from Crypto.PublicKey import RSA
-from Crypto.Hash import SHA256
+import threading
+import time
+import weakref
 import datetime
 import jwt
-from tapipy.tapis import Tapis
+from jwt.algorithms import RSAAlgorithm
 
-from tapisservice import errors
+# orjson, when installed, parses the token segments several times faster than the standard library.
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+from tapisservice import errors, metrics
 from tapisservice.tenants import tenant_cache
 from tapisservice.config import conf
-from tapisservice.logs import get_logger
-logger = get_logger(__name__)
+from tapisservice.logs import get_lazy_logger
+from tapisservice.utils import LazyObject, is_initialized
+logger = get_lazy_logger(__name__)
+
+
+class TokenCache(object):
+    """
+    Bounded, thread-safe LRU cache of verified token claims, used by validate_token() to skip the JWT decode and
+    signature check for tokens it has already verified. Entries are keyed by a digest of the raw token (and the
+    expected audience) so the tokens themselves are never held in memory by the cache.
+
+    An entry expires at the token's exp claim or after max_ttl seconds, whichever comes first, and is dropped as soon
+    as the public key of the token's tenant no longer matches the key the token was verified with.
+    """
+    def __init__(self, max_size=1000, max_ttl=300):
+        # max_size <= 0 disables the cache entirely.
+        self.max_size = max_size
+        self.max_ttl = max_ttl
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.key_changes = 0
+
+    @staticmethod
+    def get_key(token, expected_aud=[]):
+        """
+        Returns the cache key for a token; the expected audience is part of the key since it changes the outcome of
+        the validation.
+        """
+        aud = ','.join(sorted(expected_aud)) if expected_aud else ''
+        return hashlib.sha256(f"{aud}|{token}".encode()).hexdigest()
+
+    def get(self, token, tenant_cache, expected_aud=[]):
+        """
+        Returns a copy of the cached claims for `token`, or None if the token is not cached, has expired or its
+        tenant's public key has changed since it was verified.
+        """
+        if self.max_size <= 0:
+            return None
+        key = self.get_key(token, expected_aud)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            claims, tenant_id, public_key, expires_at = entry
+            if time.time() >= expires_at:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            tenant = tenant_cache.tenants.get(tenant_id)
+            if getattr(tenant, 'public_key', None) != public_key:
+                del self._entries[key]
+                self.key_changes += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return dict(claims)
+
+    def put(self, token, claims, tenant_id, public_key, expected_aud=[]):
+        """
+        Add the verified claims for `token` to the cache, evicting the least recently used entries if the cache is full.
+        """
+        if self.max_size <= 0:
+            return
+        expires_at = time.time() + self.max_ttl
+        exp = claims.get('exp')
+        if isinstance(exp, (int, float)):
+            expires_at = min(expires_at, exp)
+        key = self.get_key(token, expected_aud)
+        with self._lock:
+            self._entries[key] = (dict(claims), tenant_id, public_key, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+        Returns the cache counters as a dictionary.
+        """
+        return {'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'key_changes': self.key_changes}
+
+
+token_cache = LazyObject(lambda: TokenCache(max_size=conf.get('tapisservice_token_cache_size', 1000),
+                                            max_ttl=conf.get('tapisservice_token_cache_max_ttl', 300)))
+
+# service clients created by get_service_tapis_client, for the service token expiry gauge.
+_service_clients = weakref.WeakSet()
+
+
+def get_service_token_expiries():
+    """
+    Returns {(tenant_id,): seconds} with the time remaining on the access token of each tenant's service tokens, taking
+    the soonest expiry when several service clients hold tokens for the same tenant.
+    """
+    expiries = {}
+    for client in list(_service_clients):
+        for tenant_id, tokens in list(getattr(client, 'service_tokens', {}).items()):
+            access_token = tokens.get('access_token') if isinstance(tokens, dict) else None
+            if not hasattr(access_token, 'expires_in'):
+                continue
+            seconds = access_token.expires_in().total_seconds()
+            expiries[(tenant_id,)] = min(seconds, expiries.get((tenant_id,), seconds))
+    return expiries
+
+
+token_validation_seconds = metrics.registry.histogram(
+    'tapisservice_token_validation_seconds',
+    'Time spent in validate_token, by outcome (ok, expired, bad_signature, unknown_tenant, malformed, invalid).',
+    ['outcome'])
+
+
+def _get_token_cache_lookups():
+    if not is_initialized(token_cache):
+        return None
+    return {('hit',): token_cache.hits, ('miss',): token_cache.misses}
+
+
+metrics.registry.callback_counter(
+    'tapisservice_token_cache_lookups_total',
+    'Lookups in the cache of verified access tokens, by result.',
+    ['result'],
+    callback=_get_token_cache_lookups)
+metrics.registry.gauge(
+    'tapisservice_service_token_expires_in_seconds',
+    'Seconds until the service access token for each site admin tenant expires.',
+    ['tenant_id'],
+    callback=get_service_token_expiries)
 
 
+def _get_site_pool_stats(key):
+    values = {}
+    for client in list(_service_clients):
+        for site_id, adapter in list(getattr(client, 'site_pool_adapters', {}).items()):
+            values[(site_id,)] = values.get((site_id,), 0) + adapter.get_stats()[key]
+    return values
+
+
+metrics.registry.gauge(
+    'tapisservice_site_pool_requests_in_flight',
+    'Outgoing service requests currently using the connection pools of each site.',
+    ['site_id'],
+    callback=functools.partial(_get_site_pool_stats, 'in_use'))
+metrics.registry.callback_counter(
+    'tapisservice_site_pool_connections_opened_total',
+    'Connections opened by the connection pools of each site.',
+    ['site_id'],
+    callback=functools.partial(_get_site_pool_stats, 'connections_opened'))
+metrics.registry.callback_counter(
+    'tapisservice_site_pool_wait_seconds_total',
+    'Time outgoing service requests spent waiting for a connection from the pools of each site.',
+    ['site_id'],
+    callback=functools.partial(_get_site_pool_stats, 'wait_seconds_total'))
+
+
+def get_service_token_refresh_time(access_token, refresh_fraction=0.8, margin=30):
+    """
+    Returns the datetime at which `access_token` is due for a refresh, once refresh_fraction of its TTL has elapsed
+    (or `margin` seconds before it expires, if its TTL is not known), or None if it has no expiry information.
+    """
+    expires_at = getattr(access_token, 'expires_at', None)
+    if not isinstance(expires_at, datetime.datetime):
+        return None
+    try:
+        ttl = float(getattr(access_token, 'original_ttl', -1))
+    except (TypeError, ValueError):
+        ttl = -1
+    if ttl > 0:
+        return expires_at - datetime.timedelta(seconds=(1 - refresh_fraction) * ttl)
+    return expires_at - datetime.timedelta(seconds=margin)
+
+
+class ServiceTokenRefresher(object):
+    """
+    Daemon thread that refreshes each of a service client's tokens (client.service_tokens) once refresh_fraction of
+    the access token's TTL has elapsed, so that outgoing requests do not have to refresh tokens themselves. Refreshes go
+    through client.refresh_service_tokens() and are therefore serialized per tenant with any refresh made inline.
+    """
+    def __init__(self, client, refresh_fraction=0.8, retry_interval=30, max_sleep=300):
+        self.client = client
+        self.refresh_fraction = refresh_fraction
+        # seconds to wait before retrying a failed refresh
+        self.retry_interval = retry_interval
+        # the longest the thread sleeps between checks; tokens added to the client are picked up within this time.
+        self.max_sleep = max_sleep
+        self.refreshes = 0
+        self.failures = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def get_refresh_time(self, access_token):
+        """
+        Returns the datetime at which `access_token` should be refreshed, or None if it has no expiry information.
+        """
+        # when the original TTL is not known, the token is refreshed retry_interval seconds before it expires.
+        return get_service_token_refresh_time(access_token, self.refresh_fraction, self.retry_interval)
+
+    def refresh_due_tokens(self):
+        """
+        Refresh the tokens that are due for a refresh. Returns the number of seconds until the next one is due.
+        """
+        now = datetime.datetime.now(datetime.timezone.utc)
+        next_due = self.max_sleep
+        for tenant_id, tokens in list(getattr(self.client, 'service_tokens', {}).items()):
+            if not 'refresh_token' in tokens:
+                continue
+            refresh_at = self.get_refresh_time(tokens.get('access_token'))
+            if refresh_at is None:
+                continue
+            if refresh_at <= now:
+                try:
+                    access_token = self.client.refresh_service_tokens(tenant_id=tenant_id)
+                except Exception as e:
+                    self.failures += 1
+                    logger.error(f"Got exception refreshing the service tokens for tenant {tenant_id}; "
+                                 f"will retry in {self.retry_interval} seconds. exception: {e}")
+                    next_due = min(next_due, self.retry_interval)
+                    continue
+                self.refreshes += 1
+                refresh_at = self.get_refresh_time(access_token)
+                if refresh_at is None:
+                    continue
+            next_due = min(next_due, (refresh_at - now).total_seconds())
+        # never spin, even if a refreshed token is immediately due again
+        return max(next_due, 1)
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='tapis-service-token-refresh', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        delay = self.refresh_due_tokens()
+        while not self._stop.wait(delay):
+            delay = self.refresh_due_tokens()
+
+
+# guards the creation of the per-tenant locks that serialize service token refreshes on a client.
+_service_token_locks_guard = threading.Lock()
+
+
+def get_service_token_lock(client, tenant_id):
+    """
+    Returns the lock used to serialize refreshes of the service tokens for `tenant_id` on `client`.
+    """
+    with _service_token_locks_guard:
+        if not hasattr(client, 'service_token_locks'):
+            client.service_token_locks = {}
+        return client.service_token_locks.setdefault(tenant_id, threading.Lock())
+
+
+# path -> SharedSnapshot holding service tokens shared by the workers of the node; see get_shared_token_store().
+_shared_token_stores = {}
+
+
+def get_shared_token_store(username, token_tenant_id, tenant_id, access_token_ttl, refresh_token_ttl):
+    """
+    Returns the SharedSnapshot through which the workers of the node share the service tokens `username` (of
+    `token_tenant_id`) mints for `tenant_id` with these TTLs, or None if tapisservice_service_token_shared_path is not
+    set or the store cannot be opened.
+    """
+    base_path = conf.get('tapisservice_service_token_shared_path')
+    if not base_path:
+        return None
+    key = json.dumps([conf.primary_site_admin_tenant_base_url, username, token_tenant_id, tenant_id, access_token_ttl,
+                      refresh_token_ttl])
+    path = f'{base_path}-{hashlib.sha256(key.encode()).hexdigest()[:16]}'
+    store = _shared_token_stores.get(path)
+    if store is None:
+        from tapisservice.shared import SharedSnapshot
+        try:
+            store = SharedSnapshot(path)
+        except OSError as e:
+            logger.error(f"Could not open the shared service token store {path}; this worker will mint its own "
+                         f"tokens. exception: {e}")
+            return None
+        with _service_token_locks_guard:
+            store = _shared_token_stores.setdefault(path, store)
+    return store
+
+
+def _read_shared_service_tokens(client, store):
+    """
+    Returns the tokens in the shared token `store`, in the form of client.service_tokens entries, or None if there are
+    none or they are already due for a refresh.
+    """
+    from tapipy.tapis import TapisResult
+    entry = store.read()
+    if not entry:
+        return None
+    try:
+        access_token = client.add_claims_to_token(TapisResult(**entry['access_token']))
+        refresh_token = TapisResult(**entry['refresh_token'])
+    except Exception as e:
+        logger.error(f"Ignoring the service tokens in {store.path}; exception: {e}")
+        return None
+    refresh_at = get_service_token_refresh_time(access_token,
+                                                conf.get('tapisservice_service_token_refresh_fraction', 0.8))
+    if refresh_at is None or refresh_at <= datetime.datetime.now(datetime.timezone.utc):
+        return None
+    return {'access_token': access_token, 'refresh_token': refresh_token}
+
+
+def _publish_service_tokens(client, store, access_token, refresh_token):
+    """
+    Publishes the `access_token` and `refresh_token` just returned by the Tokens API to the shared token `store`, and
+    returns them in the form of a client.service_tokens entry.
+    """
+    from tapisservice.tenants import tapis_result_to_dict
+    # the TapisResults are converted before add_claims_to_token() adds a function to the access token.
+    entry = {'access_token': tapis_result_to_dict(access_token),
+             'refresh_token': tapis_result_to_dict(refresh_token)}
+    try:
+        store.publish(entry)
+    except Exception as e:
+        logger.error(f"Could not publish the service tokens to {store.path}; exception: {e}")
+    return {'access_token': client.add_claims_to_token(access_token), 'refresh_token': refresh_token}
+
 
 def get_service_tapis_client(tenant_id=None,
                              base_url=None,
@@ -26,12 +375,15 @@ def get_service_tapis_client(tenant_id=None,
                              access_token_ttl=None,
                              generate_tokens=True,
                              debug_prints=False,
-                             spec_dir=None):
+                             spec_dir=None,
+                             refresh_tokens_in_background=None):
     """
     Returns a Tapis client for the service using the service's configuration. If tenant_id is not passed, uses the first
     tenant in the service's tenants configuration.
     :param tenant_id: (str) The tenant_id associated with the tenant to configure the client with.
     :param base_url: (str) The base URL for the tenant to configure the client with.
+    :param refresh_tokens_in_background: (bool) Whether to start a ServiceTokenRefresher for the client's service
+    tokens; defaults to the tapisservice_service_token_background_refresh config.
     :return: (tapipy.tapis.Tapis) A Tapipy client object.
     """
     # if there is no base_url the primary_site_admin_tenant_base_url configured for the service:
@@ -45,30 +397,164 @@ def get_service_tapis_client(tenant_id=None,
         # tenants = sys.modules[__name__].tenants
         raise errors.BaseTapisError("As a Tapis service, passing in the appropriate tenants manager object"
                                     "is required.")
+    # tapipy.tapis is slow to import, so it is only imported once a client is needed.
+    from tapipy.tapis import Tapis
+    from tapisservice import specs
+    compiled_specs = None
+    if specs.uses_compiled_specs(resource_set, spec_dir, custom_spec_dict, download_latest_specs):
+        compiled_specs = specs.get_compiled_specs(resource_set, spec_dir, custom_spec_dict, download_latest_specs)
+    # with compiled specs, the client is built on tapipy's already loaded default specs and its resources are then
+    # replaced, so that tapipy does not load the specs again.
     t = Tapis(base_url=base_url,
               tenant_id=tenant_id,
               username=conf.service_name,
               account_type='service',
               service_password=conf.service_password,
               jwt=jwt,
-              resource_set=resource_set,
-              custom_spec_dict=custom_spec_dict,
-              spec_dir=spec_dir,
+              resource_set='tapipy' if compiled_specs else resource_set,
+              custom_spec_dict=None if compiled_specs else custom_spec_dict,
+              spec_dir=None if compiled_specs else spec_dir,
               debug_prints=debug_prints,
-              download_latest_specs=download_latest_specs,
+              download_latest_specs=False if compiled_specs else download_latest_specs,
               tenants=tenants,
               plugins=["tapisservice"],
               is_tapis_service=True)
+    if compiled_specs:
+        specs.set_client_resources(t, compiled_specs)
+        t.resource_set = resource_set
+        t.custom_spec_dict = custom_spec_dict
+        t.spec_dir = spec_dir
+        t.download_latest_specs = download_latest_specs
     if generate_tokens:
         logger.debug("tapis service client constructed, now getting tokens.")
         if access_token_ttl:
             t.get_tokens(access_token_ttl=access_token_ttl)
         else:
             t.get_tokens()
+        if refresh_tokens_in_background is None:
+            refresh_tokens_in_background = conf.get('tapisservice_service_token_background_refresh', False)
+        if refresh_tokens_in_background:
+            t.start_service_token_refresher()
+    _service_clients.add(t)
     logger.debug("got tokens, returning tapipy client.")
     return t
 
 
+class ServiceClientCache(object):
+    """
+    Thread-safe cache of the service clients built by get_service_tapis_client(), keyed by base_url, tenant_id and
+    resource_set, so that code which needs a client per request or per background task does not load the resource
+    specs and mint service tokens each time. Concurrent callers asking for a client that is not cached yet wait for a
+    single build.
+
+    Clients for the same base_url and tenant_id (e.g., with different resource sets) share one service token store:
+    the client.service_tokens dictionary, the per-tenant refresh locks and the shared token stores. Only the first of
+    them mints tokens, and a refresh made through any of them is seen by all of them.
+
+    The other arguments of get_client() are used when the client is built; they are not part of the key.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clients = {}
+        # locks serializing the build of each client
+        self._build_locks = {}
+        # (base_url, tenant_id) -> (service_tokens, service_token_locks, shared_token_stores) shared by the clients of
+        # that identity.
+        self._token_stores = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get_client(self, tenant_id=None, base_url=None, resource_set='tapipy', tenants=tenant_cache, **kwargs):
+        """
+        Returns the cached service client for the base_url, tenant_id and resource_set, building it with
+        get_service_tapis_client(tenants=tenants, **kwargs) if it is not cached. base_url and tenant_id default as in
+        get_service_tapis_client().
+        """
+        if not base_url:
+            base_url = conf.primary_site_admin_tenant_base_url
+        if not tenant_id:
+            tenant_id = conf.service_tenant_id
+        key = (base_url, tenant_id, resource_set)
+        client = self._clients.get(key)
+        if client is not None:
+            with self._lock:
+                self.hits += 1
+            return client
+        with self._lock:
+            build_lock = self._build_locks.setdefault(key, threading.Lock())
+        with build_lock:
+            client = self._clients.get(key)
+            if client is not None:
+                with self._lock:
+                    self.hits += 1
+                return client
+            with self._lock:
+                self.misses += 1
+            identity = (base_url, tenant_id)
+            store = self._token_stores.get(identity)
+            generate_tokens = kwargs.pop('generate_tokens', True)
+            client = get_service_tapis_client(tenant_id=tenant_id, base_url=base_url, resource_set=resource_set,
+                                              tenants=tenants, generate_tokens=generate_tokens and store is None,
+                                              **kwargs)
+            if store is not None:
+                client.service_tokens, client.service_token_locks, client.shared_token_stores = store
+            elif generate_tokens:
+                self._token_stores[identity] = (client.service_tokens, client.service_token_locks,
+                                                client.shared_token_stores)
+            with self._lock:
+                self._clients[key] = client
+        return client
+
+    def invalidate(self, tenant_id=None, base_url=None, resource_set=None):
+        """
+        Removes the cached clients matching the arguments given (all of them if none are given) and stops their
+        background token refreshers. Token stores no longer used by any cached client are dropped, so the next client
+        for that identity mints new tokens. Returns the number of clients removed.
+        """
+        with self._lock:
+            removed = [key for key in self._clients
+                       if (base_url is None or key[0] == base_url)
+                       and (tenant_id is None or key[1] == tenant_id)
+                       and (resource_set is None or key[2] == resource_set)]
+            clients = [self._clients.pop(key) for key in removed]
+            for key in removed:
+                self._build_locks.pop(key, None)
+            in_use = {key[:2] for key in self._clients}
+            for identity in [i for i in self._token_stores if i not in in_use]:
+                del self._token_stores[identity]
+        for client in clients:
+            refresher = getattr(client, 'service_token_refresher', None)
+            if refresher:
+                refresher.stop()
+        return len(clients)
+
+    def clear(self):
+        """
+        Removes all cached clients; see invalidate().
+        """
+        return self.invalidate()
+
+    def get_stats(self):
+        with self._lock:
+            return {'clients': len(self._clients),
+                    'token_stores': len(self._token_stores),
+                    'hits': self.hits,
+                    'misses': self.misses}
+
+
+service_client_cache = ServiceClientCache()
+
+
+def get_cached_service_tapis_client(tenant_id=None, base_url=None, resource_set='tapipy', tenants=tenant_cache,
+                                    **kwargs):
+    """
+    Returns a service client from the process-wide service_client_cache, building it with get_service_tapis_client()
+    the first time it is asked for. See ServiceClientCache.
+    """
+    return service_client_cache.get_client(tenant_id=tenant_id, base_url=base_url, resource_set=resource_set,
+                                           tenants=tenants, **kwargs)
+
+
 def get_service_tokens(self, **kwargs):
     """
     Calls the Tapis Tokens API to get access and refresh tokens for a service and set them on the client.
@@ -79,17 +565,23 @@ def get_service_tokens(self, **kwargs):
     else:
         username = kwargs['username']
     # tapis services manage a set ot tokens, one for each of the tenants for which we need to interact with.
-    self.service_tokens = {}
     # if the caller passed a tenant_id explicitly, we just use that
     if 'tenant_id' in kwargs:
-        self.service_tokens = {kwargs['tenant_id']: {}}
+        tenant_ids = [kwargs['tenant_id']]
     # otherwise, we compute all the tenant's that this service could need to interact with.
     else:
         try:
-            self.service_tokens = {t: {} for t in self.tenant_cache.get_site_admin_tenants_for_service()}
+            tenant_ids = list(self.tenant_cache.get_site_admin_tenants_for_service())
         except AttributeError:
             raise errors.BaseTapisError("Unable to retrieve target tenants for a service. Are you really a Tapis "
                                         "service? Did you pass in your Tenants manager instance?")
+    # the service_tokens dictionary is updated in place, never rebound: the clients of a ServiceClientCache share it.
+    if not hasattr(self, 'service_tokens'):
+        self.service_tokens = {}
+    for tenant_id in [t for t in self.service_tokens if t not in tenant_ids]:
+        del self.service_tokens[tenant_id]
+    for tenant_id in tenant_ids:
+        self.service_tokens.setdefault(tenant_id, {})
     if 'access_token_ttl' not in kwargs:
         # default to a 24 hour access token -
         access_token_ttl = 86400
@@ -100,44 +592,150 @@ def get_service_tokens(self, **kwargs):
         refresh_token_ttl = 3153600000
     else:
         refresh_token_ttl = kwargs['refresh_token_ttl']
-    for tenant_id in self.service_tokens.keys():
-        logger.debug(f"attempting to generate token for tenant {tenant_id}")
-        try:
-            target_site_id = self.tenant_cache.get_tenant_config(tenant_id=tenant_id).site_id
-        except Exception as e:
-            raise errors.BaseTapisError(f"Got exception computing target site id; e:{e}")
-        try:
-            tokens = self.tokens.create_token(token_username=username,
-                                              token_tenant_id=self.tenant_id,
-                                              account_type=self.account_type,
-                                              access_token_ttl=access_token_ttl,
-                                              generate_refresh_token=True,
-                                              refresh_token_ttl=refresh_token_ttl,
-                                              target_site_id=target_site_id,
-                                              _tapis_set_x_headers_from_service=True)
-        except Exception as e:
-            raise errors.BaseTapisError(f"Could not generate service tokens for service: {username};\n"
-                                           f"exception: {e};\n"
-                                           f"function args:\n"
-                                           f"token_username: {self.username};\n "
-                                           f"account_type: {self.account_type};\n "
-                                           f"target_site_id: {target_site_id};\n "
-                                           f"request url: {e.request.url}; \n "
-                                           f"headers: {e.request.headers}")
-        logger.debug(f"generate token for tenant {tenant_id} successfully.")
-        self.service_tokens[tenant_id] = {'access_token': self.add_claims_to_token(tokens.access_token),
-                                          'refresh_token': tokens.refresh_token}
+    # mint the tokens for all tenants concurrently, with bounded parallelism, and collect all failures instead of
+    # stopping at the first one.
+    # with a shared token store, the workers of the node reuse the tokens minted by any of them.
+    shared_token_stores = {}
+    for tenant_id in tenant_ids:
+        store = get_shared_token_store(username, self.tenant_id, tenant_id, access_token_ttl, refresh_token_ttl)
+        if store is not None:
+            shared_token_stores[tenant_id] = store
+    if not hasattr(self, 'shared_token_stores'):
+        self.shared_token_stores = {}
+    self.shared_token_stores.clear()
+    self.shared_token_stores.update(shared_token_stores)
+    max_workers = max(1, min(len(tenant_ids), conf.get('tapisservice_service_token_mint_workers', 8)))
+    failures = {}
+    self.service_token_timings = {}
+    self.shared_service_tokens_reused = []
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='tapis-token-mint') as executor:
+        futures = {executor.submit(_get_tenant_service_tokens, self, tenant_id, username, access_token_ttl,
+                                   refresh_token_ttl): tenant_id for tenant_id in tenant_ids}
+        for future in as_completed(futures):
+            tenant_id = futures[future]
+            try:
+                tokens, elapsed, reused = future.result()
+            except errors.BaseTapisError as e:
+                failures[tenant_id] = e.msg
+                continue
+            self.service_token_timings[tenant_id] = elapsed
+            if reused:
+                self.shared_service_tokens_reused.append(tenant_id)
+            logger.debug("got service tokens", tenant_id=tenant_id, seconds=round(elapsed, 3), reused=reused)
+            self.service_tokens[tenant_id] = tokens
+    if self.service_token_timings:
+        slowest = max(self.service_token_timings, key=self.service_token_timings.get)
+        logger.info(f"got service tokens for {len(self.service_token_timings)} tenant(s), "
+                    f"{len(self.shared_service_tokens_reused)} of them from the shared token store; slowest was "
+                    f"{slowest} at {self.service_token_timings[slowest]:.3f} seconds.")
+    if failures:
+        raise errors.ServiceTokenError(f"Could not generate service tokens for service: {username} for tenant(s) "
+                                       f"{', '.join(sorted(failures))}; failures: {failures}",
+                                       failures=failures)
+
+
+def _get_tenant_service_tokens(self, tenant_id, username, access_token_ttl, refresh_token_ttl):
+    """
+    Returns the client.service_tokens entry for one tenant, the elapsed seconds and whether the tokens were reused from
+    the shared token store. With a shared token store, the tokens another worker of the node minted are reused unless
+    they are due for a refresh; otherwise new tokens are created and published to the store. The store is locked
+    meanwhile, so that the workers starting together mint the tokens only once.
+    """
+    store = self.shared_token_stores.get(tenant_id)
+    if store is None:
+        tokens, elapsed = _create_service_tokens(self, tenant_id, username, access_token_ttl, refresh_token_ttl)
+        return {'access_token': self.add_claims_to_token(tokens.access_token),
+                'refresh_token': tokens.refresh_token}, elapsed, False
+    start = time.perf_counter()
+    with store.lock():
+        service_tokens = _read_shared_service_tokens(self, store)
+        if service_tokens is not None:
+            return service_tokens, time.perf_counter() - start, True
+        tokens, _ = _create_service_tokens(self, tenant_id, username, access_token_ttl, refresh_token_ttl)
+        service_tokens = _publish_service_tokens(self, store, tokens.access_token, tokens.refresh_token)
+    return service_tokens, time.perf_counter() - start, False
+
+
+def _create_service_tokens(self, tenant_id, username, access_token_ttl, refresh_token_ttl):
+    """
+    Call the Tokens API to create the service's tokens for one tenant. Returns the tokens and the elapsed seconds.
+    """
+    logger.debug("attempting to generate token", tenant_id=tenant_id)
+    start = time.perf_counter()
+    try:
+        target_site_id = self.tenant_cache.get_tenant_config(tenant_id=tenant_id).site_id
+    except Exception as e:
+        raise errors.BaseTapisError(f"Got exception computing target site id; e:{e}")
+    try:
+        tokens = self.tokens.create_token(token_username=username,
+                                          token_tenant_id=self.tenant_id,
+                                          account_type=self.account_type,
+                                          access_token_ttl=access_token_ttl,
+                                          generate_refresh_token=True,
+                                          refresh_token_ttl=refresh_token_ttl,
+                                          target_site_id=target_site_id,
+                                          _tapis_set_x_headers_from_service=True)
+    except Exception as e:
+        request = getattr(e, 'request', None)
+        raise errors.BaseTapisError(f"Could not generate service tokens for service: {username};\n"
+                                       f"exception: {e};\n"
+                                       f"function args:\n"
+                                       f"token_username: {self.username};\n "
+                                       f"account_type: {self.account_type};\n "
+                                       f"target_site_id: {target_site_id};\n "
+                                       f"request url: {getattr(request, 'url', None)}; \n "
+                                       f"headers: {getattr(request, 'headers', None)}")
+    return tokens, time.perf_counter() - start
 
 
 def refresh_service_tokens(self, tenant_id):
     """
-    Use the refresh token operation for tokens of type "service".
+    Use the refresh token operation for tokens of type "service". Refreshes are serialized per tenant; a caller that
+    had to wait for another thread's refresh of the same tenant's tokens gets those new tokens instead of refreshing
+    again. With a shared token store, refreshes are also serialized across the workers of the node, and tokens another
+    worker refreshed are used if they are not yet due for a refresh themselves.
     """
-    refresh_token = self.service_tokens[tenant_id]['refresh_token'].refresh_token
-    tokens = self.tokens.refresh_token(refresh_token=refresh_token, _tapis_set_x_headers_from_service=True)
-    self.service_tokens[tenant_id]['access_token'] = self.add_claims_to_token(tokens.access_token)
-    self.service_tokens[tenant_id]['refresh_token'] = tokens.refresh_token
-    return tokens.access_token
+    current_access_token = self.service_tokens[tenant_id].get('access_token')
+    with get_service_token_lock(self, tenant_id):
+        latest_access_token = self.service_tokens[tenant_id].get('access_token')
+        if latest_access_token is not current_access_token:
+            logger.debug("service tokens were refreshed by another thread", tenant_id=tenant_id)
+            return latest_access_token
+        store = self.shared_token_stores.get(tenant_id)
+        if store is None:
+            refresh_token = self.service_tokens[tenant_id]['refresh_token'].refresh_token
+            tokens = self.tokens.refresh_token(refresh_token=refresh_token, _tapis_set_x_headers_from_service=True)
+            # replace the tenant's tokens in one assignment so readers never see a mismatched pair.
+            self.service_tokens[tenant_id] = {'access_token': self.add_claims_to_token(tokens.access_token),
+                                              'refresh_token': tokens.refresh_token}
+            return tokens.access_token
+        with store.lock():
+            service_tokens = _read_shared_service_tokens(self, store)
+            if service_tokens is not None and not service_tokens['access_token'].access_token == \
+                    getattr(current_access_token, 'access_token', None):
+                logger.debug("service tokens were refreshed by another worker", tenant_id=tenant_id)
+                self.service_tokens[tenant_id] = service_tokens
+                return service_tokens['access_token']
+            refresh_token = self.service_tokens[tenant_id]['refresh_token'].refresh_token
+            tokens = self.tokens.refresh_token(refresh_token=refresh_token, _tapis_set_x_headers_from_service=True)
+            service_tokens = _publish_service_tokens(self, store, tokens.access_token, tokens.refresh_token)
+        self.service_tokens[tenant_id] = service_tokens
+    return service_tokens['access_token']
+
+
+def start_service_token_refresher(self, refresh_fraction=None):
+    """
+    Start a ServiceTokenRefresher for this client's service tokens, if one is not already running. Returns the
+    refresher.
+    """
+    if refresh_fraction is None:
+        refresh_fraction = conf.get('tapisservice_service_token_refresh_fraction', 0.8)
+    refresher = getattr(self, 'service_token_refresher', None)
+    if not refresher:
+        refresher = ServiceTokenRefresher(self, refresh_fraction=refresh_fraction)
+        self.service_token_refresher = refresher
+    refresher.start()
+    return refresher
 
 
 def set_refresh_token(self, token):
@@ -175,7 +773,7 @@ def preprocess_service_request(operation, prepared_request, **kwargs):
     2. It sets the X-Tapis-Token header to the appropriate service token.
     3. It sets the X-Tapis-Tenant and X-Tapis-User headers.
     """
-    logger.debug(f"top of preprocess_service_request for operation: {operation.http_method.upper()}: {operation.path_name}")
+    logger.debug("top of preprocess_service_request", method=lambda: operation.http_method.upper(), path=operation.path_name)
     # for service requests, we must determine which site to use for the request. there are 3 cases.
     # first, the caller can explicitly set the _tapis_set_x_headers_from_service variable. this instructs the library
     # to use the service's site and name for setting the X-Tapis-Tenant and User headers when making the request.
@@ -240,7 +838,10 @@ def preprocess_service_request(operation, prepared_request, **kwargs):
     # the original base URL is the URL up to the '/v3/'
     orig_base_url = prepared_request.url.split('/v3')[0]
     prepared_request.url = prepared_request.url.replace(orig_base_url, base_url)
-    logger.debug(f"final URL: {prepared_request.url}")
+    logger.debug("final URL", url=prepared_request.url)
+    # send it through the keep-alive connection pools of the site --
+    from tapisservice.sessions import use_site_pool
+    use_site_pool(operation.tapis_client, site_id, base_url)
 
     # modify the X-Tapis-Tenant and X-Tapis-User request headers ---
     prepared_request.headers['X-Tapis-Tenant'] = request_tenant_id
@@ -250,16 +851,14 @@ def preprocess_service_request(operation, prepared_request, **kwargs):
     # the tenant_id for the request could be a user tenant (e.g., "tacc" or "dev") but the
     # service tokens are stored by admin tenant, so we need to get the admin tenant for the
     # owning site of the tenant.
-    for tn in operation.tapis_client.tenant_cache.tenants.values(): # tenant_cache is a dict
-        if tn.site.site_id == site_id:
-            request_site_admin_tenant_id = tn.site.site_admin_tenant_id
-    logger.debug(f"site admin tenant for the request: {request_site_admin_tenant_id}")
+    request_site_admin_tenant_id = operation.tapis_client.tenant_cache.get_site_admin_tenant_id(site_id)
+    logger.debug("site admin tenant for the request", tenant_id=request_site_admin_tenant_id)
     # service_tokens may be defined but still be empty dictionaries... this __call__ could be to get
     # the service's first set of tokens.
-    if request_site_admin_tenant_id in operation.tapis_client.service_tokens.keys() \
-            and 'access_token' in operation.tapis_client.service_tokens[request_site_admin_tenant_id].keys():
+    tenant_tokens = operation.tapis_client.service_tokens.get(request_site_admin_tenant_id)
+    if tenant_tokens and 'access_token' in tenant_tokens:
         try:
-            access_token = operation.tapis_client.service_tokens[request_site_admin_tenant_id]['access_token']
+            access_token = tenant_tokens['access_token']
             jwt_str = access_token.access_token
             prepared_request.headers['X-Tapis-Token']= jwt_str
             # also remove the basic auth header; we shouldn't send both
@@ -307,9 +906,9 @@ def preprocess_service_request(operation, prepared_request, **kwargs):
     else:
         # not having a token is not an issue if this is a request to generate a token --
         if '/v3/tokens' not in prepared_request.url:
-            logger.warning(f"Not able to set the access token; service token keys: {operation.tapis_client.service_tokens.keys()}")
+            logger.warning("Not able to set the access token", service_token_keys=lambda: list(operation.tapis_client.service_tokens.keys()))
             if request_site_admin_tenant_id in operation.tapis_client.service_tokens.keys():
-                logger.warning(f"key existed; value: {operation.tapis_client.service_tokens[request_site_admin_tenant_id]}")
+                logger.warning("key existed", value=operation.tapis_client.service_tokens[request_site_admin_tenant_id])
     logger.debug("returning from preprocess_service_request")
             
 
@@ -375,7 +974,7 @@ def resolve_tenant_id_for_request(request_thread_local, request, tenant_cache=te
             logger.debug("found x_tapis_tenant and x_tapis_token on the request_thread_local object.")
             # need to check token is a service token
             if not hasattr(request_thread_local, 'token_claims'):
-                logger.error(f"Did not find token_claims attribute on request_thread_local; attrs: {dir(request_thread_local)}")
+                logger.error("Did not find token_claims attribute on request_thread_local", attrs=lambda: dir(request_thread_local))
             if not request_thread_local.token_claims.get('tapis/account_type') == 'service':
                 raise errors.PermissionsError('Setting X-Tapis-Tenant header and X-Tapis-Token requires a service token.')
         
@@ -386,7 +985,7 @@ def resolve_tenant_id_for_request(request_thread_local, request, tenant_cache=te
         # todo -- compute and set g.request_site_id
         return request_thread_local.request_tenant_id
     # in all other cases, the request's tenant_id is based on the base URL of the request:
-    logger.debug(f"computing base_url based on the URL of the request: {request.base_url}")
+    logger.debug("computing base_url based on the URL of the request", base_url=request.base_url)
     # the request_baseurl includes the protocol, port (if present) and contains the url path; examples:
     #  http://localhost:5000/v3/oauth2/tenant;
     #  https://dev.develop.tapis.io/v3/oauth2/tenant
@@ -394,7 +993,7 @@ def resolve_tenant_id_for_request(request_thread_local, request, tenant_cache=te
     # cannot be used to resolve the tenant id so instead we use the tenant_id claim within the x-tapis-token:
     dev_request_url = conf.get("dev_request_url", "dev://request_url")
     if 'http://172.17.0.1:' in request.base_url or 'http://localhost:' in request.base_url or dev_request_url in request.base_url:
-        logger.debug(f"found 172.17.0.1, localhost, or {dev_request_url} in base_url")
+        logger.debug("found 172.17.0.1, localhost, or dev_request_url in base_url", dev_request_url=dev_request_url)
         # some services, such as authenticator, have endpoints that do not receive tokens. in the local development
         # case for these endpoints, we don't have a lot of good options -- we can't use the base URL or the token
         # to determine the tenant, so we just set it to the "dev" tenant.
@@ -419,12 +1018,12 @@ def resolve_tenant_id_for_request(request_thread_local, request, tenant_cache=te
     if request_thread_local.x_tapis_token:
         logger.debug("found x_tapis_token on g; making sure tenant claim inside token matches that of the base URL.")
         if not hasattr(request_thread_local, "token_claims"):
-            logger.error(f"request_thread_local missing token_claims! attrs: {dir(request_thread_local)}")
+            logger.error("request_thread_local missing token_claims!", attrs=lambda: dir(request_thread_local))
         token_tenant_id = request_thread_local.token_claims.get('tapis/tenant_id')
         if not token_tenant_id == request_thread_local.request_tenant_id:
             raise errors.PermissionsError(f'The tenant_id claim in the token, '
                                           f'{token_tenant_id} does not match the URL tenant, {request_thread_local.request_tenant_id}.')
-    logger.debug(f"resolve_tenant_id_for_request returning {request_thread_local.request_tenant_id}")
+    logger.debug("resolve_tenant_id_for_request returning", request_tenant_id=request_thread_local.request_tenant_id)
     return request_thread_local.request_tenant_id
 
 
@@ -438,7 +1037,7 @@ def validate_request_token(request_thread_local, tenant_cache=tenant_cache, expe
     :param expected_aud: allows developers to change the expected audience of the token.
     :return:
     """
-    logger.debug(f"top of validate_request_token; thread_local attrs: {dir(request_thread_local)}")
+    logger.debug("top of validate_request_token", thread_local_attrs=lambda: dir(request_thread_local))
     if not hasattr(request_thread_local, 'x_tapis_token'):
         raise errors.NoTokenError("No access token found in the request.")
     claims = validate_token(request_thread_local.x_tapis_token, tenant_cache, expected_aud)
@@ -467,6 +1066,139 @@ def validate_request_token(request_thread_local, tenant_cache=tenant_cache, expe
             pass
 
 
+# the signing algorithm of Tapis tokens.
+JWT_ALGORITHMS = ('RS256',)
+_rs256 = RSAAlgorithm(RSAAlgorithm.SHA256)
+
+# a base64url encoded JWT segment; trailing padding is tolerated as it is by jwt.decode.
+_jwt_segment_re = re.compile(rb'[A-Za-z0-9_-]*={0,2}')
+
+# the result of decode_jwt(): the parsed header and claims and the raw bytes the signature is checked against.
+DecodedJWT = collections.namedtuple('DecodedJWT', ['header', 'claims', 'signing_input', 'signature'])
+
+
+def _decode_jwt_segment(segment, name):
+    stripped = segment.rstrip(b'=')
+    if not _jwt_segment_re.fullmatch(segment) or len(stripped) % 4 == 1 \
+            or (len(stripped) < len(segment) and len(segment) % 4):
+        raise jwt.DecodeError(f"Invalid {name} padding")
+    try:
+        return base64.urlsafe_b64decode(stripped + b'=' * (-len(stripped) % 4))
+    except (TypeError, ValueError) as e:
+        raise jwt.DecodeError(f"Invalid {name} padding") from e
+
+
+def _parse_jwt_json(data, name):
+    try:
+        value = _json_loads(data)
+    except (ValueError, RecursionError) as e:
+        raise jwt.DecodeError(f"Invalid {name} string: {e}") from e
+    if not isinstance(value, dict):
+        raise jwt.DecodeError(f"Invalid {name} string: must be a json object")
+    return value
+
+
+def decode_jwt(token):
+    """
+    Splits a JWT and parses its header and claims in a single pass WITHOUT checking the signature. The returned
+    DecodedJWT is passed on to check_jwt_claims() and verify_jwt_signature(), so a token is only ever parsed once.
+    Raises jwt.DecodeError if the token is malformed.
+    """
+    if isinstance(token, str):
+        token = token.encode()
+    if not isinstance(token, bytes):
+        raise jwt.DecodeError("Invalid token type.")
+    parts = token.split(b'.')
+    if not len(parts) == 3:
+        raise jwt.DecodeError(f"Invalid JWT format; did not get 3 parts got: {len(parts)}.")
+    header = _parse_jwt_json(_decode_jwt_segment(parts[0], 'header'), 'header')
+    # Tapis never issues tokens with unencoded (RFC 7797) payloads.
+    if header.get('b64', True) is False:
+        raise jwt.DecodeError("Unencoded payloads are not supported.")
+    claims = _parse_jwt_json(_decode_jwt_segment(parts[1], 'payload'), 'payload')
+    signature = _decode_jwt_segment(parts[2], 'crypto')
+    return DecodedJWT(header, claims, token[:len(parts[0]) + len(parts[1]) + 1], signature)
+
+
+def check_jwt_claims(decoded, expected_aud=[], now=None):
+    """
+    The checks jwt.decode() makes on the header and the claims, done without any cryptography so that expired,
+    not-yet-valid and otherwise unacceptable tokens are rejected before the signature is checked. Raises the same
+    jwt exceptions jwt.decode(token, key, algorithms=["RS256"], audience=expected_aud) would; as in validate_token(),
+    an expected_aud containing "*" accepts any audience.
+    """
+    header = decoded.header
+    alg = header.get('alg')
+    if not alg or alg not in JWT_ALGORITHMS:
+        raise jwt.InvalidAlgorithmError("The specified alg value is not allowed")
+    if 'kid' in header and not isinstance(header['kid'], str):
+        raise jwt.InvalidTokenError("Key ID header parameter must be a string")
+    if 'crit' in header:
+        crit = header['crit']
+        if not isinstance(crit, list) or not crit \
+                or any(not ext == 'b64' or ext not in header for ext in crit):
+            raise jwt.InvalidTokenError("Invalid or unsupported 'crit' header")
+
+    claims = decoded.claims
+    if now is None:
+        now = time.time()
+    if 'iat' in claims:
+        try:
+            iat = int(claims['iat'])
+        except (ValueError, TypeError, OverflowError):
+            raise jwt.InvalidIssuedAtError("Issued At claim (iat) must be an integer.") from None
+        if iat > now:
+            raise jwt.ImmatureSignatureError("The token is not yet valid (iat)")
+    if 'nbf' in claims:
+        try:
+            nbf = int(claims['nbf'])
+        except (ValueError, TypeError, OverflowError):
+            raise jwt.DecodeError("Not Before claim (nbf) must be an integer.") from None
+        if nbf > now:
+            raise jwt.ImmatureSignatureError("The token is not yet valid (nbf)")
+    if 'exp' in claims:
+        try:
+            exp = int(claims['exp'])
+        except (ValueError, TypeError, OverflowError):
+            raise jwt.DecodeError("Expiration Time claim (exp) must be an integer.") from None
+        if exp <= now:
+            raise jwt.ExpiredSignatureError("Signature has expired")
+
+    # expected_aud - https://github.com/jpadilla/pyjwt/blob/master/docs/usage.rst#audience-claim-aud
+    if not '*' in expected_aud:
+        aud = claims.get('aud')
+        if not expected_aud:
+            if aud:
+                raise jwt.InvalidAudienceError("Invalid audience")
+        else:
+            if not aud:
+                raise jwt.MissingRequiredClaimError('aud')
+            if isinstance(aud, str):
+                aud = [aud]
+            if not isinstance(aud, list) or any(not isinstance(a, str) for a in aud):
+                raise jwt.InvalidAudienceError("Invalid claim format in token")
+            audience = [expected_aud] if isinstance(expected_aud, str) else expected_aud
+            if all(a not in aud for a in audience):
+                raise jwt.InvalidAudienceError("Audience doesn't match")
+    if 'sub' in claims and not isinstance(claims['sub'], str):
+        raise jwt.InvalidTokenError("Subject must be a string")
+    if 'jti' in claims and not isinstance(claims['jti'], str):
+        raise jwt.InvalidTokenError("JWT ID must be a string")
+
+
+def verify_jwt_signature(decoded, public_key):
+    """
+    Checks the signature of a DecodedJWT with `public_key`, a key object (e.g., from TenantCache.get_public_key) or
+    a PEM string. Raises jwt.InvalidSignatureError if the signature does not match.
+    """
+    if decoded.header.get('alg') not in JWT_ALGORITHMS:
+        raise jwt.InvalidAlgorithmError("The specified alg value is not allowed")
+    if isinstance(public_key, (str, bytes)):
+        public_key = _rs256.prepare_key(public_key)
+    if not _rs256.verify(decoded.signing_input, public_key, decoded.signature):
+        raise jwt.InvalidSignatureError("Signature verification failed")
+
+
 def insecure_decode_jwt_to_claims(token):
     """
     Returns the claims associated with a token WITHOUT checking the signature.
@@ -492,7 +1224,49 @@ def insecure_decode_jwt_to_claims(token):
     return claims
 
 
-def validate_token(token, tenant_cache=tenant_cache, expected_aud=[]):
+def _check_token(token, tenant_cache, expected_aud):
+    """
+    Everything validate_token() checks before the signature: parses the token once, rejects expired, not yet valid
+    and otherwise unacceptable tokens without doing any cryptography, and looks up the token's tenant. Returns
+    (None, (decoded, tenant_id, public_key_str)) for tokens that can go on to the signature check, and
+    (outcome, AuthenticationError) for rejected tokens, where outcome is the token validation metrics label.
+    """
+    # the tenant is needed to know which public key to check the signature with.
+    try:
+        decoded = decode_jwt(token)
+    except jwt.DecodeError as e:
+        logger.debug("got exception trying to parse data from the access_token jwt", exception=e)
+        return 'malformed', errors.AuthenticationError("Could not parse the Tapis access token.")
+    logger.debug("got data from token", claims=decoded.claims)
+    # get the tenant out of the jwt payload and get associated public key
+    try:
+        token_tenant_id = decoded.claims['tapis/tenant_id']
+    except KeyError:
+        return 'malformed', errors.AuthenticationError("Unable to process Tapis token; could not parse the tenant_id. "
+                                                       "It is possible the token is in a format no longer supported "
+                                                       "by the platform.")
+    try:
+        check_jwt_claims(decoded, expected_aud)
+    except jwt.PyJWTError as e:
+        logger.debug("token failed the claims checks", exception=e)
+        outcome = 'expired' if isinstance(e, jwt.ExpiredSignatureError) else 'invalid'
+        return outcome, errors.AuthenticationError("Invalid Tapis token.")
+    try:
+        token_tenant = tenant_cache.get_tenant_config(tenant_id=token_tenant_id)
+        public_key_str = token_tenant.public_key
+    except errors.BaseTapisError:
+        logger.error(f"Did not find the public key for tenant_id {token_tenant_id} in the tenant configs.")
+        return 'unknown_tenant', errors.AuthenticationError("Unable to process Tapis token; unexpected tenant_id.")
+    except AttributeError:
+        return 'unknown_tenant', errors.AuthenticationError("Unable to process Tapis token; no public key associated "
+                                                            "with the tenant_id.")
+    if not public_key_str:
+        return 'unknown_tenant', errors.AuthenticationError("Could not find the public key for the tenant_id "
+                                                            "associated with the tenant.")
+    return None, (decoded, token_tenant_id, public_key_str)
+
+
+def validate_token(token, tenant_cache=tenant_cache, expected_aud=[], token_cache=token_cache):
     """
     Stand-alone function to validate a Tapis token. 
     :param token: The token to validate
@@ -500,6 +1274,7 @@ def validate_token(token, tenant_cache=tenant_cache, expected_aud=[]):
     :param expected_aud: allows developers to change the expected audience of the token.
     Tapis doesn't set/care about aud. But OIDC clients like it on tokens. Meaning OIDC clients might check /oauth2/userinfo/oidc
     with a token using aud. For this case we need to be able to set what to expect. If none, any aud is rejected. Info in comments
+    :param token_cache: The TokenCache of already verified tokens to consult; pass None to always do the full decode.
     :return: 
     """
     # first, decode the token data to determine the tenant associated with the token. We are not able to
@@ -507,66 +1282,209 @@ def validate_token(token, tenant_cache=tenant_cache, expected_aud=[]):
     logger.debug("top of validate_token")
     if not token:
         raise errors.NoTokenError("No Tapis access token found in the request.")
-    try:
-        data = insecure_decode_jwt_to_claims(token)
-    except Exception as e:
-        logger.debug(f"got exception trying to parse data from the access_token jwt; exception: {e}")
-        raise errors.AuthenticationError("Could not parse the Tapis access token.")
-    logger.debug(f"got data from token: {data}")
-    # get the tenant out of the jwt payload and get associated public key
-    try:
-        token_tenant_id = data['tapis/tenant_id']
-    except KeyError:
-        raise errors.AuthenticationError("Unable to process Tapis token; could not parse the tenant_id. It is possible "
-                                         "the token is in a format no longer supported by the platform.")
-    try:
-        token_tenant = tenant_cache.get_tenant_config(tenant_id=token_tenant_id)
-        public_key_str = token_tenant.public_key
-    except errors.BaseTapisError:
-        logger.error(f"Did not find the public key for tenant_id {token_tenant_id} in the tenant configs.")
-        raise errors.AuthenticationError("Unable to process Tapis token; unexpected tenant_id.")
-    except AttributeError:
-        raise errors.AuthenticationError("Unable to process Tapis token; no public key associated with the "
-                                         "tenant_id.")
-    if not public_key_str:
-        raise errors.AuthenticationError("Could not find the public key for the tenant_id associated with the tenant.")
-    # check signature and decode
+    start = time.perf_counter() if metrics.registry.enabled else None
+    # tokens we have already verified (with the tenant's current public key) can skip the decode entirely --
+    if token_cache is not None:
+        claims = token_cache.get(token, tenant_cache, expected_aud)
+        if claims is not None:
+            _observe_token_validation(start, 'ok')
+            return claims
+    outcome, result = _check_token(token, tenant_cache, expected_aud)
+    if outcome:
+        _observe_token_validation(start, outcome)
+        raise result
+    decoded, token_tenant_id, public_key_str = result
+    claims = decoded.claims
+    # check signature
     tries = 0
     while tries < 2:
         tries = tries + 1
+        # the tenant_cache holds the parsed public key objects, so the PEM string is not re-parsed on every request.
+        # the PEM comes with the key object, from the same version of the registry, for the token cache below.
+        verified_key_str, public_key = tenant_cache.get_public_key_entry(token_tenant_id)
         try:
-            # expected_aud - https://github.com/jpadilla/pyjwt/blob/master/docs/usage.rst#audience-claim-aud
-            # by default, if oidc token with aud is input, jwt.decode rejects it. if no aud at all, it'll accept
-            # oidc clients generally want aud==client_id. expected_aud allows us to configure validation
-            # by default this implementation rejects all aud, set expected to change that
-            if "*" in expected_aud:
-                claims = jwt.decode(token, public_key_str, algorithms=["RS256"], options={"verify_aud": False})
-            elif expected_aud:
-                claims = jwt.decode(token, public_key_str, algorithms=["RS256"], audience=expected_aud)
-            else:
-                claims = jwt.decode(token, public_key_str, algorithms=["RS256"])
-
+            if public_key is None:
+                raise errors.AuthenticationError(f"The public key for tenant {token_tenant_id} could not be parsed.")
+            verify_jwt_signature(decoded, public_key)
+            break
         except Exception as e:
-            # if we get an exception decoding it could be that the tenant's public key has changed (i.e., that
+            # if the signature does not check out it could be that the tenant's public key has changed (i.e., that
             # the public key in out tenant_cache is stale. if we haven't updated the tenant_cache in the last
-            # update_tenant_cache_timedelta then go ahead and update and try the decode again.
+            # update_tenant_cache_timedelta then go ahead and update and try the verification again.
             if ( (datetime.datetime.now() > tenant_cache.last_tenants_cache_update + tenant_cache.update_tenant_cache_timedelta)
                     and tries == 1):
-                tenant_cache.get_tenants()
+                tenant_cache.reload_tenants()
                 continue
             # otherwise, we were using a recent public key, so just fail out.
-            logger.debug(f"Got exception trying to decode token; exception: {e}")
+            logger.debug("Got exception trying to verify the token signature", exception=e)
+            if isinstance(e, jwt.InvalidSignatureError):
+                _observe_token_validation(start, 'bad_signature')
+            else:
+                _observe_token_validation(start, 'invalid')
             raise errors.AuthenticationError("Invalid Tapis token.")
+    if token_cache is not None:
+        # record the PEM the token was actually verified with; it can differ from public_key_str after a reload.
+        token_cache.put(token, claims, token_tenant_id, verified_key_str, expected_aud)
+    _observe_token_validation(start, 'ok')
     # if the token is a service token (i.e., this is a service to service request), do additional checks:
     return claims
 
 
+# tokens per signature verification task in validate_tokens(); a batch that fits in one task is verified in the
+# calling thread.
+BULK_VALIDATION_CHUNK_SIZE = 32
+
+
+def _get_bulk_validation_executor():
+    workers = conf.get('tapisservice_bulk_token_validation_workers', 4)
+    if conf.get('tapisservice_bulk_token_validation_processes', False):
+        return ProcessPoolExecutor(max_workers=workers)
+    return ThreadPoolExecutor(max_workers=workers, thread_name_prefix='tapis-token-validation')
+
+
+# the pool validate_tokens() verifies signatures in by default; created the first time it is needed.
+bulk_validation_executor = LazyObject(_get_bulk_validation_executor)
+
+
+@functools.lru_cache(maxsize=64)
+def _load_rs256_key(pem):
+    return _rs256.prepare_key(pem)
+
+
+def _verify_signatures(public_keys, items):
+    """
+    Returns, for each (tenant_id, signing_input, signature) tuple in `items`, whether the signature is valid for the
+    tenant's key in `public_keys`: key objects or, in a process pool where key objects cannot be sent, PEM strings.
+    """
+    keys = {tenant_id: _load_rs256_key(key) if isinstance(key, str) else key for tenant_id, key in public_keys.items()}
+    return [_rs256.verify(signing_input, keys[tenant_id], signature) for tenant_id, signing_input, signature in items]
+
+
+def _verify_token_batch(pending, tenant_cache, executor):
+    """
+    Verifies the signatures of the tokens in `pending`, a dictionary of token -> (decoded, tenant_id, public_key_str),
+    in chunks of BULK_VALIDATION_CHUNK_SIZE tokens, sorted by tenant. Returns a dictionary of token -> the PEM the
+    token's signature was verified with, or None if it was not.
+    """
+    verified = {}
+    # tenant_id -> (PEM, key object), from the same version of the registry.
+    key_entries = {}
+    tokens = []
+    for token, (decoded, token_tenant_id, public_key_str) in pending.items():
+        if token_tenant_id not in key_entries:
+            key_entries[token_tenant_id] = tenant_cache.get_public_key_entry(token_tenant_id)
+        if key_entries[token_tenant_id][1] is None:
+            verified[token] = None
+        else:
+            tokens.append(token)
+    if not tokens:
+        return verified
+    tokens.sort(key=lambda token: pending[token][1])
+    chunks = [tokens[i:i + BULK_VALIDATION_CHUNK_SIZE] for i in range(0, len(tokens), BULK_VALIDATION_CHUNK_SIZE)]
+    if len(chunks) == 1:
+        executor = None
+    elif executor is None:
+        executor = bulk_validation_executor
+    if isinstance(executor, ProcessPoolExecutor):
+        # key objects cannot be sent to another process; send the PEMs the tokens carry, for their tenants only.
+        public_keys = {pending[token][1]: pending[token][2] for token in tokens}
+        key_strs = public_keys
+    else:
+        public_keys = {token_tenant_id: key for token_tenant_id, (_, key) in key_entries.items()}
+        key_strs = {token_tenant_id: pem for token_tenant_id, (pem, _) in key_entries.items()}
+    results = []
+    for chunk in chunks:
+        items = [(pending[token][1], pending[token][0].signing_input, pending[token][0].signature) for token in chunk]
+        chunk_keys = {token_tenant_id: public_keys[token_tenant_id] for token_tenant_id, _, _ in items}
+        if executor is None:
+            results.append((chunk, _verify_signatures(chunk_keys, items)))
+        else:
+            results.append((chunk, executor.submit(_verify_signatures, chunk_keys, items)))
+    for chunk, result in results:
+        if not isinstance(result, list):
+            try:
+                result = result.result()
+            except Exception as e:
+                logger.error(f"Got exception verifying token signatures; exception: {e}")
+                result = [False] * len(chunk)
+        for token, valid in zip(chunk, result):
+            verified[token] = key_strs[pending[token][1]] if valid else None
+    return verified
+
+
+def validate_tokens(tokens, tenant_cache=tenant_cache, expected_aud=[], token_cache=token_cache, executor=None):
+    """
+    Validates a batch of Tapis tokens, e.g., from bulk job callbacks, queued OBO requests or audit replays.
+    :param tokens: The tokens to validate
+    :param tenant_cache: The service's tenant_cache object with tenant configs; Should be an instance of TenantCache.
+    :param expected_aud: The expected audience of the tokens; see validate_token().
+    :param token_cache: The TokenCache of already verified tokens to consult; pass None to always do the full decode.
+    :param executor: The concurrent.futures executor to verify the signatures in; defaults to
+    bulk_validation_executor, a pool of tapisservice_bulk_token_validation_workers threads (or processes, with
+    tapisservice_bulk_token_validation_processes).
+    :return: A list with, for each token and in the same order, either its claims or the errors.BaseTapisError
+    validate_token() would have raised for it.
+
+    Identical tokens are validated once, and tokens in the token_cache are answered from it. The others go through the
+    same checks as in validate_token() in the calling thread, and only then are their signatures verified, in chunks of
+    BULK_VALIDATION_CHUNK_SIZE tokens, in the executor; a batch that fits in one chunk is verified inline.
+    """
+    results = {}
+    pending = {}
+    for token in dict.fromkeys(tokens):
+        if not token:
+            results[token] = errors.NoTokenError("No Tapis access token found in the request.")
+            continue
+        if token_cache is not None:
+            claims = token_cache.get(token, tenant_cache, expected_aud)
+            if claims is not None:
+                results[token] = claims
+                continue
+        outcome, result = _check_token(token, tenant_cache, expected_aud)
+        if outcome:
+            results[token] = result
+        else:
+            pending[token] = result
+    verified = _verify_token_batch(pending, tenant_cache, executor)
+    if not all(verified.values()) and \
+            datetime.datetime.now() > tenant_cache.last_tenants_cache_update + tenant_cache.update_tenant_cache_timedelta:
+        # as in validate_token(), a tenant's public key could have changed; reload once and retry the failures.
+        tenant_cache.reload_tenants()
+        # the retry must use the reloaded keys, so refresh the PEM each failed token carries.
+        failed = {}
+        for token, valid in verified.items():
+            if not valid:
+                decoded, token_tenant_id, public_key_str = pending[token]
+                public_key_str = getattr(tenant_cache.tenants.get(token_tenant_id), 'public_key', public_key_str)
+                failed[token] = (decoded, token_tenant_id, public_key_str)
+        verified.update(_verify_token_batch(failed, tenant_cache, executor))
+    for token, (decoded, token_tenant_id, public_key_str) in pending.items():
+        if not verified[token]:
+            logger.debug("token signature verification failed", tenant_id=token_tenant_id)
+            results[token] = errors.AuthenticationError("Invalid Tapis token.")
+            continue
+        if token_cache is not None:
+            # record the PEM the token was actually verified with.
+            token_cache.put(token, decoded.claims, token_tenant_id, verified[token], expected_aud)
+        results[token] = decoded.claims
+    return [results[token] for token in tokens]
+
+
+def _observe_token_validation(start, outcome):
+    """
+    Records the duration of a validate_token call; `start` is None when metrics are disabled.
+    """
+    if start is not None:
+        token_validation_seconds.labels(outcome).observe(time.perf_counter() - start)
+
+
 def get_pub_rsa_key(pub_key):
     """
     Return the RSA public key object associated with the string `pub_key`.
     :param pub_key:
     :return:
     """
+    from Crypto.PublicKey import RSA
     return RSA.importKey(pub_key)
 
 def service_token_checks(request_thread_local, claims, tenant_cache):
@@ -574,7 +1492,7 @@ def service_token_checks(request_thread_local, claims, tenant_cache):
     This function does additional checks when a service token is used to make a Tapis request.
 
     """
-    logger.debug(f"top of service_token_checks; claims: {claims}")
+    logger.debug("top of service_token_checks", claims=claims)
     # first check that the target_site claim in the token matches this service's site_id --
     target_site_id = claims.get('tapis/target_site')
     try:
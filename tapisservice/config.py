@@ -3,49 +3,106 @@ Validates service configuration based on jsonschema for any Tapis flask API. The
 configschema.json, in this repo, but services can update or override the schema definition with
 
 """
+import functools
+import hashlib
 import json
-import jsonschema
 import os
 import re
+import tempfile
+import threading
+import time
 
 from tapisservice.errors import BaseTapisError
 
 HERE = os.path.dirname(os.path.abspath(__file__))
 
-# load the base api schema -
-schema = json.load(open(os.path.join(HERE, 'configschema.json'), 'r'))
 
-# try to load an api-specific schema
-service_configschema_path = os.environ.get('TAPIS_CONFIGSCHEMA_PATH', '/home/tapis/configschema.json')
-try:
-    api_schema = json.load(open(service_configschema_path, 'r'))
-except Exception as e:
-    # at this point, logging is not set up yet, so we just print the message to the screen and hope for the best:
-    msg = f'ERROR, improperly configured service. Could not load configschema.json found; ' \
-          f'looked in {service_configschema_path}. Aborting. Exception: {e}'
-    print(msg)
-    raise BaseTapisError(msg)
+# bump when the way configs are validated or cached changes, so that existing cache entries are no longer used.
+CONFIG_CACHE_FORMAT_VERSION = 1
 
-# ----- Combine the service config schema with the base config schema -----
-# In what follows, we take a manual approach, but instead we could also have the service schema use the allOf
-# feature to pull in the base schema; cf., https://github.com/json-schema-org/json-schema-spec/issues/348
-# The downside with that would be that it is up to each service to include the base schema properly.
+# the pattern of the $env{NAME} placeholders in the config file.
+ENV_VARIABLE_PATTERN = re.compile(r'\$env\{(.*?)\}')
 
-# 1) we override properties defined in the base schema with properties defined in the service schema
-api_properties = api_schema.get('properties')
-if api_properties and type(api_properties) == dict:
-    schema['properties'].update(api_properties)
+# how long each step of the last Config.load_config() call took, in seconds, and whether the config cache was used
+# ('hit', 'miss' or 'disabled'); see Config.load_config().
+load_timings = {}
 
-# 2) we extend the required properties with those specified as required by the API -
-api_required = api_schema.get('required')
-if api_required and type(api_required) == list:
-    schema['required'].extend(api_required)
+
+@functools.lru_cache(maxsize=None)
+def load_schema_and_digest():
+    """
+    Returns the config schema: the base schema, configschema.json in this repo, combined with the service's schema
+    found at TAPIS_CONFIGSCHEMA_PATH, together with a sha256 digest of the two schema files.
+    """
+    digest = hashlib.sha256()
+    # load the base api schema -
+    with open(os.path.join(HERE, 'configschema.json'), 'rb') as f:
+        schema_raw = f.read()
+    digest.update(schema_raw)
+    schema = json.loads(schema_raw)
+
+    # try to load an api-specific schema
+    service_configschema_path = os.environ.get('TAPIS_CONFIGSCHEMA_PATH', '/home/tapis/configschema.json')
+    try:
+        with open(service_configschema_path, 'rb') as f:
+            api_schema_raw = f.read()
+        api_schema = json.loads(api_schema_raw)
+    except Exception as e:
+        # at this point, logging is not set up yet, so we just print the message to the screen and hope for the best:
+        msg = f'ERROR, improperly configured service. Could not load configschema.json found; ' \
+              f'looked in {service_configschema_path}. Aborting. Exception: {e}'
+        print(msg)
+        raise BaseTapisError(msg)
+    digest.update(api_schema_raw)
+
+    # ----- Combine the service config schema with the base config schema -----
+    # In what follows, we take a manual approach, but instead we could also have the service schema use the allOf
+    # feature to pull in the base schema; cf., https://github.com/json-schema-org/json-schema-spec/issues/348
+    # The downside with that would be that it is up to each service to include the base schema properly.
+
+    # 1) we override properties defined in the base schema with properties defined in the service schema
+    api_properties = api_schema.get('properties')
+    if api_properties and type(api_properties) == dict:
+        schema['properties'].update(api_properties)
+
+    # 2) we extend the required properties with those specified as required by the API -
+    api_required = api_schema.get('required')
+    if api_required and type(api_required) == list:
+        schema['required'].extend(api_required)
+    return schema, digest.hexdigest()
+
+
+def load_schema():
+    """
+    Returns the config schema; see load_schema_and_digest().
+    """
+    return load_schema_and_digest()[0]
+
+
+def get_schema_property_names(schema):
+    """
+    Returns the names of all properties defined anywhere in `schema`. Validation fills in string properties missing
+    from the config from environment variables of the same name, so these are the variables a config depends on.
+    """
+    names = set()
+    stack = [schema]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, dict):
+            properties = node.get('properties')
+            if isinstance(properties, dict):
+                names.update(properties)
+            stack.extend(node.values())
+        elif isinstance(node, list):
+            stack.extend(node)
+    return names
 
 
 # extend the default jsonschema validator to supply/modify the instance with default values supplied in the
 # schema definition. very surprising that this is not the default behavior;
 # see: https://python-jsonschema.readthedocs.io/en/stable/faq/
 def extend_with_default(validator_class):
+    import jsonschema
     validate_properties = validator_class.VALIDATORS["properties"]
 
     def set_defaults(validator, properties, instance, schema):
@@ -71,7 +128,99 @@ def extend_with_default(validator_class):
     )
 
 
-DefaultValidatingDraft7Validator = extend_with_default(jsonschema.Draft7Validator)
+@functools.lru_cache(maxsize=None)
+def get_default_validating_validator():
+    """
+    Returns the Draft7Validator class extended to fill in defaults. jsonschema is only imported when a config is
+    actually validated.
+    """
+    import jsonschema
+    return extend_with_default(jsonschema.Draft7Validator)
+
+
+@functools.lru_cache(maxsize=None)
+def get_validator(schema_digest):
+    """
+    Returns the validator for the schema with digest `schema_digest`, built once per process.
+    """
+    schema, digest = load_schema_and_digest()
+    if not digest == schema_digest:
+        raise BaseTapisError(f"No config schema with digest {schema_digest} has been loaded.")
+    return get_default_validating_validator()(schema)
+
+
+def get_config_digest(config_path, config_txt, schema_digest):
+    """
+    Returns a sha256 digest of everything the validated config depends on: the schemas, the config file and the
+    environment variables it reads (those named in $env{} placeholders and those named like a schema property).
+    """
+    names = set(ENV_VARIABLE_PATTERN.findall(config_txt)) | get_schema_property_names(load_schema())
+    key = {'format_version': CONFIG_CACHE_FORMAT_VERSION,
+           'schema': schema_digest,
+           'config_path': config_path,
+           'config': hashlib.sha256(config_txt.encode()).hexdigest(),
+           'environment': {name: os.environ[name] for name in sorted(names) if name in os.environ}}
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+def get_config_cache_path(digest):
+    """
+    Returns the path of the cached validated config for `digest` in the TAPIS_CONFIG_CACHE_DIR directory, or None if
+    the cache is not enabled.
+    """
+    cache_dir = os.environ.get('TAPIS_CONFIG_CACHE_DIR')
+    if not cache_dir:
+        return None
+    return os.path.join(cache_dir, f'config-{digest}.json')
+
+
+def read_cached_config(path, digest):
+    """
+    Returns the validated config cached at `path`, or None if there is no usable entry.
+    """
+    try:
+        with open(path, 'r') as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(entry, dict) or not entry.get('format_version') == CONFIG_CACHE_FORMAT_VERSION \
+            or not entry.get('digest') == digest or not isinstance(entry.get('config'), dict):
+        return None
+    return entry['config']
+
+
+def write_cached_config(path, digest, config):
+    """
+    Atomically writes the validated `config` to `path`, readable by the owner only since the config contains
+    secrets. Returns True on success; failures are not fatal, the next process just validates again.
+    """
+    cache_dir = os.path.dirname(path)
+    tmp_path = None
+    try:
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, prefix='.config-', suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'format_version': CONFIG_CACHE_FORMAT_VERSION, 'digest': digest, 'config': config}, f)
+        os.replace(tmp_path, path)
+        return True
+    except OSError as e:
+        print(f'Could not write the config cache at {path}; exception: {e}')
+        if tmp_path:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+        return False
+
+
+def __getattr__(name):
+    # the schema and the validator used to be built when this module was imported; keep them available as module
+    # attributes, now built on first use.
+    if name == 'schema':
+        return load_schema()
+    if name == 'DefaultValidatingDraft7Validator':
+        return get_default_validating_validator()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def match_and_replace_env_variables(txt_to_match: str) -> str:
@@ -81,8 +230,7 @@ def match_and_replace_env_variables(txt_to_match: str) -> str:
     it is then subbed into the text allow users to substitute environment variables directly into
     their configs.
     """
-    environ_regex_pattern = re.compile(r'\$env\{(.*?)\}')
-    pattern_matches = environ_regex_pattern.findall(txt_to_match)
+    pattern_matches = ENV_VARIABLE_PATTERN.findall(txt_to_match)
     for matched_var in pattern_matches:
         if os.environ.get(matched_var):
             txt_to_match = txt_to_match.replace(f"$env{{{matched_var}}}", os.environ.get(matched_var))
@@ -115,39 +263,143 @@ class Config(dict):
         self[key] = value
 
     @classmethod
-    def get_config_from_file(self):
+    def get_config_path(cls):
+        return os.environ.get('TAPIS_CONFIG_PATH', '/home/tapis/config.json')
+
+    @classmethod
+    def read_config_file(cls, path):
         """
-        Reads service config from a JSON file
-        :return:
+        Returns the text of the service config file at `path`, or None if there is no such file.
         """
-        path = os.environ.get('TAPIS_CONFIG_PATH', '/home/tapis/config.json')
         if os.path.exists(path):
             try:
                 with open(path, 'r') as config_raw:
-                    config_txt = config_raw.read()
-                    config_with_env = match_and_replace_env_variables(config_txt)
-                return json.loads(config_with_env)
+                    return config_raw.read()
             except Exception as e:
                 msg = f'Could not load configs from JSON file at: {path}. exception: {e}'
                 print(msg)
                 raise BaseTapisError(msg)
 
+    @classmethod
+    def parse_config(cls, path, config_txt):
+        """
+        Substitutes the $env{} placeholders in the service config text and parses it.
+        """
+        try:
+            config_with_env = match_and_replace_env_variables(config_txt)
+            return json.loads(config_with_env)
+        except Exception as e:
+            msg = f'Could not load configs from JSON file at: {path}. exception: {e}'
+            print(msg)
+            raise BaseTapisError(msg)
+
+    @classmethod
+    def get_config_from_file(cls):
+        """
+        Reads service config from a JSON file
+        :return:
+        """
+        path = cls.get_config_path()
+        config_txt = cls.read_config_file(path)
+        if config_txt is not None:
+            return cls.parse_config(path, config_txt)
+
     @classmethod
     def load_config(cls):
         """
         Load the config from various places, including a JSON file and environment variables.
+
+        When TAPIS_CONFIG_CACHE_DIR is set, the validated config is cached there, keyed by a digest of the schemas,
+        the config file and the environment variables the config depends on (see get_config_digest()), so that
+        processes started with the same inputs, e.g., gunicorn workers, skip parsing and validation altogether. The
+        time spent in each step is recorded in load_timings.
         :return:
         """
-        file_config = cls.get_config_from_file()
+        timings = {'cache': 'disabled'}
+        clock = time.perf_counter
+        start = last = clock()
+
+        def mark(step):
+            nonlocal last
+            now = clock()
+            timings[step] = now - last
+            last = now
+
+        schema_digest = load_schema_and_digest()[1]
+        mark('schema')
+        path = cls.get_config_path()
+        config_txt = cls.read_config_file(path)
+        mark('read_config')
+        cache_path = digest = None
+        if config_txt is not None and os.environ.get('TAPIS_CONFIG_CACHE_DIR'):
+            digest = get_config_digest(path, config_txt, schema_digest)
+            cache_path = get_config_cache_path(digest)
+            mark('digest')
+        if cache_path:
+            file_config = read_cached_config(cache_path, digest)
+            mark('cache_read')
+            if file_config is not None:
+                timings['cache'] = 'hit'
+                timings['total'] = clock() - start
+                load_timings.clear()
+                load_timings.update(timings)
+                return file_config
+            timings['cache'] = 'miss'
+        file_config = cls.parse_config(path, config_txt) if config_txt is not None else None
+        mark('parse_config')
+        import jsonschema
+        mark('import_jsonschema')
+        validator = get_validator(schema_digest)
+        mark('build_validator')
         # validate config against schema definition
         try:
             # jsonschema.validate(instance=file_config, schema=schema)
-            DefaultValidatingDraft7Validator(schema).validate(file_config)
+            validator.validate(file_config)
         except jsonschema.SchemaError as e:
             msg = f'Invalid service config: exception: {e}'
             print(msg)
             raise BaseTapisError(msg)
+        mark('validate')
+        if cache_path:
+            write_cached_config(cache_path, digest, file_config)
+            mark('cache_write')
+        timings['total'] = clock() - start
+        load_timings.clear()
+        load_timings.update(timings)
         return file_config
 
 
-conf = Config(Config.load_config())
\ No newline at end of file
+def _load_before(name):
+    def method(self, *args, **kwargs):
+        self._load()
+        return getattr(self, name)(*args, **kwargs)
+    method.__name__ = name
+    return method
+
+
+class LazyConfig(Config):
+    """
+    A Config that is loaded and validated the first time it is used rather than when it is created. Once loaded, the
+    object turns itself into a plain Config, so that later accesses cost no more than they would on a Config.
+    """
+    _load_lock = threading.Lock()
+
+    def _load(self):
+        with LazyConfig._load_lock:
+            if type(self) is LazyConfig:
+                dict.update(self, self.load_config())
+                # Config.__setattr__ sets items, so set the class with object's.
+                object.__setattr__(self, '__class__', Config)
+
+    def __getattr__(self, key):
+        self._load()
+        return getattr(self, key)
+
+
+for _name in ('__getitem__', '__setitem__', '__delitem__', '__contains__', '__iter__', '__len__', '__eq__', '__ne__',
+              '__repr__', 'get', 'keys', 'values', 'items', 'copy', 'pop', 'popitem', 'setdefault', 'update'):
+    setattr(LazyConfig, _name, _load_before(_name))
+
+
+# the config is loaded and validated the first time conf is used rather than when this module is imported.
+conf = LazyConfig()
\ No newline at end of file
@@ -28,6 +28,16 @@ class AuthenticationError(BaseTapisError):
     pass
 
 
+class ServiceTokenError(BaseTapisError):
+    """Error generating service tokens for one or more tenants."""
+    def __init__(self, msg=None, code=400, failures=None):
+        """
+        :param failures: (dict) The error message for each tenant_id whose tokens could not be generated.
+        """
+        super().__init__(msg, code)
+        self.failures = failures or {}
+
+
 class PermissionsError(BaseTapisError):
     """Error checking permissions or insufficient permissions needed to perform the action."""
     pass
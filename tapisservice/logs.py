@@ -42,3 +42,102 @@ def get_logger(name: str) -> logging.Logger:
         logger.addHandler(handler)
     logger.info("returning a logger set to level: {} for module: {}".format(level, name))
     return logger
+
+
+def format_fields(fields):
+    """
+    Format structured logging fields as space separated key=value pairs. Callable values are called first, so
+    expensive values can be passed as lambdas and are only computed when the message is actually emitted.
+    """
+    parts = []
+    for key, value in fields.items():
+        if callable(value):
+            value = value()
+        if isinstance(value, str) and value and not any(c.isspace() or c in '"=' for c in value):
+            parts.append(f"{key}={value}")
+        else:
+            parts.append(f"{key}={value!r}")
+    return ' '.join(parts)
+
+
+class LazyLogger(object):
+    """
+    Logging facade for hot paths. The underlying logger is created on first use and its level, from
+    get_module_log_level(), is cached, so a call below the module's level costs a single integer comparison: the
+    message is not formatted and callable field values are never called. Use as follows:
+
+    logger = get_lazy_logger(__name__)
+    logger.debug("found tenant", tenant_id=tenant_id, tenants=lambda: list(self.tenants.keys()))
+
+    which emits `found tenant tenant_id=dev tenants=['admin', 'dev']` when the module logs at DEBUG.
+    """
+    def __init__(self, name: str):
+        self.name = name
+        self._logger = None
+        self._level = None
+
+    @property
+    def logger(self) -> logging.Logger:
+        if self._logger is None:
+            self._logger = get_logger(self.name)
+            self._level = self._logger.getEffectiveLevel()
+        return self._logger
+
+    @property
+    def level(self) -> int:
+        if self._level is None:
+            self.logger
+        return self._level
+
+    def setLevel(self, level):
+        self.logger.setLevel(level)
+        self._level = self._logger.getEffectiveLevel()
+
+    def isEnabledFor(self, level: int) -> bool:
+        return level >= self.level
+
+    def _log(self, level: int, msg, args, fields, exc_info=None):
+        if level < self.level:
+            return
+        if args:
+            msg = msg % args
+        if fields:
+            msg = f"{msg} {format_fields(fields)}"
+        # stacklevel points the [in pathname:lineno] of the log record at our caller rather than at this class.
+        self._logger.log(level, msg, exc_info=exc_info, stacklevel=3)
+
+    def log(self, level: int, msg, *args, **fields):
+        self._log(level, msg, args, fields)
+
+    def debug(self, msg, *args, **fields):
+        self._log(logging.DEBUG, msg, args, fields)
+
+    def info(self, msg, *args, **fields):
+        self._log(logging.INFO, msg, args, fields)
+
+    def warning(self, msg, *args, **fields):
+        self._log(logging.WARNING, msg, args, fields)
+
+    warn = warning
+
+    def error(self, msg, *args, **fields):
+        self._log(logging.ERROR, msg, args, fields)
+
+    def exception(self, msg, *args, **fields):
+        self._log(logging.ERROR, msg, args, fields, exc_info=True)
+
+    def critical(self, msg, *args, **fields):
+        self._log(logging.CRITICAL, msg, args, fields)
+
+    def __getattr__(self, item):
+        # anything else (handlers, addHandler, ...) goes to the underlying logger.
+        if item.startswith('_') or item in ('logger', 'level'):
+            raise AttributeError(item)
+        return getattr(self.logger, item)
+
+
+def get_lazy_logger(name: str) -> LazyLogger:
+    """
+    Returns a LazyLogger for the module `name`; see LazyLogger.
+    """
+    return LazyLogger(name)
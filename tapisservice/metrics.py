@@ -0,0 +1,287 @@
+"""
+A small, dependency free metrics registry for the library's internals (token validation, the tenant cache and the
+service tokens), exportable in the Prometheus text exposition format.
+
+Metrics are only recorded when the tapisservice_metrics_enabled config is true. Call sites check `registry.enabled`
+before doing any work (including reading the clock), so when metrics are disabled the hot paths pay for a single
+attribute lookup. Use as follows:
+
+from tapisservice import metrics
+lookups = metrics.registry.counter('tapisservice_tenant_cache_lookups_total', 'Tenant lookups.', ['result'])
+...
+if metrics.registry.enabled:
+    lookups.labels(result='hit').inc()
+
+Expose registry.render() from an endpoint; see tapisflask.resources.MetricsResource and
+tapisfastapi.resources.metrics.
+"""
+import abc
+import bisect
+import functools
+import math
+import threading
+
+from tapisservice.config import conf
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# default histogram buckets, in seconds; spans a cached token validation (microseconds) to a Tenants API call.
+DEFAULT_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_value(value):
+    if value is None:
+        return 'NaN'
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, float):
+        if math.isinf(value):
+            return '+Inf' if value > 0 else '-Inf'
+        return repr(value)
+    return str(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labelnames, labelvalues, extra=None):
+    pairs = list(zip(labelnames, labelvalues))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class Metric(abc.ABC):
+    """
+    Base class for the metric types. A metric has a fixed list of label names; labels() returns the child for one
+    combination of label values, and a metric with no labels is its own child.
+    """
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children = {}
+
+    def labels(self, *labelvalues, **labelkwargs):
+        if labelkwargs:
+            labelvalues = tuple(labelkwargs[name] for name in self.labelnames)
+        child = self._children.get(labelvalues)
+        if child is None:
+            if not len(labelvalues) == len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}; got {labelvalues}.")
+            with self._lock:
+                child = self._children.setdefault(labelvalues, self._new_child())
+        return child
+
+    @abc.abstractmethod
+    def _new_child(self):
+        """
+        Returns a new child, holding the value(s) of one combination of label values.
+        """
+
+    def _sorted_children(self):
+        with self._lock:
+            return sorted(self._children.items())
+
+    @abc.abstractmethod
+    def samples(self):
+        """
+        Returns a list of (suffix, labels, value) tuples where labels is the formatted label string.
+        """
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        for suffix, labels, value in self.samples():
+            lines.append(f'{self.name}{suffix}{labels} {_format_value(value)}')
+        return '\n'.join(lines)
+
+
+class _Value(object):
+    __slots__ = ('value', '_lock')
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+
+class Counter(Metric):
+    """
+    A monotonically increasing count, e.g., the number of tenant cache misses.
+    """
+    type = 'counter'
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def samples(self):
+        return [('', _format_labels(self.labelnames, labelvalues), child.value)
+                for labelvalues, child in self._sorted_children()]
+
+
+class Gauge(Counter):
+    """
+    A value that can go up and down. A gauge created with a callback is computed when the registry is rendered: the
+    callback returns either a number or a dictionary mapping tuples of label values to numbers.
+    """
+    type = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def dec(self, amount=1):
+        self.labels().dec(amount)
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def samples(self):
+        if not self.callback:
+            return super().samples()
+        try:
+            values = self.callback()
+        except Exception:
+            # a broken callback should not take the rest of the metrics down with it.
+            return []
+        if values is None:
+            return []
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [('', _format_labels(self.labelnames, labelvalues), value)
+                for labelvalues, value in sorted(values.items())]
+
+
+class CallbackCounter(Gauge):
+    """
+    A counter whose value is read from a callback when the registry is rendered, for exporting counts the library
+    already keeps, e.g., TenantCache.reload_stats.
+    """
+    type = 'counter'
+
+
+class _HistogramValue(object):
+    __slots__ = ('upper_bounds', 'bucket_counts', 'sum', 'count', '_lock')
+
+    def __init__(self, upper_bounds):
+        self.upper_bounds = upper_bounds
+        self.bucket_counts = [0] * (len(upper_bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.upper_bounds, value)
+        with self._lock:
+            self.bucket_counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+
+class Histogram(Metric):
+    """
+    Counts observations, e.g., latencies in seconds, in cumulative buckets.
+    """
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.upper_bounds = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramValue(self.upper_bounds)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def samples(self):
+        samples = []
+        for labelvalues, child in self._sorted_children():
+            cumulative = 0
+            for upper_bound, count in zip(self.upper_bounds + (math.inf,), child.bucket_counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, labelvalues, ('le', _format_value(float(upper_bound))))
+                samples.append(('_bucket', labels, cumulative))
+            labels = _format_labels(self.labelnames, labelvalues)
+            samples.append(('_sum', labels, child.sum))
+            samples.append(('_count', labels, child.count))
+        return samples
+
+
+class MetricsRegistry(object):
+    """
+    Holds the library's metrics. Creating a metric that already exists returns the existing one, so modules can
+    declare their metrics at import time. When `enabled` is not passed, it is read from the
+    tapisservice_metrics_enabled config the first time it is checked.
+    """
+    def __init__(self, enabled=None):
+        if enabled is not None:
+            self.enabled = enabled
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    @functools.cached_property
+    def enabled(self):
+        return conf.get('tapisservice_metrics_enabled', False)
+
+    def _get_or_create(self, cls, name, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = cls(name, *args, **kwargs)
+                self._metrics[name] = metric
+            elif not type(metric) == cls:
+                raise ValueError(f"metric {name} is already registered as a {metric.type}.")
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=(), callback=None):
+        return self._get_or_create(Gauge, name, documentation, labelnames, callback=callback)
+
+    def callback_counter(self, name, documentation, labelnames=(), callback=None):
+        return self._get_or_create(CallbackCounter, name, documentation, labelnames, callback=callback)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def clear(self):
+        """
+        Resets the values of all metrics; the metrics themselves stay registered.
+        """
+        for metric in list(self._metrics.values()):
+            with metric._lock:
+                metric._children = {}
+
+    def render(self):
+        """
+        Returns all metrics in the Prometheus text exposition format.
+        """
+        return '\n'.join(metric.render() for metric in list(self._metrics.values())) + '\n'
+
+
+registry = MetricsRegistry()
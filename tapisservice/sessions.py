@@ -0,0 +1,176 @@
+"""
+Per-site keep-alive connection pools for the requests.Session of service clients.
+
+preprocess_service_request() rewrites each outgoing request to the base URL of the site that should handle it. The
+first time a client sends to a base URL, use_site_pool() mounts the SitePoolAdapter of that site on the client's
+requests_session for it, so all of a site's hosts share one adapter with configurable pool sizes, and connections to
+each host are kept alive and reused across requests.
+
+This module imports requests, so it is only imported once a tapipy client exists.
+"""
+import collections
+import queue
+import threading
+import time
+
+from requests.adapters import HTTPAdapter
+from urllib3 import HTTPConnectionPool, HTTPSConnectionPool
+
+from tapisservice.config import conf
+
+
+class SitePoolAdapter(HTTPAdapter):
+    """
+    HTTPAdapter for the requests to one site. Keeps a pool of up to pool_maxsize keep-alive connections for each of
+    up to pool_connections hosts of the site and records pool utilization and the time spent waiting for a connection.
+    With pool_block=True, requests wait for a free connection instead of opening (and then discarding) extra ones.
+    """
+    def __init__(self, site_id, pool_connections=10, pool_maxsize=10, pool_block=False, **kwargs):
+        self.site_id = site_id
+        self._stats_lock = threading.Lock()
+        self.requests = 0
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.connection_waits = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        super().__init__(pool_connections=pool_connections, pool_maxsize=pool_maxsize, pool_block=pool_block, **kwargs)
+
+    def _record_wait(self, seconds):
+        with self._stats_lock:
+            self.connection_waits += 1
+            self.wait_seconds_total += seconds
+            if seconds > self.wait_seconds_max:
+                self.wait_seconds_max = seconds
+
+    def _pool_classes(self):
+        """
+        Returns the urllib3 pool classes, by scheme, for the pools of this adapter. They use the pool's public QueueCls
+        hook to hold their idle connections in a queue that times how long each checkout waits for a connection.
+        """
+        adapter = self
+
+        class TimedQueue(queue.LifoQueue):
+            # the pool the queue belongs to; once the pool is closed, the gets that drain it are not checkouts.
+            owner = None
+
+            def get(self, block=True, timeout=None):
+                start = time.perf_counter()
+                try:
+                    return super().get(block=block, timeout=timeout)
+                finally:
+                    if self.owner is not None and self.owner.pool is self:
+                        adapter._record_wait(time.perf_counter() - start)
+
+        class TimedPoolMixin(object):
+            QueueCls = TimedQueue
+
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                self.pool.owner = self
+
+        class SiteHTTPConnectionPool(TimedPoolMixin, HTTPConnectionPool):
+            pass
+
+        class SiteHTTPSConnectionPool(TimedPoolMixin, HTTPSConnectionPool):
+            pass
+
+        return {'http': SiteHTTPConnectionPool, 'https': SiteHTTPSConnectionPool}
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.pool_classes_by_scheme = self._pool_classes()
+        self.poolmanager.pool_classes_by_scheme = self.pool_classes_by_scheme
+
+    def proxy_manager_for(self, proxy, **proxy_kwargs):
+        if proxy in self.proxy_manager:
+            return self.proxy_manager[proxy]
+        manager = super().proxy_manager_for(proxy, **proxy_kwargs)
+        manager.pool_classes_by_scheme = self.pool_classes_by_scheme
+        return manager
+
+    def send(self, request, *args, **kwargs):
+        with self._stats_lock:
+            self.requests += 1
+            self.in_use += 1
+            if self.in_use > self.peak_in_use:
+                self.peak_in_use = self.in_use
+        try:
+            return super().send(request, *args, **kwargs)
+        finally:
+            with self._stats_lock:
+                self.in_use -= 1
+
+    def get_stats(self):
+        """
+        Returns a dictionary of the pool statistics of this site: the number of hosts with a pool, the connections
+        opened so far, the requests in flight (and the peak) and their share of the pool capacity, and the number of
+        connection checkouts with the total and longest time spent waiting for one.
+        """
+        pools = [self.poolmanager.pools.get(key) for key in self.poolmanager.pools.keys()]
+        pools = [pool for pool in pools if pool is not None]
+        capacity = self._pool_maxsize * max(len(pools), 1)
+        with self._stats_lock:
+            return {'site_id': self.site_id,
+                    'pool_connections': self._pool_connections,
+                    'pool_maxsize': self._pool_maxsize,
+                    'pool_block': self._pool_block,
+                    'hosts': len(pools),
+                    'connections_opened': sum(getattr(pool, 'num_connections', 0) for pool in pools),
+                    'requests': self.requests,
+                    'in_use': self.in_use,
+                    'peak_in_use': self.peak_in_use,
+                    'utilization': self.in_use / capacity,
+                    'connection_waits': self.connection_waits,
+                    'wait_seconds_total': self.wait_seconds_total,
+                    'wait_seconds_max': self.wait_seconds_max}
+
+
+# guards the creation of the site adapters and the mounting of base URLs on the clients' sessions.
+_site_pools_guard = threading.Lock()
+
+
+def get_site_pool_adapter(client, site_id):
+    """
+    Returns the SitePoolAdapter for `site_id` on `client`, creating it with the configured pool sizes.
+    """
+    adapters = client.site_pool_adapters
+    adapter = adapters.get(site_id)
+    if adapter is None:
+        with _site_pools_guard:
+            adapter = adapters.get(site_id)
+            if adapter is None:
+                adapter = SitePoolAdapter(site_id,
+                                          pool_connections=conf.get('tapisservice_site_pool_connections', 10),
+                                          pool_maxsize=conf.get('tapisservice_site_pool_maxsize', 10),
+                                          pool_block=conf.get('tapisservice_site_pool_block', False))
+                adapters[site_id] = adapter
+    return adapter
+
+
+def use_site_pool(client, site_id, base_url):
+    """
+    Makes the requests `client` sends to `base_url` use the connection pools of `site_id`. Cheap once the base URL has
+    been mounted, so it can be called for every outgoing request.
+    """
+    prefix = base_url.rstrip('/') + '/'
+    session = client.requests_session
+    if prefix in session.adapters:
+        return
+    adapter = get_site_pool_adapter(client, site_id)
+    with _site_pools_guard:
+        if prefix in session.adapters:
+            return
+        # same as session.mount(), but on a copy: other threads may be iterating over the adapters to send requests.
+        adapters = collections.OrderedDict(session.adapters)
+        adapters[prefix] = adapter
+        for key in [k for k in adapters if len(k) < len(prefix)]:
+            adapters[key] = adapters.pop(key)
+        session.adapters = adapters
+
+
+def get_site_pool_stats(client):
+    """
+    Returns {site_id: stats} with the SitePoolAdapter.get_stats() of each site `client` has sent requests to.
+    """
+    return {site_id: adapter.get_stats() for site_id, adapter in list(client.site_pool_adapters.items())}
@@ -0,0 +1,213 @@
+"""
+Node-local state shared by the worker processes of a service, e.g., the gunicorn or uvicorn workers of one pod.
+
+A SharedSnapshot is a versioned value published by one process and read by the others through a memory map. Its
+path is a small control file holding the generation of the latest version, which every process maps and compares
+against the generation it last loaded; that check reads a few bytes of shared memory and makes no system call. Each
+version is written to its own data file next to the control file (path.<generation>), which readers map and unpickle
+in place. Publishing is serialized across processes with an flock on path.lock, and SharedSnapshot.acquire_ownership()
+elects a single owner among the processes (path.owner), which is released when the owner exits.
+
+Put the files on a tmpfs such as /dev/shm so the shared pages never go to disk. They are created readable by the owner
+only, and files owned by another user are never read, as the data files are unpickled.
+
+This module uses fcntl, so it is only imported when a shared mode is configured.
+"""
+import contextlib
+import fcntl
+import mmap
+import os
+import pickle
+import struct
+import tempfile
+import threading
+import time
+
+from tapisservice.logs import get_lazy_logger
+logger = get_lazy_logger(__name__)
+
+
+SHARED_FORMAT_VERSION = 1
+
+# control file layout: magic, format version, sequence number, generation, published_at (time.time()).
+_MAGIC = b'TPSS'
+_HEADER = struct.Struct('<4sIQQd')
+_SEQUENCE = struct.Struct('<Q')
+_SEQUENCE_OFFSET = 8
+_VERSION = struct.Struct('<Qd')
+_VERSION_OFFSET = 16
+CONTROL_FILE_SIZE = 64
+
+# how many of the latest data files are kept, so that readers that just read the generation can still open its file.
+_KEEP_VERSIONS = 2
+
+
+def _open_owned(path, flags, mode=0o600):
+    """
+    Opens `path` and returns the file descriptor, raising PermissionError if the file is owned by another user.
+    """
+    fd = os.open(path, flags, mode)
+    if not os.fstat(fd).st_uid == os.getuid():
+        os.close(fd)
+        raise PermissionError(f"{path} is owned by another user.")
+    return fd
+
+
+class SharedSnapshot(object):
+    """
+    A value shared by the processes of a node through the files at `path`. One process publish()es a new version,
+    while the others watch get_generation() and read() the version when it changes.
+    """
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self.directory = os.path.dirname(self.path)
+        self._owner_fd = None
+        self._owner_pid = None
+        self._lock_fds = threading.local()
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        with self.lock():
+            fd = _open_owned(self.path, os.O_RDWR | os.O_CREAT)
+            try:
+                if os.fstat(fd).st_size < CONTROL_FILE_SIZE:
+                    os.ftruncate(fd, CONTROL_FILE_SIZE)
+                self._control = mmap.mmap(fd, CONTROL_FILE_SIZE)
+            finally:
+                os.close(fd)
+            magic, version, _, _, _ = _HEADER.unpack_from(self._control)
+            if not (magic == _MAGIC and version == SHARED_FORMAT_VERSION):
+                # a new control file (or one of an older format): nothing has been published yet.
+                _HEADER.pack_into(self._control, 0, _MAGIC, SHARED_FORMAT_VERSION, 0, 0, 0.0)
+
+    @contextlib.contextmanager
+    def lock(self):
+        """
+        Context manager holding the exclusive, cross-process lock for publishing. Reentrant within a thread.
+        """
+        depth = getattr(self._lock_fds, 'depth', 0)
+        if depth:
+            self._lock_fds.depth += 1
+            try:
+                yield
+            finally:
+                self._lock_fds.depth -= 1
+            return
+        fd = _open_owned(f'{self.path}.lock', os.O_RDWR | os.O_CREAT)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            self._lock_fds.depth = 1
+            try:
+                yield
+            finally:
+                self._lock_fds.depth = 0
+        finally:
+            # closing the file releases the lock.
+            os.close(fd)
+
+    def acquire_ownership(self):
+        """
+        Tries to become the owner of the snapshot without waiting; the ownership lasts until this process exits or
+        calls release_ownership(). Returns True if this process is the owner.
+        """
+        if self.is_owner():
+            return True
+        fd = _open_owned(f'{self.path}.owner', os.O_RDWR | os.O_CREAT)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self._owner_fd = fd
+        self._owner_pid = os.getpid()
+        return True
+
+    def is_owner(self):
+        # the lock of a forked parent is not this process's ownership.
+        return self._owner_fd is not None and self._owner_pid == os.getpid()
+
+    def release_ownership(self):
+        if self.is_owner():
+            os.close(self._owner_fd)
+        self._owner_fd = None
+        self._owner_pid = None
+
+    def get_generation(self):
+        """
+        Returns (generation, published_at) of the latest version, or (0, 0.0) if nothing has been published yet.
+        """
+        for _ in range(1000):
+            sequence = _SEQUENCE.unpack_from(self._control, _SEQUENCE_OFFSET)[0]
+            if sequence % 2:
+                # a publish() is updating the version.
+                time.sleep(0)
+                continue
+            generation, published_at = _VERSION.unpack_from(self._control, _VERSION_OFFSET)
+            if _SEQUENCE.unpack_from(self._control, _SEQUENCE_OFFSET)[0] == sequence:
+                return generation, published_at
+        raise RuntimeError(f"Could not read the generation of {self.path}.")
+
+    def get_data_path(self, generation):
+        return f'{self.path}.{generation}'
+
+    def read(self, generation=None):
+        """
+        Returns the value of `generation` (default: the latest), unpickled from a memory map of its data file, or
+        None if there is no usable version.
+        """
+        if generation is None:
+            generation, _ = self.get_generation()
+        if not generation:
+            return None
+        path = self.get_data_path(generation)
+        try:
+            fd = _open_owned(path, os.O_RDONLY)
+            try:
+                with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as mapped:
+                    entry = pickle.loads(mapped)
+            finally:
+                os.close(fd)
+        except Exception as e:
+            logger.error(f"Could not read the shared data in {path}; exception: {e}")
+            return None
+        if not isinstance(entry, dict) or not entry.get('format_version') == SHARED_FORMAT_VERSION \
+                or not entry.get('generation') == generation:
+            logger.error(f"Ignoring the shared data in {path}; unexpected format.")
+            return None
+        return entry['value']
+
+    def publish(self, value):
+        """
+        Writes `value` as a new version and returns its generation. The data file is complete before the generation
+        is updated, so readers never see a partial version.
+        """
+        with self.lock():
+            generation = self.get_generation()[0] + 1
+            path = self.get_data_path(generation)
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=f'.{os.path.basename(self.path)}-',
+                                            suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    pickle.dump({'format_version': SHARED_FORMAT_VERSION, 'generation': generation, 'value': value},
+                                f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+            # seqlock: readers retry while the sequence number is odd or changes under them.
+            sequence = _SEQUENCE.unpack_from(self._control, _SEQUENCE_OFFSET)[0]
+            _SEQUENCE.pack_into(self._control, _SEQUENCE_OFFSET, sequence + 1)
+            _VERSION.pack_into(self._control, _VERSION_OFFSET, generation, time.time())
+            _SEQUENCE.pack_into(self._control, _SEQUENCE_OFFSET, sequence + 2)
+            self._control.flush()
+            self._remove_old_versions(generation)
+        return generation
+
+    def _remove_old_versions(self, generation):
+        # processes that have a version mapped keep it after it is removed.
+        for old in range(generation - _KEEP_VERSIONS, 0, -1):
+            try:
+                os.remove(self.get_data_path(old))
+            except FileNotFoundError:
+                break
+            except OSError as e:
+                logger.info(f"Could not remove {self.get_data_path(old)}; exception: {e}")
+                break
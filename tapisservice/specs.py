@@ -0,0 +1,200 @@
+"""
+Precompiled cache of the tapipy OpenAPI specs used by service clients.
+
+A tapipy client built with a resource_set other than 'tapipy', a spec_dir, a custom_spec_dict or
+download_latest_specs unpickles the full, dereferenced spec of every resource each time it is built. When
+tapisservice_spec_cache_dir is set, get_service_tapis_client() instead uses specs compiled by this module: only the
+resources the service needs (tapisservice_spec_resources), and of each operation only the parts tapipy uses. The
+compiled specs are written once to the cache directory, keyed by a digest of the source specs, and read by every
+other process through a memory map, which is several times faster and smaller than the source specs. Within a process,
+the specs are loaded once and shared by all clients.
+
+Note that tapipy loads the specs of the default 'tapipy' resource set when it is imported, so clients using them
+do not need this cache.
+"""
+import hashlib
+import json
+import mmap
+import os
+import pickle
+import sys
+import tempfile
+import threading
+
+from tapisservice.config import conf
+from tapisservice.logs import get_lazy_logger
+logger = get_lazy_logger(__name__)
+
+
+SPEC_CACHE_FORMAT_VERSION = 1
+
+# the parts of an operation used by tapipy.tapis.Operation; everything else is dropped when compiling.
+OPERATION_KEYS = ('operationId', 'parameters', 'requestBody')
+
+# resources tapisservice itself uses, always compiled.
+REQUIRED_RESOURCES = ('tenants', 'tokens')
+
+# digest -> compiled specs loaded in this process.
+_loaded_specs = {}
+_loaded_specs_lock = threading.Lock()
+
+
+def uses_compiled_specs(resource_set='tapipy', spec_dir=None, custom_spec_dict=None, download_latest_specs=False):
+    """
+    Whether a client built with these arguments should use compiled specs: only when the spec cache is enabled and
+    tapipy would otherwise load the specs for the client.
+    """
+    if not conf.get('tapisservice_spec_cache_dir'):
+        return False
+    return bool(custom_spec_dict or spec_dir or download_latest_specs or not resource_set == 'tapipy')
+
+
+def get_resources(resource_set='tapipy', custom_spec_dict=None, resource_names=None):
+    """
+    Returns {resource_name: spec_url} for the resources of `resource_set` updated with `custom_spec_dict`, limited to
+    `resource_names` (plus REQUIRED_RESOURCES) if given.
+    """
+    from tapipy.tapis import RESOURCES
+    resources = dict(RESOURCES[resource_set])
+    if custom_spec_dict:
+        resources.update(custom_spec_dict)
+    if resource_names:
+        wanted = set(resource_names) | set(REQUIRED_RESOURCES)
+        resources = {name: url for name, url in resources.items() if name in wanted}
+    return resources
+
+
+def get_spec_source_path(url, spec_dir):
+    """
+    Returns the path of the file tapipy loads the spec at `url` from.
+    """
+    from tapipy.tapis import get_file_info_from_url
+    if 'local:' in url:
+        return url.replace('local:', '').strip()
+    return get_file_info_from_url(url, spec_dir)[2]
+
+
+def get_specs_digest(resources, spec_dir):
+    """
+    Returns a sha256 digest of everything the compiled specs depend on: the format, the tapipy and python versions,
+    the resources and the contents of their source spec files.
+    """
+    import tapipy
+    key = {'format_version': SPEC_CACHE_FORMAT_VERSION,
+           'operation_keys': OPERATION_KEYS,
+           'tapipy': getattr(tapipy, '__version__', None),
+           'python': list(sys.version_info[:2]),
+           'resources': sorted(resources.items())}
+    digest = hashlib.sha256(json.dumps(key, sort_keys=True).encode())
+    for _, url in sorted(resources.items()):
+        try:
+            with open(get_spec_source_path(url, spec_dir), 'rb') as f:
+                digest.update(hashlib.sha256(f.read()).digest())
+        except OSError:
+            digest.update(b'missing')
+    return digest.hexdigest()
+
+
+def compile_specs(spec_dicts):
+    """
+    Returns the compact form of the dereferenced `spec_dicts` ({resource_name: spec}): of each spec only the paths,
+    and of each operation only the OPERATION_KEYS.
+    """
+    return {name: {'paths': {path: {method: {key: op[key] for key in OPERATION_KEYS if key in op}
+                                    for method, op in path_desc.items()}
+                             for path, path_desc in spec.get('paths', {}).items()}}
+            for name, spec in spec_dicts.items()}
+
+
+def get_spec_cache_path(cache_dir, digest):
+    return os.path.join(cache_dir, f'specs-{digest}.pickle')
+
+
+def read_compiled_specs(path, digest):
+    """
+    Returns the compiled specs cached at `path`, read through a memory map, or None if there is no usable entry.
+    """
+    try:
+        with open(path, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                entry = pickle.loads(mapped)
+    except Exception:
+        return None
+    if not isinstance(entry, dict) or not entry.get('format_version') == SPEC_CACHE_FORMAT_VERSION \
+            or not entry.get('digest') == digest or not isinstance(entry.get('specs'), dict):
+        return None
+    return entry['specs']
+
+
+def write_compiled_specs(path, digest, specs):
+    """
+    Atomically writes the compiled `specs` to `path`, readable by the owner only since the file is unpickled. Returns
+    True on success; failures are not fatal, the next process just compiles the specs again.
+    """
+    cache_dir = os.path.dirname(path)
+    tmp_path = None
+    try:
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, prefix='.specs-', suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump({'format_version': SPEC_CACHE_FORMAT_VERSION, 'digest': digest, 'specs': specs}, f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        return True
+    except OSError as e:
+        logger.error(f"Could not write the compiled specs to {path}; exception: {e}")
+        if tmp_path:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+        return False
+
+
+def get_compiled_specs(resource_set='tapipy', spec_dir=None, custom_spec_dict=None, download_latest_specs=False,
+                       resource_names=None, cache_dir=None):
+    """
+    Returns the compiled specs ({resource_name: {'paths': ...}}) for a client built with these arguments: from this
+    process's memory, the spec cache in `cache_dir` or, failing both, compiled from the specs tapipy loads (which
+    downloads them if needed) and written to the cache. resource_names and cache_dir default to the
+    tapisservice_spec_resources and tapisservice_spec_cache_dir configs.
+    """
+    from tapipy.tapis import _get_specs, get_spec_dir
+    if cache_dir is None:
+        cache_dir = conf.get('tapisservice_spec_cache_dir')
+    if resource_names is None:
+        resource_names = conf.get('tapisservice_spec_resources')
+    resources = get_resources(resource_set, custom_spec_dict, resource_names)
+    # creates spec_dir from the specs shipped with tapipy if it does not exist, as tapipy does.
+    spec_dir = get_spec_dir(spec_dir)
+    if not download_latest_specs:
+        digest = get_specs_digest(resources, spec_dir)
+        specs = _loaded_specs.get(digest)
+        if specs is not None:
+            return specs
+        specs = read_compiled_specs(get_spec_cache_path(cache_dir, digest), digest)
+        if specs is not None:
+            logger.debug("loaded compiled specs", digest=digest)
+            with _loaded_specs_lock:
+                return _loaded_specs.setdefault(digest, specs)
+    spec_dicts, _ = _get_specs(resources, spec_dir=spec_dir, download_latest_specs=download_latest_specs)
+    specs = compile_specs(spec_dicts)
+    # the digest is computed again as tapipy may have just downloaded some of the specs.
+    digest = get_specs_digest(resources, spec_dir)
+    write_compiled_specs(get_spec_cache_path(cache_dir, digest), digest, specs)
+    logger.info(f"compiled the specs of {len(specs)} resources", digest=digest)
+    with _loaded_specs_lock:
+        return _loaded_specs.setdefault(digest, specs)
+
+
+def set_client_resources(client, specs):
+    """
+    Replaces the resources of the tapipy `client` with ones built from the compiled `specs`.
+    """
+    from tapipy.tapis import Resource, RESOURCE_SPECS
+    for resource_name in RESOURCE_SPECS:
+        if resource_name not in specs and isinstance(getattr(client, resource_name, None), Resource):
+            delattr(client, resource_name)
+    for resource_name, spec in specs.items():
+        setattr(client, resource_name, Resource(resource_name, spec['paths'], client))
+    client.resource_dicts = specs
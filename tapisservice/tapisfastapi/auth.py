@@ -1,14 +1,29 @@
-from tapisservice.tapisfastapi.utils import g
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from tapisservice.tapisfastapi.utils import g, get_request_context
 from tapisservice.auth import add_headers as core_add_headers
 from tapisservice.auth import validate_request_token as core_validate_request_token
 from tapisservice.auth import resolve_tenant_id_for_request as core_resolve_tenant_id_for_request
+from tapisservice.config import conf
 from tapisservice.tenants import tenant_cache
 from tapisservice import errors
+from tapisservice.utils import LazyObject
 
-from starlette.requests import Request
+from starlette.datastructures import URL, Headers
 from starlette.types import ASGIApp, Receive, Scope, Send
 
 
+def _get_auth_executor():
+    return ThreadPoolExecutor(max_workers=conf.get('tapisservice_auth_executor_workers', 8),
+                              thread_name_prefix='tapis-auth')
+
+
+# bounded pool of worker threads used to run token validation and any tenant reloads off of the event loop; created on
+# first use, so that importing this module does not load the config.
+auth_executor = LazyObject(_get_auth_executor)
+
+
 class FormattedRequest():
     def __init__(self, headers, base_url, url, method):
         self.headers = headers
@@ -17,6 +32,56 @@ class FormattedRequest():
         self.method = method
 
 
+# the port left out of URLs for each scheme, as in starlette.datastructures.URL.
+_default_ports = {'http': 80, 'https': 443}
+_http_schemes = {'http': 'http', 'https': 'https', 'ws': 'http', 'wss': 'https'}
+
+# the ASGI scope types that are authenticated; everything else (e.g., lifespan) is passed straight to the app.
+_authenticated_scope_types = ('http', 'websocket')
+
+
+class ScopeRequest(FormattedRequest):
+    """
+    A FormattedRequest read straight from an ASGI http or websocket scope, without building a starlette Request. The
+    headers are a starlette Headers over the raw scope headers and the base_url is computed the way starlette's
+    Request.base_url is (e.g., 'https://dev.develop.tapis.io/'). The url is only built if an authn or authz callback
+    asks for it.
+    """
+    def __init__(self, scope: Scope) -> None:
+        self.scope = scope
+        self.headers = Headers(scope=scope)
+        # websocket scopes have no method; the handshake is a GET.
+        self.method = scope.get('method', 'GET')
+        self.base_url = base_url_for_scope(scope, self.headers)
+
+    @property
+    def url(self):
+        return URL(scope=self.scope)
+
+
+def base_url_for_scope(scope, headers=None):
+    """
+    Returns the base URL of the request in an ASGI scope, including the scheme, the host (from the Host header,
+    falling back to the server) and the root_path, with a trailing slash. Websocket schemes are reported as their
+    http equivalents so that tenant resolution treats them like any other request.
+    """
+    if headers is None:
+        headers = Headers(scope=scope)
+    scheme = _http_schemes.get(scope.get('scheme', 'http'), 'http')
+    root_path = scope.get('root_path', '')
+    if not root_path.endswith('/'):
+        root_path += '/'
+    host = headers.get('host')
+    if host is None:
+        server = scope.get('server')
+        if server is None:
+            return root_path
+        host, port = server
+        if port != _default_ports.get(scheme):
+            host = f"{host}:{port}"
+    return f"{scheme}://{host}{root_path}"
+
+
 class TapisMiddleware:
     """
     All-in-one convenience Middleware for implementing the basic kgservice authentication
@@ -31,35 +96,56 @@ class TapisMiddleware:
                     Middleware(GlobalsMiddleware),
                     Middleware(TapisMiddleware, authorization=authorization, authentication=None)
                   ])
+
+    By default, token validation and tenant reloads run in the bounded auth_executor so that they never block the
+    event loop; pass offload_auth=False to run them inline on the event loop instead.
+
+    Requests to the paths in public_paths, e.g., ['/v3/kg/hello', '/v3/kg/ready', '/metrics'], skip authentication
+    and authorization entirely; a path ending in '*' matches every path starting with the rest of it. With
+    skip_preflight=True, CORS preflight requests (OPTIONS with an Access-Control-Request-Method header) skip them too.
+    Scopes other than http and websocket, such as lifespan events, are passed straight to the app.
     """
-    def __init__(self, app: ASGIApp, tenant_cache=tenant_cache, authn_callback=None, authz_callback=None) -> None:
+    def __init__(self, app: ASGIApp, tenant_cache=tenant_cache, authn_callback=None, authz_callback=None,
+                 offload_auth=True, public_paths=(), skip_preflight=False) -> None:
         self.app = app
         self.authn_callback = authn_callback
         self.authz_callback = authz_callback
         self.tenant_cache = tenant_cache
+        self.offload_auth = offload_auth
+        self.public_paths = frozenset(p for p in public_paths if not p.endswith('*'))
+        self.public_path_prefixes = tuple(p[:-1] for p in public_paths if p.endswith('*'))
+        self.skip_preflight = skip_preflight
+
+    def is_public(self, scope: Scope) -> bool:
+        """
+        Whether the request in the scope skips authentication and authorization.
+        """
+        path = scope['path']
+        if path in self.public_paths or (self.public_path_prefixes and path.startswith(self.public_path_prefixes)):
+            return True
+        if self.skip_preflight and scope.get('method') == 'OPTIONS':
+            for key, _ in scope['headers']:
+                if key == b'access-control-request-method':
+                    return True
+        return False
 
     async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
-        # Gives request obj with headers and query, etc. https://www.starlette.io/requests/
-        request = Request(scope, receive)
-        # Because the docs are very non-descript:
-        #request.url.components = ['http', 'localhost:8000', '/pods/hello', '', '']
-        #request.url._url = http://localhost:8000/pods/hello
-        #request.url.scheme = 'http'
-        #request.url.hostname = 'localhost'
-        #request.url.path = '/pods/hello'
-        #request.url.port = '8000'
-        #request.url.netloc = 'localhost:8000
-        #request.base_url = 'https://localhost:8000'
-        # Base url comes in format {"_url": "base_url"}, request.base_url should be str though.
-        formatted_request = FormattedRequest(headers = request.headers,
-                                             base_url = request.base_url._url,
-                                             url = request.url,
-                                             method = request.method)
-        authn_and_authz(
-            formatted_request,
-            tenant_cache=self.tenant_cache,
-            authn_callback=self.authn_callback,
-            authz_callback=self.authz_callback)
+        if scope['type'] not in _authenticated_scope_types or self.is_public(scope):
+            await self.app(scope, receive, send)
+            return
+        formatted_request = ScopeRequest(scope)
+        if self.offload_auth:
+            await authn_and_authz_async(
+                formatted_request,
+                tenant_cache=self.tenant_cache,
+                authn_callback=self.authn_callback,
+                authz_callback=self.authz_callback)
+        else:
+            authn_and_authz(
+                formatted_request,
+                tenant_cache=self.tenant_cache,
+                authn_callback=self.authn_callback,
+                authz_callback=self.authz_callback)
         await self.app(scope, receive, send)
 
 
@@ -72,6 +158,13 @@ def authn_and_authz(request, tenant_cache=tenant_cache, authn_callback=None, aut
     authorization(request, authz_callback)
 
 
+async def authn_and_authz_async(request, tenant_cache=tenant_cache, authn_callback=None, authz_callback=None):
+    """Non-blocking version of authn_and_authz(); used by the TapisMiddleware.
+    """
+    await authentication_async(request, tenant_cache, authn_callback)
+    authorization(request, authz_callback)
+
+
 def authentication(request, tenant_cache=tenant_cache, authn_callback=None, expected_aud=[]):
     """Entry point for authentication.
     """
@@ -87,6 +180,33 @@ def authentication(request, tenant_cache=tenant_cache, authn_callback=None, expe
     core_resolve_tenant_id_for_request(g, request, tenant_cache)
 
 
+def _authenticate(state, request, tenant_cache, expected_aud):
+    """
+    The blocking part of authentication: signature verification and tenant resolution, which can reload the tenants.
+    Runs in the auth_executor.
+    """
+    core_add_headers(state, request)
+    core_validate_request_token(state, tenant_cache, expected_aud=expected_aud)
+    core_resolve_tenant_id_for_request(state, request, tenant_cache)
+
+
+async def authentication_async(request, tenant_cache=tenant_cache, authn_callback=None, expected_aud=[]):
+    """Entry point for authentication that runs the blocking work in the auth_executor instead of on the event loop.
+    The authn_callback, if any, is still called on the event loop.
+    """
+    # the ContextVar behind `g` is not visible from the executor threads, so they are handed the RequestContext itself.
+    context = get_request_context()
+    loop = asyncio.get_running_loop()
+    try:
+        await loop.run_in_executor(auth_executor, _authenticate, context, request, tenant_cache, expected_aud)
+    except errors.NoTokenError as e:
+        if authn_callback:
+            authn_callback(request)
+            return
+        else:
+            raise e
+
+
 def authorization(request, authz_callback=None):
     """Entry point for authorization.
     """
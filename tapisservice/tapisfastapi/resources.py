@@ -0,0 +1,28 @@
+"""
+Common fastapi endpoints to be available in all Tapis APIs.
+
+Add these to your service's api.py as follows (replace "pods" with your service name):
+
+from tapisservice.tapisfastapi.resources import metrics
+...
+
+# Prometheus metrics (requires the tapisservice_metrics_enabled config)
+api.add_api_route('/v3/pods/metrics', metrics, methods=['GET'], include_in_schema=False)
+
+"""
+from starlette.responses import Response
+from tapisservice import errors
+from tapisservice import metrics as tapis_metrics
+from tapisservice.logs import get_logger
+logger = get_logger(__name__)
+
+
+async def metrics():
+    """
+    Library metrics in the Prometheus text format; see tapisservice.metrics.
+    """
+    logger.debug('top of GET /metrics')
+    if not tapis_metrics.registry.enabled:
+        raise errors.ResourceError(msg='Metrics are not enabled for this service; set tapisservice_metrics_enabled.',
+                                   code=404)
+    return Response(tapis_metrics.registry.render(), media_type=tapis_metrics.CONTENT_TYPE)
@@ -1,23 +1,29 @@
 import os
 import traceback
 
-from contextvars import ContextVar, Token
-from typing import Any, Dict
+from contextvars import ContextVar
+from typing import Any
 from starlette.types import ASGIApp, Receive, Scope, Send
 
 from tapisservice.config import conf
 from tapisservice.errors import BaseTapisError
-from tapisservice.logs import get_logger
-logger = get_logger(__name__)
+from tapisservice.logs import get_lazy_logger
+logger = get_lazy_logger(__name__)
+
+
+def __getattr__(name):
+    # TAG, the service version, is read from the config on first use so that importing this module does not load it.
+    if name == 'TAG':
+        return conf.version
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-TAG = conf.version
 
 def ok(result, msg="The request was successful", metadata={}):
     if not isinstance(metadata, dict):
         raise TypeError("Got exception formatting response. Metadata should be dict.")
     d = {'result': result,
          'status': 'success',
-         'version': TAG,
+         'version': conf.version,
          'message': msg,
          'metadata': metadata}
     return d
@@ -27,46 +33,62 @@ def error(result=None, msg="Error processing the request.", metadata={}):
         raise TypeError("Got exception formatting response. Metadata should be dict.")
     d = {'result': result,
          'status': 'error',
-         'version': TAG,
+         'version': conf.version,
          'message': msg,
          'metadata': metadata}
     return d
 
-class Globals:
+class RequestContext:
     """
-    Class required to setup GlobalsMiddleware
+    Holds the per-request attributes behind `g`: the Tapis headers and the results of authentication set by
+    tapisservice.auth.add_headers(), validate_request_token() and resolve_tenant_id_for_request(), plus whatever the
+    service sets itself. The attributes the library sets are slots; anything else goes in the instance dictionary,
+    which is only created if used. Attributes that were never set read as None.
     """
-    __slots__ = ("_vars", "_reset_tokens")
+    __slots__ = ('x_tapis_token', 'x_tapis_tenant', 'x_tapis_user', 'x_tapis_user_token_hash', 'token_claims',
+                 'username', 'request_username', 'tenant_id', 'account_type', 'delegation', 'site_id',
+                 'request_tenant_id', 'request_tenant_base_url', 'request_site_id', '__dict__')
+
+    def __getattr__(self, item: str) -> Any:
+        # only called for attributes that were never set.
+        if item.startswith('__'):
+            raise AttributeError(item)
+        return None
+
 
-    _vars: Dict[str, ContextVar]
-    _reset_tokens: Dict[str, Token]
+# the RequestContext of the current request; GlobalsMiddleware sets a new one for every request.
+_request_context: ContextVar = ContextVar("globals:request_context", default=None)
 
-    def __init__(self) -> None:
-        object.__setattr__(self, '_vars', {})
-        object.__setattr__(self, '_reset_tokens', {})
+
+def get_request_context() -> RequestContext:
+    """
+    Returns the RequestContext of the current request, creating it if GlobalsMiddleware has not.
+    """
+    context = _request_context.get()
+    if context is None:
+        context = RequestContext()
+        _request_context.set(context)
+    return context
+
+
+class Globals:
+    """
+    Class required to setup GlobalsMiddleware. Attribute access is forwarded to the current RequestContext, so each
+    request costs one RequestContext and one ContextVar set however many attributes are used.
+    """
+    __slots__ = ()
 
     def reset(self) -> None:
-        for _name, var in self._vars.items():
-            try:
-                var.reset(self._reset_tokens[_name])
-            # ValueError will be thrown if the reset() happens in
-            # a different context compared to the original set().
-            # Then just set to None for this new context.
-            except ValueError:
-                var.set(None)
-
-    def _ensure_var(self, item: str) -> None:
-        if item not in self._vars:
-            self._vars[item] = ContextVar(f"globals:{item}", default=None)
-            self._reset_tokens[item] = self._vars[item].set(None)
+        _request_context.set(RequestContext())
 
     def __getattr__(self, item: str) -> Any:
-        self._ensure_var(item)
-        return self._vars[item].get()
+        return getattr(get_request_context(), item)
 
     def __setattr__(self, item: str, value: Any) -> None:
-        self._ensure_var(item)
-        self._vars[item].set(value)
+        setattr(get_request_context(), item, value)
+
+    def __delattr__(self, item: str) -> None:
+        delattr(get_request_context(), item)
 
 class GlobalsMiddleware:
     """
@@ -93,7 +115,10 @@ class GlobalsMiddleware:
         self.app = app
 
     async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
-        g.reset()
-        await self.app(scope, receive, send)
+        reset_token = _request_context.set(RequestContext())
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _request_context.reset(reset_token)
 
 g = Globals()
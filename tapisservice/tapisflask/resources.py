@@ -3,16 +3,20 @@ Common flask resources to be available in all Tapis APIs.
 
 Add these to your service's api.py as follows (replace "tenants" with your service name):
 
-from common.resources import HelloResource, ReadyResource
+from common.resources import HelloResource, ReadyResource, MetricsResource
 ...
 
 # Health-checks
 api.add_resource(ReadyResource, '/v3/tenants/ready')
 api.add_resource(HelloResource, '/v3/tenants/hello')
 
+# Prometheus metrics (requires the tapisservice_metrics_enabled config)
+api.add_resource(MetricsResource, '/v3/tenants/metrics')
+
 """
+from flask import Response
 from flask_restful import Resource
-from tapisservice import errors
+from tapisservice import errors, metrics
 from tapisservice.tapisflask import utils
 from tapisservice.logs import get_logger
 logger = get_logger(__name__)
@@ -43,3 +47,15 @@ class ReadyResource(Resource):
             logger.error(f"Got exception in ready resource trying to import models; e: {e}.")
             raise errors.ResourceError(msg=f'Service not ready')
         return utils.ok(result='', msg="Service is ready.")
+
+
+class MetricsResource(Resource):
+    """
+    Library metrics in the Prometheus text format; see tapisservice.metrics.
+    """
+    def get(self):
+        logger.debug('top of GET /metrics')
+        if not metrics.registry.enabled:
+            raise errors.ResourceError(msg='Metrics are not enabled for this service; set tapisservice_metrics_enabled.',
+                                       code=404)
+        return Response(metrics.registry.render(), content_type=metrics.CONTENT_TYPE)
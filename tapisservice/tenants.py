@@ -1,9 +1,82 @@
+import collections
 import datetime
-from tapipy.tapis import Tapis, TapisResult
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit
+from cryptography.hazmat.primitives.serialization import load_pem_public_key
 from tapisservice.config import conf
-from tapisservice import errors
-from tapisservice.logs import get_logger
-logger = get_logger(__name__)
+from tapisservice import errors, metrics
+from tapisservice.logs import get_lazy_logger
+from tapisservice.utils import LazyObject, is_initialized
+logger = get_lazy_logger(__name__)
+
+tenant_cache_lookups = metrics.registry.counter(
+    'tapisservice_tenant_cache_lookups_total',
+    'Tenant lookups in get_tenant_config by tenant id or URL; a miss means the tenant was not in the cached registry.',
+    ['by', 'result'])
+tenant_reload_seconds = metrics.registry.histogram(
+    'tapisservice_tenant_reload_seconds',
+    'Time spent fetching the tenants registry from the Tenants API, by result (success or failure).',
+    ['result'])
+
+
+SNAPSHOT_FORMAT_VERSION = 1
+
+
+# the tenants registry and the data derived from it, as built by one call to TenantCache.set_tenants(). The cache
+# publishes each version with a single assignment, so a reader that takes one reference to it sees the tenants, their
+# public keys and the indexes of the same version:
+#   tenants - dict of tenant_id -> tenant object,
+#   public_keys - dict of tenant_id -> (public_key PEM string, parsed key object),
+#   tenants_by_host - dict of URL host -> tenant, covering both the tenant base URLs and their primary-site URLs,
+#   site_admin_tenant_ids - dict of site_id -> site_admin_tenant_id,
+#   site_admin_tenants_for_service - the admin tenants this service needs tokens for (None if they could not be
+#   computed),
+#   generation - incremented by every set_tenants().
+TenantRegistry = collections.namedtuple('TenantRegistry', ['tenants', 'public_keys', 'tenants_by_host',
+                                                           'site_admin_tenant_ids', 'site_admin_tenants_for_service',
+                                                           'generation'])
+
+
+def get_url_host(url):
+    """
+    Returns the lower-cased host (and non-default port) of a URL, e.g., 'dev.develop.tapis.io' for
+    'https://dev.develop.tapis.io:443/v3/systems'. This is the key used for the tenant hostname index.
+    """
+    parts = urlsplit(url)
+    host = parts.netloc.lower()
+    if parts.scheme == 'https' and host.endswith(':443'):
+        host = host[:-len(':443')]
+    elif parts.scheme == 'http' and host.endswith(':80'):
+        host = host[:-len(':80')]
+    return host
+
+
+def tapis_result_to_dict(result):
+    """
+    Converts a TapisResult (or a list of them), including nested TapisResults, back into plain dictionaries and lists.
+    """
+    from tapipy.tapis import TapisResult
+    if isinstance(result, TapisResult):
+        return {key: tapis_result_to_dict(value) for key, value in vars(result).items()}
+    if isinstance(result, list):
+        return [tapis_result_to_dict(value) for value in result]
+    return result
+
+
+class _BootstrapTenants(object):
+    """
+    Passed as the tenant cache of the unauthenticated Tapis client that fetches the tenants and sites, so that
+    constructing the client does not fetch them a second time.
+    """
+    tenants = {}
+
+    def reload_tenants(self):
+        pass
 
 
 class TenantCache(object):
@@ -18,7 +91,70 @@ class TenantCache(object):
         # the configuration -- it only refreshes when it encoutners a tenant it does not recognize or it fails
         # to validate the signature of an access token
         self.update_tenant_cache_timedelta = datetime.timedelta(seconds=90)
-        self.tenants = self.get_tenants()
+        # reloads are single-flight: concurrent callers of reload_tenants() share the one fetch in flight, and no two
+        # fetches start less than tenant_reload_min_interval apart.
+        self.tenant_reload_min_interval = datetime.timedelta(
+            seconds=conf.get('tapisservice_tenant_reload_min_interval', 5))
+        self._reload_lock = threading.Lock()
+        # the current TenantRegistry; empty until the tenants are first loaded.
+        self.registry = TenantRegistry({}, {}, {}, {}, None, 0)
+        # loading the tenants when the cache is built does not count, so the first reload is never suppressed.
+        self.last_reload_attempt = float('-inf')
+        # tenant ids (and URL hosts) that were still unknown after a reload; lookups for these fail fast until the
+        # entry expires instead of triggering another reload. dict of key -> expiry (time.monotonic()).
+        self.unknown_tenant_ttl = datetime.timedelta(seconds=conf.get('tapisservice_unknown_tenant_ttl', 60))
+        self.unknown_tenants_max_size = 10000
+        self._unknown_tenants = collections.OrderedDict()
+        # guards _unknown_tenants and reload_stats, which request threads and reloads change concurrently; never held
+        # while the tenants are fetched.
+        self._stats_lock = threading.Lock()
+        self.reload_stats = {'reloads': 0, 'coalesced': 0, 'suppressed': 0, 'failures': 0, 'unknown_tenant_hits': 0,
+                             'adopted': 0}
+        # the optional background refresher; see start_background_refresh().
+        self.last_successful_update = None
+        self.refresh_failures = 0
+        self.last_refresh_error = None
+        self._refresh_thread = None
+        self._stop_refresh = threading.Event()
+        # optional local snapshot of the tenants registry; when a valid one exists, startup uses it instead of waiting
+        # on the Tenants API, and the registry is revalidated against the Tenants API in the background.
+        self.snapshot_path = conf.get('tapisservice_tenants_snapshot_path')
+        self.snapshot_max_age = datetime.timedelta(seconds=conf.get('tapisservice_tenants_snapshot_max_age', 86400))
+        self.loaded_from_snapshot = False
+        # optional registry shared by the workers of the node: one worker (the owner) refreshes it and publishes each
+        # version, and the others pick up new versions by comparing shared_generation; see get_shared_tenants().
+        self.shared_tenants = None
+        self.shared_generation = 0
+        self.shared_check_interval = conf.get('tapisservice_tenants_shared_check_interval', 1)
+        self._next_shared_check = 0
+        shared_path = conf.get('tapisservice_tenants_shared_path')
+        if shared_path and not conf.service_name == 'tenants':
+            from tapisservice.shared import SharedSnapshot
+            self.shared_tenants = SharedSnapshot(shared_path)
+        tenants = None
+        if self.shared_tenants is not None:
+            tenants = self.load_shared_tenants(max_age=self.snapshot_max_age)
+        if tenants is not None:
+            published_time = self.last_tenants_cache_update
+            self.set_tenants(tenants)
+            self.last_successful_update = published_time
+        else:
+            tenants = self.load_snapshot()
+            if tenants is not None:
+                snapshot_time = self.last_tenants_cache_update
+                self.set_tenants(tenants)
+                # the registry is only as fresh as the snapshot.
+                self.last_successful_update = snapshot_time
+                self.loaded_from_snapshot = True
+                # with a shared registry, the owner revalidates it for all the workers.
+                if self.shared_tenants is None:
+                    threading.Thread(target=self.refresh_tenants, name='tapis-tenant-revalidate', daemon=True).start()
+            else:
+                self.set_tenants(self.get_tenants())
+        if self.shared_tenants is not None:
+            self.take_shared_ownership()
+        elif conf.get('tapisservice_tenant_background_refresh', False):
+            self.start_background_refresh()
 
     def extend_tenant(self, t):
         """
@@ -50,33 +186,242 @@ class TenantCache(object):
             result = {tn.tenant_id: tn for tn in result}
             return result
         else:
+            if self.shared_tenants is not None:
+                return self.get_shared_tenants()
             logger.debug("this is not the tenants service; calling tenants API to get sites and tenants...")
-            # if this case, this is not the tenants service, so we will try to get
-            # the list of tenants by making API calls to the tenants service.
-            # NOTE: we intentionally create a new Tapis client with *no authentication* so that we can call the Tenants
-            # API even _before_ the SK is started up. If we pass a JWT, the Tenants will try to validate it as part of
-            # handling our request, and this validation will fail if SK is not available.
-            t = Tapis(base_url=conf.primary_site_admin_tenant_base_url)
+            self.last_tenants_cache_update = datetime.datetime.now()
+            tenants_data, sites_data = self.fetch_tenants_data()
+            tenants = self.build_tenants(tenants_data, sites_data)
+            self.write_snapshot(tenants_data, sites_data)
+            return tenants
+
+    def fetch_tenants_data(self):
+        """
+        Calls the Tenants API for the lists of tenants and sites and returns them as (tenants, sites), both lists of
+        dictionaries.
+        """
+        # NOTE: we intentionally create a new Tapis client with *no authentication* so that we can call the Tenants
+        # API even _before_ the SK is started up. If we pass a JWT, the Tenants will try to validate it as part of
+        # handling our request, and this validation will fail if SK is not available.
+        from tapipy.tapis import Tapis
+        t = Tapis(base_url=conf.primary_site_admin_tenant_base_url, tenants=_BootstrapTenants())
+        try:
+            tenants = t.tenants.list_tenants()
+            sites = t.tenants.list_sites()
+        except Exception as e:
+            msg = f"Got an exception trying to get the list of sites and tenants. Exception: {e}"
+            logger.error(msg)
+            raise errors.BaseTapisError("Unable to retrieve sites and tenants from the Tenants API.")
+        return tapis_result_to_dict(tenants), tapis_result_to_dict(sites)
+
+    def build_tenants(self, tenants_data, sites_data):
+        """
+        Builds the tenants dict, {tenant_id: tenant_obj, ...}, from the lists of tenant and site dictionaries returned
+        by fetch_tenants_data() (or read from a snapshot), and sets primary_site and service_running_at_primary_site.
+        """
+        from tapipy.tapis import TapisResult
+        sites = [TapisResult(**s) for s in sites_data]
+        tenants = [TapisResult(**t) for t in tenants_data]
+        for t in tenants:
+            self.extend_tenant(t)
+            for s in sites:
+                if hasattr(s, "primary") and s.primary:
+                    self.primary_site = s
+                    if s.site_id == conf.service_site_id:
+                        self.service_running_at_primary_site = True
+                if s.site_id == t.site_id:
+                    t.site = s
+        # Convert to dict {tenant_id: tenant_obj, ...}
+        tenants = {tn.tenant_id: tn for tn in tenants}
+        return tenants
+
+    @staticmethod
+    def get_snapshot_digest(payload):
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, separators=(',', ':')).encode()).hexdigest()
+
+    def write_snapshot(self, tenants_data, sites_data):
+        """
+        Writes the tenants and sites to the snapshot file, if one is configured. The file is replaced atomically, so
+        readers never see a partial snapshot. Failures are logged and otherwise ignored.
+        """
+        if not self.snapshot_path:
+            return False
+        payload = {'tenants': tenants_data, 'sites': sites_data}
+        snapshot = {'format_version': SNAPSHOT_FORMAT_VERSION,
+                    'created_at': time.time(),
+                    'primary_site_admin_tenant_base_url': conf.primary_site_admin_tenant_base_url,
+                    'sha256': self.get_snapshot_digest(payload),
+                    'payload': payload}
+        directory = os.path.dirname(os.path.abspath(self.snapshot_path))
+        try:
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(prefix='.tenants-snapshot-', dir=directory)
             try:
-                self.last_tenants_cache_update = datetime.datetime.now()
-                tenants = t.tenants.list_tenants()
-                sites = t.tenants.list_sites()
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(snapshot, f)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.snapshot_path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        except Exception as e:
+            logger.error(f"Could not write the tenants snapshot to {self.snapshot_path}; exception: {e}")
+            return False
+        return True
+
+    def read_snapshot(self):
+        """
+        Reads and checks the snapshot file. Returns (tenants, sites, created_at), or None if there is no snapshot
+        or it is unusable: corrupt, failing its integrity check, taken from a different Tapis installation, or older
+        than snapshot_max_age.
+        """
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return None
+        try:
+            with open(self.snapshot_path, 'r') as f:
+                snapshot = json.load(f)
+            payload = snapshot['payload']
+            created_at = snapshot['created_at']
+            if not snapshot.get('format_version') == SNAPSHOT_FORMAT_VERSION:
+                logger.info(f"Ignoring tenants snapshot {self.snapshot_path}; unsupported format version.")
+                return None
+            if not snapshot.get('sha256') == self.get_snapshot_digest(payload):
+                logger.error(f"Ignoring tenants snapshot {self.snapshot_path}; integrity check failed.")
+                return None
+            if not snapshot.get('primary_site_admin_tenant_base_url') == conf.primary_site_admin_tenant_base_url:
+                logger.info(f"Ignoring tenants snapshot {self.snapshot_path}; it is for a different primary site.")
+                return None
+            age = time.time() - created_at
+            if age > self.snapshot_max_age.total_seconds():
+                logger.info(f"Ignoring tenants snapshot {self.snapshot_path}; it is {age:.0f} seconds old.")
+                return None
+            return payload['tenants'], payload['sites'], created_at
+        except Exception as e:
+            logger.error(f"Ignoring tenants snapshot {self.snapshot_path}; could not read it. exception: {e}")
+            return None
+
+    def load_snapshot(self):
+        """
+        Returns the tenants dict built from the snapshot file, or None if there is no usable snapshot. The tenants
+        service always reads the registry from its own database and never uses a snapshot.
+        """
+        if conf.service_name == 'tenants':
+            return None
+        snapshot = self.read_snapshot()
+        if not snapshot:
+            return None
+        tenants_data, sites_data, created_at = snapshot
+        try:
+            tenants = self.build_tenants(tenants_data, sites_data)
+        except Exception as e:
+            logger.error(f"Ignoring tenants snapshot {self.snapshot_path}; could not build the tenants. exception: {e}")
+            return None
+        self.last_tenants_cache_update = datetime.datetime.fromtimestamp(created_at)
+        logger.info(f"loaded {len(tenants)} tenants from the snapshot at {self.snapshot_path}.")
+        return tenants
+
+    def get_shared_tenants(self):
+        """
+        get_tenants() for a registry shared by the workers of the node. Calls the Tenants API and publishes the result
+        for the other workers, unless another worker published a registry while this one waited for the shared lock or
+        within tenant_reload_min_interval, in which case that registry is used instead. Either way, at most one worker
+        of the node calls the Tenants API at a time.
+        """
+        seen_generation, _ = self.shared_tenants.get_generation()
+        with self.shared_tenants.lock():
+            generation, published_at = self.shared_tenants.get_generation()
+            if generation and (not generation == seen_generation
+                               or time.time() - published_at < self.tenant_reload_min_interval.total_seconds()):
+                tenants = self.load_shared_tenants()
+                if tenants is not None:
+                    self.count_reload_stat('adopted')
+                    return tenants
+            logger.debug("calling tenants API to get sites and tenants for the workers of the node...")
+            self.last_tenants_cache_update = datetime.datetime.now()
+            tenants_data, sites_data = self.fetch_tenants_data()
+            tenants = self.build_tenants(tenants_data, sites_data)
+            self.write_snapshot(tenants_data, sites_data)
+            try:
+                self.shared_generation = self.shared_tenants.publish(
+                    {'primary_site_admin_tenant_base_url': conf.primary_site_admin_tenant_base_url,
+                     'tenants': tenants_data,
+                     'sites': sites_data})
             except Exception as e:
-                msg = f"Got an exception trying to get the list of sites and tenants. Exception: {e}"
-                logger.error(msg)
-                raise errors.BaseTapisError("Unable to retrieve sites and tenants from the Tenants API.")
-            for t in tenants:
-                self.extend_tenant(t)
-                for s in sites:
-                    if hasattr(s, "primary") and s.primary:
-                        self.primary_site = s
-                        if s.site_id == conf.service_site_id:
-                            self.service_running_at_primary_site = True
-                    if s.site_id == t.site_id:
-                        t.site = s
-            # Convert to dict {tenant_id: tenant_obj, ...}
-            tenants = {tn.tenant_id: tn for tn in tenants}
-            return tenants
+                logger.error(f"Could not publish the tenants to {self.shared_tenants.path}; exception: {e}")
+        return tenants
+
+    def load_shared_tenants(self, max_age=None):
+        """
+        Returns the tenants dict built from the latest registry published by a worker of the node, or None if there is
+        none, it is for a different primary site or it is older than `max_age` (a timedelta).
+        """
+        generation, published_at = self.shared_tenants.get_generation()
+        if not generation:
+            return None
+        if max_age is not None and time.time() - published_at > max_age.total_seconds():
+            logger.info(f"Ignoring the shared tenants in {self.shared_tenants.path}; they were published "
+                        f"{time.time() - published_at:.0f} seconds ago.")
+            return None
+        registry = self.shared_tenants.read(generation)
+        if not registry:
+            return None
+        if not registry.get('primary_site_admin_tenant_base_url') == conf.primary_site_admin_tenant_base_url:
+            logger.info(f"Ignoring the shared tenants in {self.shared_tenants.path}; they are for a different "
+                        f"primary site.")
+            return None
+        try:
+            tenants = self.build_tenants(registry['tenants'], registry['sites'])
+        except Exception as e:
+            logger.error(f"Ignoring the shared tenants in {self.shared_tenants.path}; could not build the tenants. "
+                         f"exception: {e}")
+            return None
+        self.shared_generation = generation
+        self.last_tenants_cache_update = datetime.datetime.fromtimestamp(published_at)
+        logger.debug("loaded the shared tenants", generation=generation, tenants=len(tenants))
+        return tenants
+
+    def sync_shared_tenants(self):
+        """
+        Replaces the registry with a newer one published by another worker of the node, if there is one. The shared
+        generation is checked at most every shared_check_interval seconds, and the check is skipped while this worker
+        is reloading the tenants. Also takes over the refreshes if their owner has exited. Returns True if the
+        registry was replaced.
+        """
+        now = time.monotonic()
+        if now < self._next_shared_check:
+            return False
+        self._next_shared_check = now + self.shared_check_interval
+        self.take_shared_ownership()
+        generation, _ = self.shared_tenants.get_generation()
+        if generation == self.shared_generation or not self._reload_lock.acquire(blocking=False):
+            return False
+        try:
+            tenants = self.load_shared_tenants()
+            if tenants is None:
+                return False
+            self.set_tenants(tenants)
+            self.count_reload_stat('adopted')
+        finally:
+            self._reload_lock.release()
+        return True
+
+    def take_shared_ownership(self):
+        """
+        Makes this worker the one that refreshes the shared registry in the background, unless another worker of the
+        node already does. The registry is refreshed right away if it came from the snapshot or is older than
+        update_tenant_cache_timedelta. Returns True if this worker is the owner.
+        """
+        if self.shared_tenants.is_owner():
+            return True
+        if not self.shared_tenants.acquire_ownership():
+            return False
+        logger.info(f"this worker (pid {os.getpid()}) now refreshes the tenants shared by the workers of the node.")
+        age = self.get_snapshot_age()
+        if self.loaded_from_snapshot or age is None or age > self.update_tenant_cache_timedelta.total_seconds():
+            threading.Thread(target=self.refresh_tenants, name='tapis-tenant-revalidate', daemon=True).start()
+        self.start_background_refresh()
+        return True
 
     def get_tenants_for_tenants_api(self):
         """
@@ -90,6 +435,7 @@ class TenantCache(object):
             raise errors.BaseTapisError("get_tenants_for_tenants_api called by a service other than tenants.")
         from service.models import get_tenants as tenants_api_get_tenants
         from service.models import get_sites as tenants_api_get_sites
+        from tapipy.tapis import TapisResult
         # in the case where the tenants api migrations are running, this call will fail with a
         # sqlalchemy.exc.ProgrammingError because the tenants table will not exist yet.
         tenants = []
@@ -126,8 +472,241 @@ class TenantCache(object):
                     break
         return result
 
-    def reload_tenants(self):
-        self.tenants = self.get_tenants()
+    @property
+    def tenants(self):
+        return self.registry.tenants
+
+    @tenants.setter
+    def tenants(self, tenants):
+        self.set_tenants(tenants)
+
+    @property
+    def public_keys(self):
+        return self.registry.public_keys
+
+    @property
+    def tenants_by_host(self):
+        return self.registry.tenants_by_host
+
+    @property
+    def site_admin_tenant_ids(self):
+        return self.registry.site_admin_tenant_ids
+
+    @property
+    def site_admin_tenants_for_service(self):
+        return self.registry.site_admin_tenants_for_service
+
+    @property
+    def tenants_generation(self):
+        return self.registry.generation
+
+    def set_tenants(self, tenants):
+        """
+        Replace the tenants registry with `tenants` (a dict of tenant_id -> tenant object) and rebuild the data derived
+        from it, such as the parsed public keys. Public keys that cannot be parsed are logged here, once per load. The
+        new TenantRegistry replaces the current one in a single assignment, so concurrent readers never see a mix of
+        the two.
+        """
+        public_keys = {}
+        for tenant_id, tenant in tenants.items():
+            pem = getattr(tenant, 'public_key', None)
+            public_keys[tenant_id] = (pem, self.load_public_key(tenant_id, pem))
+        tenants_by_host = self.build_host_index(tenants)
+        site_admin_tenant_ids = self.build_site_admin_tenant_index(tenants)
+        try:
+            site_admin_tenants_for_service = self.compute_site_admin_tenants_for_service(tenants)
+        except AttributeError:
+            # e.g., a tenant with no site record; get_site_admin_tenants_for_service() will raise the error instead.
+            site_admin_tenants_for_service = None
+        self.registry = TenantRegistry(tenants, public_keys, tenants_by_host, site_admin_tenant_ids,
+                                       site_admin_tenants_for_service, self.registry.generation + 1)
+        self.last_successful_update = datetime.datetime.now()
+
+    def build_host_index(self, tenants):
+        """
+        Build the URL host -> tenant index used to resolve tenants from request URLs. Tenant base URLs take precedence
+        over the primary-site URLs computed from the primary site's tenant_base_url_template.
+        """
+        index = {}
+        for tenant in tenants.values():
+            base_url = getattr(tenant, 'base_url', None)
+            if base_url:
+                index.setdefault(get_url_host(base_url), tenant)
+        # without a primary site (or its template) the primary-site URLs cannot be computed for any tenant.
+        if not getattr(self.primary_site, 'tenant_base_url_template', None):
+            return index
+        for tenant in tenants.values():
+            try:
+                base_url_at_primary_site = self.get_base_url_for_tenant_primary_site(tenant.tenant_id)
+            except (errors.BaseTapisError, AttributeError) as e:
+                # a bad tenant record only leaves that tenant out of the index.
+                logger.debug("could not index the primary-site URL of tenant",
+                             tenant_id=lambda: getattr(tenant, 'tenant_id', None), exception=e)
+                continue
+            index.setdefault(get_url_host(base_url_at_primary_site), tenant)
+        return index
+
+    def reload_tenants(self, force=False):
+        """
+        Fetch the tenants registry again and replace the cached one. Concurrent calls are coalesced into a single
+        fetch, and calls made within tenant_reload_min_interval of the previous fetch are suppressed unless `force`
+        is True. Returns True if this call actually reloaded the tenants.
+        """
+        generation = self.tenants_generation
+        with self._reload_lock:
+            if not generation == self.tenants_generation:
+                # another thread completed a reload while we were waiting for the lock; use its result.
+                self.count_reload_stat('coalesced')
+                return False
+            now = time.monotonic()
+            if not force and now - self.last_reload_attempt < self.tenant_reload_min_interval.total_seconds():
+                self.count_reload_stat('suppressed')
+                logger.debug("tenants were reloaded less than tenant_reload_min_interval ago; not reloading.")
+                return False
+            self.last_reload_attempt = now
+            start = time.perf_counter()
+            try:
+                tenants = self.get_tenants()
+            except Exception:
+                self.count_reload_stat('failures')
+                if metrics.registry.enabled:
+                    tenant_reload_seconds.labels('failure').observe(time.perf_counter() - start)
+                raise
+            self.set_tenants(tenants)
+            self.count_reload_stat('reloads')
+            if metrics.registry.enabled:
+                tenant_reload_seconds.labels('success').observe(time.perf_counter() - start)
+            return True
+
+    def count_reload_stat(self, stat):
+        """
+        Increments the reload counter `stat`.
+        """
+        with self._stats_lock:
+            self.reload_stats[stat] += 1
+
+    def get_reload_stats(self):
+        """
+        Returns the reload counters, including how many reloads were coalesced or suppressed, as a dictionary.
+        """
+        with self._stats_lock:
+            stats = dict(self.reload_stats)
+            stats['unknown_tenants'] = len(self._unknown_tenants)
+        stats['generation'] = self.tenants_generation
+        stats['snapshot_age'] = self.get_snapshot_age()
+        stats['refresh_failures'] = self.refresh_failures
+        stats['last_refresh_error'] = self.last_refresh_error
+        stats['background_refresh_running'] = bool(self._refresh_thread and self._refresh_thread.is_alive())
+        if self.shared_tenants is not None:
+            stats['shared_generation'] = self.shared_generation
+            stats['shared_owner'] = self.shared_tenants.is_owner()
+        return stats
+
+    def get_snapshot_age(self):
+        """
+        Returns the number of seconds since the tenants registry was last successfully loaded.
+        """
+        if not self.last_successful_update:
+            return None
+        return (datetime.datetime.now() - self.last_successful_update).total_seconds()
+
+    def start_background_refresh(self, interval=None):
+        """
+        Start a daemon thread that reloads the tenants registry every `interval` (a timedelta; defaults to
+        update_tenant_cache_timedelta). Requests keep using the current registry while a refresh runs, and keep using
+        it if the refresh fails; failures are counted in refresh_failures and last_refresh_error.
+
+        Note that threads do not survive a fork, so servers that fork workers after importing the service (e.g.,
+        gunicorn with preload_app) need to call this in each worker.
+        """
+        if self._refresh_thread and self._refresh_thread.is_alive():
+            return
+        interval = interval or self.update_tenant_cache_timedelta
+        self._stop_refresh.clear()
+        self._refresh_thread = threading.Thread(target=self._background_refresh_loop,
+                                                args=(interval.total_seconds(),),
+                                                name='tapis-tenant-refresh',
+                                                daemon=True)
+        self._refresh_thread.start()
+
+    def stop_background_refresh(self):
+        self._stop_refresh.set()
+        if self._refresh_thread:
+            self._refresh_thread.join()
+            self._refresh_thread = None
+
+    def _background_refresh_loop(self, interval):
+        while not self._stop_refresh.wait(interval):
+            self.refresh_tenants()
+
+    def refresh_tenants(self):
+        """
+        One background refresh; never raises. Returns True if the registry was replaced.
+        """
+        try:
+            reloaded = self.reload_tenants(force=True)
+        except Exception as e:
+            self.refresh_failures += 1
+            self.last_refresh_error = f"{datetime.datetime.now().isoformat()}: {e}"
+            logger.error(f"Background refresh of the tenants failed; continuing to use the tenants loaded "
+                         f"{self.get_snapshot_age()} seconds ago. Exception: {e}")
+            return False
+        self.last_refresh_error = None
+        return reloaded
+
+    def is_unknown_tenant(self, key):
+        """
+        Whether `key` (a tenant id or URL host) was recently found to not be in the registry, even after a reload.
+        """
+        with self._stats_lock:
+            expires = self._unknown_tenants.get(key)
+            if expires is None:
+                return False
+            if time.monotonic() >= expires:
+                del self._unknown_tenants[key]
+                return False
+            self.reload_stats['unknown_tenant_hits'] += 1
+            return True
+
+    def add_unknown_tenant(self, key):
+        with self._stats_lock:
+            self._unknown_tenants[key] = time.monotonic() + self.unknown_tenant_ttl.total_seconds()
+            while len(self._unknown_tenants) > self.unknown_tenants_max_size:
+                self._unknown_tenants.popitem(last=False)
+
+    def load_public_key(self, tenant_id, pem):
+        """
+        Parse the PEM-encoded public key of a tenant into a key object that can be passed directly to jwt.decode().
+        Returns None if the tenant has no public key or the key could not be parsed.
+        """
+        if not pem:
+            return None
+        try:
+            return load_pem_public_key(pem.encode())
+        except Exception as e:
+            logger.error(f"Could not parse the public key for tenant {tenant_id}; tokens for this tenant will be "
+                         f"rejected. Exception: {e}")
+            return None
+
+    def get_public_key_entry(self, tenant_id):
+        """
+        Returns a (public_key PEM string, parsed key object) tuple for a tenant, both from the same version of the
+        registry; the key object is None if the tenant has no valid public key.
+        """
+        registry = self.registry
+        pem = getattr(registry.tenants.get(tenant_id), 'public_key', None)
+        entry = registry.public_keys.get(tenant_id)
+        # the tenant's key could have been modified in place since the registry was loaded; only re-parse in that case.
+        if entry is None or not entry[0] == pem:
+            entry = (pem, self.load_public_key(tenant_id, pem))
+            registry.public_keys[tenant_id] = entry
+        return entry
+
+    def get_public_key(self, tenant_id):
+        """
+        Returns the parsed public key object for a tenant, or None if the tenant has no valid public key.
+        """
+        return self.get_public_key_entry(tenant_id)[1]
 
     def get_tenant_config(self, tenant_id=None, url=None):
         """
@@ -138,18 +717,26 @@ class TenantCache(object):
         :return:
         """
         def find_tenant_from_id():
-            logger.debug(f"top of find_tenant_from_id for tenant_id: {tenant_id}")
+            logger.debug("top of find_tenant_from_id", tenant_id=tenant_id)
             # tenants is a dict
-            tenant = self.tenants.get(tenant_id)
+            tenants = self.registry.tenants
+            tenant = tenants.get(tenant_id)
             if tenant:
-                logger.debug(f"found tenant {tenant_id}")
+                logger.debug("found tenant", tenant_id=tenant_id)
                 return tenant
-            logger.info(f"did not find tenant: {tenant_id}. self.tenants: {self.tenants.keys()}")
+            logger.info("did not find tenant", tenant_id=tenant_id, tenants=lambda: list(tenants.keys()))
             return None
 
         def find_tenant_from_url():
+            # the index and the tenants scanned must be from the same version of the registry.
+            registry = self.registry
+            # first, an O(1) lookup by the URL's host
+            tenant = registry.tenants_by_host.get(get_url_host(url))
+            if tenant:
+                return tenant
+            # fall back to scanning the tenants for a base URL that is a substring of the url;
             # tenants is a dict
-            for tenant in self.tenants.values():
+            for tenant in registry.tenants.values():
                 if tenant.base_url in url:
                     return tenant
                 base_url_at_primary_site = self.get_base_url_for_tenant_primary_site(tenant.tenant_id)
@@ -157,30 +744,41 @@ class TenantCache(object):
                     return tenant
             return None
 
-        logger.debug(f"top of get_tenant_config; called with tenant_id: {tenant_id}; url: {url}")
+        logger.debug("top of get_tenant_config", tenant_id=tenant_id, url=url)
+        if self.shared_tenants is not None:
+            self.sync_shared_tenants()
         # allow for local development by checking for localhost:500 in the url; note: using 500, NOT 5000 since services
         # might be running on different 500x ports locally, e.g., 5000, 5001, 5002, etc..
         if url and 'http://localhost:500' in url:
             logger.debug("http://localhost:500 in url; resolving tenant id to dev.")
             tenant_id = 'dev'
         if tenant_id:
-            logger.debug(f"looking for tenant with tenant_id: {tenant_id}")
+            logger.debug("looking for tenant", tenant_id=tenant_id)
             t = find_tenant_from_id()
         elif url:
-            logger.debug(f"looking for tenant with url {url}")
+            logger.debug("looking for tenant", url=url)
             # convert URL from http:// to https://
             if url.startswith('http://'):
                 logger.debug("url started with http://; stripping and replacing with https")
                 url = url[len('http://'):]
                 url = 'https://{}'.format(url)
-            logger.debug(f"looking for tenant with URL: {url}")
+            logger.debug("looking for tenant with https URL", url=url)
             t = find_tenant_from_url()
         else:
             raise errors.BaseTapisError("Invalid call to get_tenant_config; either tenant_id or url must be passed.")
+        if metrics.registry.enabled:
+            tenant_cache_lookups.labels('id' if tenant_id else 'url', 'hit' if t else 'miss').inc()
         if t:
             return t
+        # don't reload for tenants we already failed to find recently; this keeps requests with bogus tenant ids
+        # from triggering calls to the Tenants API.
+        unknown_key = tenant_id or get_url_host(url)
+        if self.is_unknown_tenant(unknown_key):
+            logger.debug("recently seen unknown tenant; not reloading tenants", tenant=unknown_key)
+            raise errors.BaseTapisError("invalid tenant id.")
         # try one reload and then give up -
-        logger.debug(f"did not find tenant; going to reload tenants.")
+        logger.debug("did not find tenant; going to reload tenants.")
+        generation = self.tenants_generation
         self.reload_tenants()
         if tenant_id:
             t = find_tenant_from_id()
@@ -188,6 +786,10 @@ class TenantCache(object):
             t = find_tenant_from_url()
         if t:
             return t
+        # only remember the miss if the registry was actually fetched again, by this call or a concurrent one; a
+        # suppressed reload says nothing about tenants created since the last fetch.
+        if not self.tenants_generation == generation:
+            self.add_unknown_tenant(unknown_key)
         raise errors.BaseTapisError("invalid tenant id.")
 
     def get_base_url_admin_tenant_primary_site(self):
@@ -210,14 +812,14 @@ class TenantCache(object):
         `service` should be the service being requested (e.g., apps, files, sk, tenants, etc.)
 
         """
-        logger.debug(f"top of get_site_and_base_url_for_service_request() for tenant_id: {tenant_id} and service: {service}")
+        logger.debug("top of get_site_and_base_url_for_service_request()", tenant_id=tenant_id, service=service)
         site_id_for_request = None
         base_url = None
         # requests to the tenants service should always go to the primary site
         if service == 'tenants':
             site_id_for_request = self.primary_site.site_id
             base_url =self.get_base_url_admin_tenant_primary_site()
-            logger.debug(f"call to tenants API, returning site_id: {site_id_for_request}; base url: {base_url}")
+            logger.debug("call to tenants API", site_id=site_id_for_request, base_url=base_url)
             return site_id_for_request, base_url
 
         # the SK and token services always use the same site as the site the service is running on --
@@ -227,8 +829,8 @@ class TenantCache(object):
             # if the site_id for the service is the same as the site_id for the request, use the tenant URL:
             if conf.service_site_id == tenant_config.site_id:
                 base_url = tenant_config.base_url
-                logger.debug(f"service '{service}' is SK or tokens and tenant's site was the same as the "
-                             f"configured site; returning site_id: {site_id_for_request}; base_url: {base_url}")
+                logger.debug("service is SK or tokens and tenant's site was the same as the configured site",
+                             service=service, site_id=site_id_for_request, base_url=base_url)
                 return site_id_for_request, base_url
             else:
                 # otherwise, we use the primary site (NOTE: if we are here, the configured site_id is different from the
@@ -236,8 +838,8 @@ class TenantCache(object):
                 # associate sites never handle requests for tenants they do not own.
                 site_id_for_request = self.primary_site.site_id
                 base_url = self.get_base_url_for_tenant_primary_site(tenant_id)
-                logger.debug(f'request for {tenant_id} and {service}; returning site_id: {site_id_for_request}; '
-                             f'base URL: {base_url}')
+                logger.debug("SK or tokens request for a tenant of another site", tenant_id=tenant_id, service=service,
+                             site_id=site_id_for_request, base_url=base_url)
                 return site_id_for_request, base_url
         # if the service is hosted by the site, we use the base_url associated with the tenant --
         try:
@@ -249,14 +851,13 @@ class TenantCache(object):
         if service in site_services:
             site_id_for_request = conf.service_site_id
             base_url = tenant_config.base_url
-            logger.debug(f"service {service} was hosted at site; returning site_id: {site_id_for_request}; "
-                         f"tenant's base_url: {base_url}")
+            logger.debug("service was hosted at site", service=service, site_id=site_id_for_request, base_url=base_url)
             return site_id_for_request, base_url
         # otherwise, we use the primary site
         site_id_for_request = self.primary_site.site_id
         base_url = self.get_base_url_for_tenant_primary_site(tenant_id)
-        logger.debug(f'request was for {tenant_id} and {service}; returning site_id: {site_id_for_request};'
-                     f'base URL: {base_url}')
+        logger.debug("service not hosted at site; using primary site", tenant_id=tenant_id, service=service,
+                     site_id=site_id_for_request, base_url=base_url)
         return site_id_for_request, base_url
 
     def get_base_url_for_tenant_primary_site(self, tenant_id):
@@ -273,21 +874,82 @@ class TenantCache(object):
 
     def get_site_admin_tenants_for_service(self):
         """
-        Get all tenants for which this service might need to interact with.
+        Get all tenants for which this service might need to interact with. The list is computed when the tenants
+        are loaded.
+        """
+        registry = self.registry
+        if registry.site_admin_tenants_for_service is None:
+            return self.compute_site_admin_tenants_for_service(registry.tenants)
+        return list(registry.site_admin_tenants_for_service)
+
+    def compute_site_admin_tenants_for_service(self, tenants):
+        """
+        Compute the admin tenants of all the sites this service might need to interact with, from `tenants`.
         """
         # services running at the primary site must interact with all sites, so this list comprehension
         # just pulls out the tenant's that are admin tenant id's for some site.
-        logger.debug("top of get_site_admin_tenants_for_service")
+        logger.debug("top of compute_site_admin_tenants_for_service")
         if self.service_running_at_primary_site:
-            admin_tenants = [tn.tenant_id for tn in self.tenants.values() if tn.tenant_id == tn.site.site_admin_tenant_id]
+            admin_tenants = [tn.tenant_id for tn in tenants.values() if tn.tenant_id == tn.site.site_admin_tenant_id]
         # otherwise, this service is running at an associate site, so it only needs itself and the primary site.
         else:
             admin_tenants = [conf.service_tenant_id]
-            for tn in self.tenants.values():
+            for tn in tenants.values():
                 if tn.tenant_id == tn.site.site_admin_tenant_id and hasattr(tn.site, 'primary') and tn.site.primary:
                     admin_tenants.append(tn.tenant_id)
-        logger.debug(f"site admin tenants for service: {admin_tenants}")
+        logger.debug("site admin tenants for service", admin_tenants=admin_tenants)
         return admin_tenants
 
+    def build_site_admin_tenant_index(self, tenants):
+        """
+        Build the site_id -> site_admin_tenant_id index from the sites attached to `tenants`.
+        """
+        index = {}
+        for tenant in tenants.values():
+            site = getattr(tenant, 'site', None)
+            admin_tenant_id = getattr(site, 'site_admin_tenant_id', None)
+            if admin_tenant_id:
+                index[site.site_id] = admin_tenant_id
+        return index
+
+    def get_site_admin_tenant_id(self, site_id):
+        """
+        Returns the tenant_id of the admin tenant of the site `site_id`, or None if the site is not known.
+        """
+        registry = self.registry
+        admin_tenant_id = registry.site_admin_tenant_ids.get(site_id)
+        if admin_tenant_id:
+            return admin_tenant_id
+        # the tenants could have been modified since the index was built; fall back to scanning them.
+        for tn in registry.tenants.values():
+            site = getattr(tn, 'site', None)
+            if getattr(site, 'site_id', None) == site_id:
+                return site.site_admin_tenant_id
+        return None
+
+# the tenants are fetched (or read from the snapshot) the first time tenant_cache is used rather than when this module
+# is imported.
+tenant_cache = LazyObject(TenantCache)
+
+
+def _get_reload_counts():
+    if not is_initialized(tenant_cache):
+        return None
+    with tenant_cache._stats_lock:
+        stats = dict(tenant_cache.reload_stats)
+    return {('reloaded',): stats['reloads'],
+            ('failed',): stats['failures'],
+            ('coalesced',): stats['coalesced'],
+            ('suppressed',): stats['suppressed']}
+
 
-tenant_cache = TenantCache()
\ No newline at end of file
+metrics.registry.gauge(
+    'tapisservice_tenant_snapshot_age_seconds',
+    'Seconds since the tenants registry was last loaded successfully.',
+    callback=lambda: tenant_cache.get_snapshot_age() if is_initialized(tenant_cache) else None)
+metrics.registry.callback_counter(
+    'tapisservice_tenant_reloads_total',
+    'Reloads of the tenants registry, by result: reloaded, failed, or skipped because another reload was in flight '
+    '(coalesced) or one had just been done (suppressed).',
+    ['result'],
+    callback=_get_reload_counts)
@@ -0,0 +1,79 @@
+import operator
+import threading
+
+_empty = object()
+
+
+def _proxy(func):
+    def inner(self, *args):
+        if self._wrapped is _empty:
+            self._setup()
+        return func(self._wrapped, *args)
+    return inner
+
+
+class LazyObject(object):
+    """
+    Proxy for an object that is expensive to create. The object is built by calling `factory` the first time the proxy
+    is used (attribute or item access, iteration, etc.), and from then on everything is forwarded to it. isinstance()
+    checks see the wrapped object's class.
+
+    The module level tenant_cache and token_cache are LazyObjects, so that importing tapisservice modules does not
+    call the Tenants API. Modeled on django.utils.functional.LazyObject.
+    """
+    def __init__(self, factory):
+        self.__dict__['_factory'] = factory
+        self.__dict__['_wrapped'] = _empty
+        self.__dict__['_setup_lock'] = threading.Lock()
+
+    def _setup(self):
+        with self._setup_lock:
+            if self._wrapped is _empty:
+                self.__dict__['_wrapped'] = self._factory()
+
+    def __getattr__(self, name):
+        if self._wrapped is _empty:
+            self._setup()
+        value = getattr(self._wrapped, name)
+        if getattr(value, '__self__', None) is self._wrapped:
+            # keep bound methods, e.g. conf.get, on the proxy so that later lookups skip __getattr__ altogether.
+            self.__dict__[name] = value
+        return value
+
+    def __setattr__(self, name, value):
+        if self._wrapped is _empty:
+            self._setup()
+        self.__dict__.pop(name, None)
+        setattr(self._wrapped, name, value)
+
+    def __delattr__(self, name):
+        if self._wrapped is _empty:
+            self._setup()
+        self.__dict__.pop(name, None)
+        delattr(self._wrapped, name)
+
+    __class__ = property(_proxy(operator.attrgetter('__class__')))
+    __dir__ = _proxy(dir)
+    __str__ = _proxy(str)
+    __bool__ = _proxy(bool)
+    __eq__ = _proxy(operator.eq)
+    __ne__ = _proxy(operator.ne)
+    __hash__ = _proxy(hash)
+    __getitem__ = _proxy(operator.getitem)
+    __setitem__ = _proxy(operator.setitem)
+    __delitem__ = _proxy(operator.delitem)
+    __iter__ = _proxy(iter)
+    __len__ = _proxy(len)
+    __contains__ = _proxy(operator.contains)
+
+    def __repr__(self):
+        if self._wrapped is _empty:
+            return f'<LazyObject: {getattr(self._factory, "__qualname__", self._factory)} (not yet created)>'
+        return repr(self._wrapped)
+
+
+def is_initialized(obj):
+    """
+    Returns False if `obj` is a LazyObject whose object has not been created yet, and True otherwise.
+    """
+    return not (type(obj) is LazyObject and obj._wrapped is _empty)
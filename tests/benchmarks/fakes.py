@@ -0,0 +1,208 @@
+"""
+Offline stand-ins for the pieces of a Tapis installation that tapisservice talks to: an RSA signing key, a
+tenants/sites registry of configurable size and a small HTTP server that serves the registry (Tenants API) and
+mints service tokens (Tokens API). Used by the benchmarks so that they run on a laptop with no network.
+
+NOTE: tapisservice loads and validates its config when it is first used, and the config is not reloaded, so
+configure_environment() must be called before anything from tapisservice is used.
+"""
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import jwt
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def generate_keypair(key_size=2048):
+    """
+    Returns a (private_key_pem, public_key_pem) tuple for a new RSA key.
+    """
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=key_size)
+    private_pem = private_key.private_bytes(serialization.Encoding.PEM,
+                                            serialization.PrivateFormat.PKCS8,
+                                            serialization.NoEncryption()).decode()
+    public_pem = private_key.public_key().public_bytes(serialization.Encoding.PEM,
+                                                       serialization.PublicFormat.SubjectPublicKeyInfo).decode()
+    return private_pem, public_pem
+
+
+def build_registry(num_tenants, num_sites, public_key, admin_base_url, domain='bench.tapis.io'):
+    """
+    Returns a (tenants, sites) tuple of lists of dictionaries shaped like the Tenants API's list_tenants and
+    list_sites results.
+    The first site, 'tacc', is the primary site; each site has an admin tenant ('admin' for the primary site,
+    '<site_id>admin' otherwise) whose base_url is `admin_base_url`, so that service tokens can be minted against
+    the FakeTapisServer. The `num_tenants` user tenants, t0, t1, ..., are spread over the sites round-robin and each
+    gets its own base_url, https://<tenant_id>.<domain>.
+    """
+    sites = []
+    tenants = []
+    for i in range(num_sites):
+        site_id = 'tacc' if i == 0 else f'site{i}'
+        admin_tenant_id = 'admin' if i == 0 else f'{site_id}admin'
+        site = {'site_id': site_id,
+                'primary': i == 0,
+                'site_admin_tenant_id': admin_tenant_id,
+                'services': ['systems', 'apps', 'files', 'jobs'] if i == 0 else ['systems', 'files']}
+        if i == 0:
+            site['tenant_base_url_template'] = f'https://${{tenant_id}}.{domain}'
+        sites.append(site)
+        tenants.append({'tenant_id': admin_tenant_id,
+                        'site_id': site_id,
+                        'base_url': admin_base_url,
+                        'public_key': public_key,
+                        'status': 'active'})
+    for i in range(num_tenants):
+        tenant_id = f't{i}'
+        tenants.append({'tenant_id': tenant_id,
+                        'site_id': sites[i % num_sites]['site_id'],
+                        'base_url': f'https://{tenant_id}.{domain}',
+                        'public_key': public_key,
+                        'status': 'active'})
+    return tenants, sites
+
+
+def make_token(private_key, tenant_id, username, account_type='user', exp_in=3600, **claims):
+    """
+    Returns a Tapis access token for `username` in `tenant_id` signed with `private_key`. Additional claims, such
+    as `tapis/target_site` for service tokens, can be passed as keyword arguments (use a dict for claim names
+    containing a '/').
+    """
+    now = int(time.time())
+    data = {'jti': str(uuid.uuid4()),
+            'iss': 'https://admin.bench.tapis.io/v3/tokens',
+            'sub': f'{username}@{tenant_id}',
+            'tapis/tenant_id': tenant_id,
+            'tapis/token_type': 'access',
+            'tapis/delegation': False,
+            'tapis/delegation_sub': None,
+            'tapis/username': username,
+            'tapis/account_type': account_type,
+            'exp': now + exp_in}
+    data.update(claims)
+    return jwt.encode(data, private_key, algorithm='RS256')
+
+
+class FakeTapisServer(object):
+    """
+    A threaded HTTP server on localhost that answers the Tenants API's list_tenants and list_sites calls with a
+    fixed registry and the Tokens API's create_token and refresh_token calls with tokens signed by `private_key`.
+    Every other request gets an empty 200 result. `counters` records the number of calls to each API. Set
+    `tenants_delay` to make list_tenants calls take that many seconds, like a slow Tenants API.
+    """
+    def __init__(self, private_key, token_ttl=3600):
+        self.private_key = private_key
+        self.token_ttl = token_ttl
+        self.tenants_delay = 0
+        self.tenants = []
+        self.sites = []
+        self.counters = {'tenants': 0, 'sites': 0, 'create_token': 0, 'refresh_token': 0, 'other': 0}
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return f'http://127.0.0.1:{self._server.server_port}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='fake-tapis-server', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def token_response(self, data):
+        tenant_id = data.get('token_tenant_id', 'admin')
+        username = data.get('token_username', 'abaco')
+        claims = {'tapis/target_site': data.get('target_site_id', 'tacc')}
+        expires_at = time.strftime('%Y-%m-%dT%H:%M:%S+00:00', time.gmtime(time.time() + self.token_ttl))
+        access_token = make_token(self.private_key, tenant_id, username, 'service', self.token_ttl, **claims)
+        refresh_token = make_token(self.private_key, tenant_id, username, 'service', 10 * self.token_ttl,
+                                   **{'tapis/token_type': 'refresh'})
+        return {'access_token': {'access_token': access_token, 'expires_at': expires_at,
+                                 'expires_in': self.token_ttl, 'jti': str(uuid.uuid4())},
+                'refresh_token': {'refresh_token': refresh_token, 'expires_at': expires_at,
+                                  'expires_in': 10 * self.token_ttl, 'jti': str(uuid.uuid4())}}
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _read_json(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                return json.loads(self.rfile.read(length) or b'{}')
+
+            def _send(self, result):
+                body = json.dumps({'result': result, 'status': 'success', 'message': 'ok'}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path.startswith('/v3/tenants'):
+                    server.counters['tenants'] += 1
+                    if server.tenants_delay:
+                        time.sleep(server.tenants_delay)
+                    return self._send(server.tenants)
+                if self.path.startswith('/v3/sites'):
+                    server.counters['sites'] += 1
+                    return self._send(server.sites)
+                server.counters['other'] += 1
+                self._send({})
+
+            def do_POST(self):
+                data = self._read_json()
+                if self.path.startswith('/v3/tokens'):
+                    server.counters['create_token'] += 1
+                    return self._send(server.token_response(data))
+                server.counters['other'] += 1
+                self._send({})
+
+            def do_PUT(self):
+                self._read_json()
+                if self.path.startswith('/v3/tokens'):
+                    server.counters['refresh_token'] += 1
+                    return self._send(server.token_response({}))
+                server.counters['other'] += 1
+                self._send({})
+
+        return Handler
+
+
+def configure_environment(base_url, python_framework_type='fastapi', log_level='ERROR', config_dir=None, **configs):
+    """
+    Writes a service config pointing at the FakeTapisServer at `base_url` and sets TAPIS_CONFIG_PATH and
+    TAPIS_CONFIGSCHEMA_PATH so that tapisservice picks it up when it is imported. Returns the config path.
+    """
+    config = {'service_name': 'abaco',
+              'service_site_id': 'tacc',
+              'service_tenant_id': 'admin',
+              'tenants': ['admin'],
+              'service_password': 'bench',
+              'primary_site_admin_tenant_base_url': base_url,
+              'python_framework_type': python_framework_type,
+              'log_level': log_level}
+    config.update(configs)
+    config_dir = config_dir or tempfile.mkdtemp(prefix='tapisservice-bench-')
+    path = os.path.join(config_dir, 'config.json')
+    with open(path, 'w') as f:
+        json.dump(config, f)
+    os.environ['TAPIS_CONFIG_PATH'] = path
+    os.environ['TAPIS_CONFIGSCHEMA_PATH'] = os.path.join(os.path.dirname(HERE), 'configschema.json')
+    return path
@@ -0,0 +1,378 @@
+"""
+In-process load test of the framework integrations: a minimal Flask app using tapisflask.auth.authn_and_authz as its
+before_request hook, driven through WSGI by a pool of threads, and a minimal FastAPI app using GlobalsMiddleware and
+tapisfastapi.auth.TapisMiddleware, driven through ASGI by concurrent tasks on one event loop.
+
+Requests carry a weighted mix of headers (see --mix):
+    user     - a user token for the tenant whose base URL the request was made to,
+    service  - a service token with X-Tapis-Tenant/X-Tapis-User (OBO) headers,
+    invalid  - a token with a bad signature,
+    expired  - an expired user token.
+For each framework and each --concurrency level, reports requests/sec and p50/p95/p99 latency, and writes JSON to
+--output. Like run_benchmarks.py, everything runs against fakes.FakeTapisServer and needs no network.
+
+With --reload-delay, the user requests are also sent through the FastAPI app while another task keeps a tenant reload
+in flight against a Tenants API that takes that many seconds to answer, once with TapisMiddleware's offload_auth=True
+(fastapi_reload_offload) and once with offload_auth=False (fastapi_reload_inline).
+
+Usage:
+    python tests/benchmarks/loadtest.py --concurrency 1 8 32 --requests 5000 --output loadtest.json
+    python tests/benchmarks/loadtest.py --frameworks fastapi --mix user=50 service=50
+    python tests/benchmarks/loadtest.py --frameworks fastapi --concurrency 16 --requests 500 --reload-delay 0.2
+"""
+import argparse
+import asyncio
+import collections
+import datetime
+import itertools
+import json
+import os
+import platform
+import random
+import sys
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.dirname(os.path.dirname(HERE)))
+
+import fakes
+from run_benchmarks import percentile
+
+DOMAIN = 'bench.tapis.io'
+DEFAULT_MIX = {'user': 80, 'service': 15, 'invalid': 3, 'expired': 2}
+
+
+def build_request_mix(private_key, tenant_ids, mix, distinct, seed):
+    """
+    Returns a shuffled list of (host, headers, kind) tuples, with `kind` drawn according to the weights in `mix`.
+    Tokens are drawn from `distinct` users per kind, so the token cache sees a realistic amount of reuse.
+    """
+    rng = random.Random(seed)
+    users = [(rng.choice(tenant_ids), f'user{i}') for i in range(distinct)]
+    user_tokens = [(tenant_id, fakes.make_token(private_key, tenant_id, username)) for tenant_id, username in users]
+    service_tokens = [fakes.make_token(private_key, 'admin', service, 'service', **{'tapis/target_site': 'tacc'})
+                      for service in ('jobs', 'apps', 'files', 'systems')]
+    other_key, _ = fakes.generate_keypair()
+    invalid_tokens = [(tenant_id, fakes.make_token(other_key, tenant_id, username)) for tenant_id, username in users]
+    expired_tokens = [(tenant_id, fakes.make_token(private_key, tenant_id, username, exp_in=-60))
+                      for tenant_id, username in users]
+    kinds = [kind for kind, weight in mix.items() for _ in range(weight)]
+    requests = []
+    for i in range(max(1000, distinct * 10)):
+        kind = rng.choice(kinds)
+        if kind == 'service':
+            tenant_id, username = rng.choice(users)
+            headers = {'X-Tapis-Token': rng.choice(service_tokens),
+                       'X-Tapis-Tenant': tenant_id,
+                       'X-Tapis-User': username}
+        else:
+            tokens = {'user': user_tokens, 'invalid': invalid_tokens, 'expired': expired_tokens}[kind]
+            tenant_id, token = rng.choice(tokens)
+            headers = {'X-Tapis-Token': token}
+        requests.append((f'{tenant_id}.{DOMAIN}', headers, kind))
+    return requests
+
+
+def summarize(latencies, wall_time, statuses):
+    latencies = sorted(l * 1000 for l in latencies)
+    return {'requests': len(latencies),
+            'requests_per_sec': round(len(latencies) / wall_time, 1),
+            'mean_ms': round(sum(latencies) / len(latencies), 3),
+            'p50_ms': round(percentile(latencies, 50), 3),
+            'p95_ms': round(percentile(latencies, 95), 3),
+            'p99_ms': round(percentile(latencies, 99), 3),
+            'max_ms': round(latencies[-1], 3),
+            'statuses': dict(sorted(statuses.items()))}
+
+
+# Flask -----
+
+def make_flask_app(tenant_cache):
+    from flask import Flask, g, jsonify
+    from tapisservice import errors
+    from tapisservice.tapisflask import auth
+
+    app = Flask('tapisservice-loadtest')
+
+    @app.before_request
+    def authnz():
+        auth.authn_and_authz(tenant_cache=tenant_cache)
+
+    @app.errorhandler(errors.BaseTapisError)
+    def handle_tapis_error(e):
+        return jsonify({'status': 'error', 'message': e.msg}), e.code
+
+    @app.route('/v3/systems')
+    def systems():
+        return jsonify({'tenant_id': g.request_tenant_id, 'username': g.request_username})
+
+    return app
+
+
+def run_flask(app, request_mix, concurrency, total):
+    """
+    Calls the WSGI app directly from `concurrency` threads until `total` requests have completed.
+    """
+    from werkzeug.test import EnvironBuilder
+
+    environs = []
+    for host, headers, kind in request_mix:
+        environ = EnvironBuilder(path='/v3/systems', base_url=f'https://{host}', headers=headers).get_environ()
+        environs.append(environ)
+    next_request = iter(range(total))
+    lock = threading.Lock()
+    latencies = []
+    statuses = collections.Counter()
+
+    def worker():
+        local_latencies = []
+        local_statuses = collections.Counter()
+        while True:
+            with lock:
+                i = next(next_request, None)
+            if i is None:
+                break
+            status = []
+            environ = dict(environs[i % len(environs)])
+            start = time.perf_counter()
+            body = app(environ, lambda s, h, exc_info=None: status.append(s))
+            for _ in body:
+                pass
+            getattr(body, 'close', lambda: None)()
+            local_latencies.append(time.perf_counter() - start)
+            local_statuses[status[0].split()[0]] += 1
+        with lock:
+            latencies.extend(local_latencies)
+            statuses.update(local_statuses)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return summarize(latencies, time.perf_counter() - start, statuses)
+
+
+# FastAPI -----
+
+def make_fastapi_app(tenant_cache, offload_auth=True):
+    from fastapi import FastAPI
+    from starlette.middleware import Middleware
+    from starlette.responses import JSONResponse
+    from tapisservice import errors
+    from tapisservice.tapisfastapi.auth import TapisMiddleware
+    from tapisservice.tapisfastapi.utils import GlobalsMiddleware, g
+
+    # errors raised in middleware only reach the catch-all Exception handler, as in the Tapis FastAPI services.
+    def error_handler(request, exc):
+        if isinstance(exc, errors.BaseTapisError):
+            return JSONResponse({'status': 'error', 'message': exc.msg}, status_code=exc.code)
+        return JSONResponse({'status': 'error', 'message': str(exc)}, status_code=500)
+
+    app = FastAPI(exception_handlers={Exception: error_handler},
+                  middleware=[Middleware(GlobalsMiddleware),
+                              Middleware(TapisMiddleware, tenant_cache=tenant_cache, offload_auth=offload_auth)])
+
+    @app.get('/v3/systems')
+    def systems():
+        return {'tenant_id': g.request_tenant_id, 'username': g.request_username}
+
+    return app
+
+
+def make_scope(host, headers):
+    """
+    Returns the ASGI scope of a GET /v3/systems request to `host` with `headers`.
+    """
+    raw_headers = [(b'host', host.encode())] + [(k.lower().encode(), v.encode()) for k, v in headers.items()]
+    return {'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+            'scheme': 'https', 'path': '/v3/systems', 'raw_path': b'/v3/systems', 'query_string': b'',
+            'root_path': '', 'headers': raw_headers, 'server': (host, 443), 'client': ('127.0.0.1', 50000)}
+
+
+def run_fastapi(app, request_mix, concurrency, total, background=None):
+    """
+    Calls the ASGI app directly from `concurrency` tasks on one event loop until `total` requests have completed. If
+    given, `background` is a coroutine function that is run alongside the requests, and cancelled once they are done;
+    its own requests are not counted.
+    """
+    scopes = [make_scope(host, headers) for host, headers, kind in request_mix]
+    latencies = []
+    statuses = collections.Counter()
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def worker(next_request):
+        for i in next_request:
+            status = []
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    status.append(message['status'])
+
+            start = time.perf_counter()
+            try:
+                # like uvicorn, run each request in its own task (and so its own copy of the context).
+                await asyncio.ensure_future(app(dict(scopes[i % len(scopes)]), receive, send))
+            except Exception:
+                # starlette re-raises exceptions handled by the catch-all handler after sending the response.
+                pass
+            latencies.append(time.perf_counter() - start)
+            statuses[str(status[0]) if status else 'none'] += 1
+
+    async def main():
+        next_request = iter(range(total))
+        background_task = asyncio.ensure_future(background()) if background is not None else None
+        await asyncio.gather(*(worker(next_request) for _ in range(concurrency)))
+        if background_task is not None:
+            background_task.cancel()
+            await asyncio.gather(background_task, return_exceptions=True)
+
+    start = time.perf_counter()
+    asyncio.run(main())
+    return summarize(latencies, time.perf_counter() - start, statuses)
+
+
+def run_fastapi_during_reload(app, request_mix, concurrency, total, private_key):
+    """
+    Like run_fastapi(), but while the requests run, one more task keeps a tenant reload in flight: it sends requests
+    with tokens for tenants that do not exist, one after the other, each of which makes TapisMiddleware reload the
+    tenants from the (slow) Tenants API. Only the latencies of the other requests are reported.
+    """
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        pass
+
+    async def keep_reloading():
+        for i in itertools.count():
+            # a new tenant id every time, as a tenant that is still unknown after a reload is not reloaded for again.
+            token = fakes.make_token(private_key, f'unknown{i}', 'testuser')
+            try:
+                await asyncio.ensure_future(app(make_scope(f'unknown{i}.{DOMAIN}', {'X-Tapis-Token': token}),
+                                                receive, send))
+            except Exception:
+                pass
+
+    return run_fastapi(app, request_mix, concurrency, total, background=keep_reloading)
+
+
+def run(args):
+    private_key, public_key = fakes.generate_keypair()
+    server = fakes.FakeTapisServer(private_key).start()
+    server.tenants, server.sites = fakes.build_registry(args.tenants, args.sites, public_key, server.base_url,
+                                                        domain=DOMAIN)
+    configs = {}
+    if args.no_token_cache:
+        configs['tapisservice_token_cache_size'] = 0
+    fakes.configure_environment(server.base_url, **configs)
+
+    # tapisservice must only be imported once the environment points at the fake server
+    import tapisservice
+    from tapisservice.tenants import TenantCache
+
+    tenant_cache = TenantCache()
+    # OBO requests are only valid for tenants at this service's site (tacc), so the mix draws from those.
+    tenant_ids = [t['tenant_id'] for t in server.tenants if t['tenant_id'].startswith('t') and t['site_id'] == 'tacc']
+    request_mix = build_request_mix(private_key, tenant_ids, args.mix, args.distinct, args.seed)
+
+    apps = {'flask': (make_flask_app, run_flask),
+            'fastapi': (make_fastapi_app, run_fastapi)}
+    results = {}
+    for framework in args.frameworks:
+        make_app, driver = apps[framework]
+        kwargs = {'offload_auth': not args.fastapi_inline} if framework == 'fastapi' else {}
+        app = make_app(tenant_cache, **kwargs)
+        # warm up the token cache, lazily built middleware stacks, etc.
+        driver(app, request_mix, 1, min(args.requests, len(request_mix)))
+        results[framework] = {}
+        for concurrency in args.concurrency:
+            stats = driver(app, request_mix, concurrency, args.requests)
+            results[framework][str(concurrency)] = stats
+            print_stats(framework, concurrency, stats)
+    if args.reload_delay:
+        # user requests while reloads of a slow Tenants API are in flight, with authentication offloaded to the auth
+        # executor and inline on the event loop.
+        user_mix = [request for request in request_mix if request[2] == 'user']
+        tenant_cache.tenant_reload_min_interval = datetime.timedelta(seconds=0)
+        server.tenants_delay = args.reload_delay
+        for name, offload_auth in (('fastapi_reload_offload', True), ('fastapi_reload_inline', False)):
+            app = make_fastapi_app(tenant_cache, offload_auth=offload_auth)
+            run_fastapi(app, user_mix, 1, min(args.requests, len(user_mix)))
+            results[name] = {}
+            for concurrency in args.concurrency:
+                stats = run_fastapi_during_reload(app, user_mix, concurrency, args.requests, private_key)
+                results[name][str(concurrency)] = stats
+                print_stats(name, concurrency, stats)
+        server.tenants_delay = 0
+    server.stop()
+    return {'metadata': {'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                         'python_version': platform.python_version(),
+                         'platform': platform.platform(),
+                         'tapisservice_version': getattr(tapisservice, '__version__', None),
+                         'tenants': args.tenants,
+                         'sites': args.sites,
+                         'mix': args.mix,
+                         'distinct_users': args.distinct,
+                         'requests': args.requests,
+                         'token_cache': not args.no_token_cache,
+                         'fastapi_offload_auth': not args.fastapi_inline,
+                         'reload_delay': args.reload_delay,
+                         'tenant_api_calls': server.counters['tenants']},
+            'results': results}
+
+
+def print_stats(name, concurrency, stats):
+    print(f"{name:24s} concurrency {concurrency:4d}: {stats['requests_per_sec']:10.1f} req/s  "
+          f"p50 {stats['p50_ms']:8.3f}ms  p95 {stats['p95_ms']:8.3f}ms  p99 {stats['p99_ms']:8.3f}ms  "
+          f"statuses {stats['statuses']}")
+
+
+def parse_mix(items):
+    mix = {}
+    for item in items:
+        kind, _, weight = item.partition('=')
+        if kind not in DEFAULT_MIX or not weight.isdigit():
+            raise argparse.ArgumentTypeError(f"invalid mix entry {item}; use <kind>=<weight> with kind one of "
+                                             f"{', '.join(DEFAULT_MIX)}.")
+        mix[kind] = int(weight)
+    return mix
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--frameworks', nargs='+', choices=['flask', 'fastapi'], default=['flask', 'fastapi'])
+    parser.add_argument('--concurrency', nargs='+', type=int, default=[1, 4, 16, 64],
+                        help='number of concurrent clients (threads for flask, tasks for fastapi).')
+    parser.add_argument('--requests', type=int, default=2000, help='requests per concurrency level.')
+    parser.add_argument('--mix', nargs='+', default=[f'{k}={v}' for k, v in DEFAULT_MIX.items()],
+                        help='weights of the request kinds, e.g., user=80 service=15 invalid=3 expired=2.')
+    parser.add_argument('--tenants', type=int, default=100, help='number of user tenants in the fake registry.')
+    parser.add_argument('--sites', type=int, default=3, help='number of sites in the fake registry.')
+    parser.add_argument('--distinct', type=int, default=200, help='number of distinct users sending requests.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-token-cache', action='store_true', help='disable the verified token cache.')
+    parser.add_argument('--fastapi-inline', action='store_true',
+                        help='run TapisMiddleware authentication on the event loop instead of the auth executor.')
+    parser.add_argument('--reload-delay', type=float, default=0,
+                        help='also run user requests through FastAPI while tenant reloads that take this many seconds '
+                             'are in flight, with authentication offloaded and inline.')
+    parser.add_argument('--output', help='path of the JSON file to write the results to.')
+    args = parser.parse_args(argv)
+    args.mix = parse_mix(args.mix)
+
+    results = run(args)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nwrote results to {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,366 @@
+"""
+Offline microbenchmarks for the tapisservice authentication and routing hot paths.
+
+Starts a FakeTapisServer (see fakes.py) with a registry of --tenants tenants over --sites sites, points tapisservice
+at it, and times each benchmark for --iterations calls after --warmup untimed calls. Results are printed and written
+as JSON to --output so that runs can be compared between releases; pass a previous result file with --compare to
+print the change for each benchmark. No network access is needed.
+
+Usage:
+    python tests/benchmarks/run_benchmarks.py --tenants 1000 --output bench.json
+    python tests/benchmarks/run_benchmarks.py --compare bench.json --fail-threshold 20
+"""
+import argparse
+import concurrent.futures
+import contextvars
+import datetime
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+from types import SimpleNamespace
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.dirname(os.path.dirname(HERE)))
+
+import fakes
+
+
+def percentile(sorted_samples, pct):
+    index = min(len(sorted_samples) - 1, int(round(pct / 100 * (len(sorted_samples) - 1))))
+    return sorted_samples[index]
+
+
+def time_calls(func, args_list, iterations, warmup):
+    """
+    Calls func(*args) for args cycling through args_list, `warmup` times untimed and then `iterations` times timed,
+    and returns summary statistics of the per-call latency in microseconds.
+    """
+    n = len(args_list)
+    for i in range(warmup):
+        func(*args_list[i % n])
+    samples = []
+    clock = time.perf_counter
+    for i in range(iterations):
+        args = args_list[i % n]
+        start = clock()
+        func(*args)
+        samples.append(clock() - start)
+    samples = sorted(s * 1e6 for s in samples)
+    total = sum(samples)
+    return {'iterations': iterations,
+            'mean_us': round(total / iterations, 3),
+            'stdev_us': round(statistics.pstdev(samples), 3),
+            'min_us': round(samples[0], 3),
+            'p50_us': round(percentile(samples, 50), 3),
+            'p95_us': round(percentile(samples, 95), 3),
+            'p99_us': round(percentile(samples, 99), 3),
+            'max_us': round(samples[-1], 3),
+            'ops_per_sec': round(iterations / (total / 1e6), 1)}
+
+
+def run(args):
+    private_key, public_key = fakes.generate_keypair()
+    server = fakes.FakeTapisServer(private_key).start()
+    server.tenants, server.sites = fakes.build_registry(args.tenants, args.sites, public_key, server.base_url)
+    fakes.configure_environment(server.base_url)
+
+    # tapisservice must only be imported once the environment points at the fake server
+    import requests
+    import tapisservice
+    from tapisservice import auth, errors, tenants
+    from tapisservice.auth import (ServiceClientCache, TokenCache, add_headers, get_service_tapis_client,
+                                   preprocess_service_request, resolve_tenant_id_for_request, validate_request_token,
+                                   validate_token, validate_tokens)
+    from tapisservice.logs import format_fields, get_logger
+    from tapisservice.tapisfastapi.utils import g
+    from tapisservice.tenants import TenantCache
+
+    tenant_cache = TenantCache()
+    client = get_service_tapis_client(tenants=tenant_cache, base_url=server.base_url)
+
+    rng = random.Random(args.seed)
+    user_tenant_ids = [t['tenant_id'] for t in server.tenants if t['tenant_id'].startswith('t')]
+    samples = [rng.choice(user_tenant_ids) for _ in range(args.distinct)]
+    user_tokens = [fakes.make_token(private_key, tenant_id, f'user{i}') for i, tenant_id in enumerate(samples)]
+    expired_tokens = [fakes.make_token(private_key, tenant_id, f'user{i}', exp_in=-60)
+                      for i, tenant_id in enumerate(samples)]
+    service_token = fakes.make_token(private_key, 'admin', 'jobs', 'service', **{'tapis/target_site': 'tacc'})
+    no_cache = TokenCache(max_size=0)
+
+    def request_state(token=None, x_tapis_tenant=None, x_tapis_user=None):
+        return SimpleNamespace(x_tapis_token=token, x_tapis_tenant=x_tapis_tenant, x_tapis_user=x_tapis_user)
+
+    def fastapi_request(tenant_id, headers):
+        return SimpleNamespace(base_url=f'https://{tenant_id}.bench.tapis.io/v3/systems', headers=headers)
+
+    def bench_validate_token_rejected(token):
+        try:
+            validate_token(token, tenant_cache, token_cache=no_cache)
+        except errors.AuthenticationError:
+            pass
+        else:
+            raise AssertionError("expected the token to be rejected.")
+
+    # a batch of tokens as a bulk callback could deliver them: every distinct token, a fifth of them twice.
+    batch = user_tokens + user_tokens[:len(user_tokens) // 5]
+    thread_pool = concurrent.futures.ThreadPoolExecutor(args.workers)
+    process_pool = concurrent.futures.ProcessPoolExecutor(args.workers)
+
+    def bench_validate_token_loop(tokens):
+        for token in tokens:
+            validate_token(token, tenant_cache, token_cache=no_cache)
+
+    def bench_validate_request_token(state):
+        validate_request_token(state, tenant_cache)
+
+    class EagerLogger(object):
+        """
+        The loggers as they were before get_lazy_logger(): the f-string of every call was built, and the values in it
+        computed, before the logger checked the level.
+        """
+        def __init__(self, name):
+            self.logger = get_logger(name)
+
+        def _log(self, method, msg, args, fields):
+            if args:
+                msg = msg % args
+            if fields:
+                msg = f"{msg} {format_fields(fields)}"
+            method(msg)
+
+        def debug(self, msg, *args, **fields):
+            self._log(self.logger.debug, msg, args, fields)
+
+        def info(self, msg, *args, **fields):
+            self._log(self.logger.info, msg, args, fields)
+
+        def warning(self, msg, *args, **fields):
+            self._log(self.logger.warning, msg, args, fields)
+
+        def error(self, msg, *args, **fields):
+            self._log(self.logger.error, msg, args, fields)
+
+    lazy_loggers = (auth.logger, tenants.logger)
+    eager_loggers = (EagerLogger(auth.__name__), EagerLogger(tenants.__name__))
+
+    def bench_validate_request_token_logging(state, loggers):
+        # both variants swap the module loggers in, so that they pay the same for it.
+        auth.logger, tenants.logger = loggers
+        try:
+            validate_request_token(state, tenant_cache)
+        finally:
+            auth.logger, tenants.logger = lazy_loggers
+
+    def bench_resolve_tenant(tenant_id, token, claims):
+        state = request_state()
+        state.token_claims = claims
+        resolve_tenant_id_for_request(state, fastapi_request(tenant_id, {'X-Tapis-Token': token}), tenant_cache)
+
+    class LegacyGlobals(object):
+        """
+        The FastAPI `g` as it was before RequestContext: one ContextVar per attribute, each set to None when first used
+        and reset by GlobalsMiddleware at the start of every request.
+        """
+        __slots__ = ('_vars', '_reset_tokens')
+
+        def __init__(self):
+            object.__setattr__(self, '_vars', {})
+            object.__setattr__(self, '_reset_tokens', {})
+
+        def reset(self):
+            for name, var in self._vars.items():
+                try:
+                    var.reset(self._reset_tokens[name])
+                except ValueError:
+                    var.set(None)
+
+        def _ensure_var(self, item):
+            if item not in self._vars:
+                self._vars[item] = contextvars.ContextVar(f'globals:{item}', default=None)
+                self._reset_tokens[item] = self._vars[item].set(None)
+
+        def __getattr__(self, item):
+            self._ensure_var(item)
+            return self._vars[item].get()
+
+        def __setattr__(self, item, value):
+            self._ensure_var(item)
+            self._vars[item].set(value)
+
+    legacy_g = LegacyGlobals()
+
+    def fastapi_request_context(g, tenant_id, headers):
+        g.reset()
+        request = fastapi_request(tenant_id, headers)
+        add_headers(g, request)
+        validate_request_token(g, tenant_cache)
+        resolve_tenant_id_for_request(g, request, tenant_cache)
+        return g.request_tenant_id, g.request_username, g.x_tapis_user
+
+    def bench_fastapi_request_context(g, tenant_id, headers):
+        # the per-request work on `g` with a cached token, in a copy of the context as uvicorn runs each request in its
+        # own task: a fresh context, authentication and the reads a handler does.
+        contextvars.copy_context().run(fastapi_request_context, g, tenant_id, headers)
+
+    user_claims = [validate_token(token, tenant_cache) for token in user_tokens]
+    operation = client.systems.getSystems
+
+    client_cache = ServiceClientCache()
+
+    def bench_service_client_cold():
+        # building a client: loading the resource specs and minting service tokens for every site admin tenant.
+        client_cache.clear()
+        client_cache.get_client(base_url=server.base_url, tenants=tenant_cache)
+
+    def bench_preprocess(tenant_id, prepared):
+        # preprocess_service_request rewrites the URL and headers in place, so the same prepared request can be reused.
+        preprocess_service_request(operation, prepared, _x_tapis_tenant=tenant_id, _x_tapis_user='testuser')
+
+    benchmarks = {
+        'validate_token_uncached': (lambda token: validate_token(token, tenant_cache, token_cache=no_cache),
+                                    [(t,) for t in user_tokens]),
+        'validate_token_expired': (bench_validate_token_rejected, [(t,) for t in expired_tokens]),
+        'validate_token_cached': (lambda token: validate_token(token, tenant_cache),
+                                  [(t,) for t in user_tokens]),
+        'validate_token_loop_batch': (bench_validate_token_loop, [(batch,)], len(batch)),
+        'validate_tokens_batch_threads': (lambda tokens: validate_tokens(tokens, tenant_cache, token_cache=no_cache,
+                                                                         executor=thread_pool),
+                                          [(batch,)], len(batch)),
+        'validate_tokens_batch_processes': (lambda tokens: validate_tokens(tokens, tenant_cache, token_cache=no_cache,
+                                                                           executor=process_pool),
+                                            [(batch,)], len(batch)),
+        'validate_request_token_user': (bench_validate_request_token,
+                                        [(request_state(t),) for t in user_tokens]),
+        # the logging of a request at a production log level (ERROR), with eager f-strings and with LazyLogger.
+        'validate_request_token_eager_logging': (bench_validate_request_token_logging,
+                                                 [(request_state(t), eager_loggers) for t in user_tokens]),
+        'validate_request_token_lazy_logging': (bench_validate_request_token_logging,
+                                                [(request_state(t), lazy_loggers) for t in user_tokens]),
+        'validate_request_token_service_obo': (bench_validate_request_token,
+                                               [(request_state(service_token, tenant_id, 'testuser'),)
+                                                for tenant_id in samples
+                                                if tenant_cache.get_tenant_config(tenant_id=tenant_id).site_id == 'tacc']),
+        'resolve_tenant_id_for_request': (bench_resolve_tenant,
+                                          [(tenant_id, token, claims) for tenant_id, token, claims
+                                           in zip(samples, user_tokens, user_claims)]),
+        'fastapi_request_context': (bench_fastapi_request_context,
+                                    [(g, tenant_id, {'X-Tapis-Token': token}) for tenant_id, token
+                                     in zip(samples, user_tokens)]),
+        'fastapi_request_context_legacy': (bench_fastapi_request_context,
+                                           [(legacy_g, tenant_id, {'X-Tapis-Token': token}) for tenant_id, token
+                                            in zip(samples, user_tokens)]),
+        'get_tenant_config_by_id': (lambda tenant_id: tenant_cache.get_tenant_config(tenant_id=tenant_id),
+                                    [(t,) for t in samples]),
+        'get_tenant_config_by_url': (lambda tenant_id: tenant_cache.get_tenant_config(
+                                        url=f'https://{tenant_id}.bench.tapis.io/v3/systems'),
+                                     [(t,) for t in samples]),
+        'get_site_and_base_url_for_service_request': (
+            lambda tenant_id: tenant_cache.get_site_and_base_url_for_service_request(tenant_id, 'systems'),
+            [(t,) for t in samples]),
+        'get_service_client_cold': (bench_service_client_cold, [()]),
+        'get_service_client_warm': (lambda: client_cache.get_client(base_url=server.base_url, tenants=tenant_cache),
+                                    [()]),
+        'preprocess_service_request': (bench_preprocess,
+                                       [(t, requests.Request('GET', f'{server.base_url}/v3/systems').prepare())
+                                        for t in samples]),
+    }
+    if args.only:
+        benchmarks = {name: benchmarks[name] for name in args.only}
+    # benchmarks that take milliseconds per call run at most this many calls.
+    max_iterations = {'get_service_client_cold': 50}
+
+    results = {}
+    for name, (func, args_list, *batch_size) in benchmarks.items():
+        # batch benchmarks validate many tokens per call, so they do proportionally fewer calls.
+        batch_size = batch_size[0] if batch_size else 1
+        iterations = min(max(10, args.iterations // batch_size), max_iterations.get(name, args.iterations))
+        warmup = min(max(1, args.warmup // batch_size), max_iterations.get(name, args.warmup) // 10 or 1)
+        results[name] = time_calls(func, args_list, iterations, warmup)
+        if batch_size > 1:
+            results[name]['batch_size'] = batch_size
+        print(f"{name:45s} mean {results[name]['mean_us']:10.2f}us  p50 {results[name]['p50_us']:10.2f}us  "
+              f"p99 {results[name]['p99_us']:10.2f}us  {results[name]['ops_per_sec']:12.1f} ops/s")
+    client_cache.clear()
+    server.stop()
+    thread_pool.shutdown()
+    process_pool.shutdown()
+
+    try:
+        import tapipy
+        tapipy_version = getattr(tapipy, '__version__', None)
+    except ImportError:
+        tapipy_version = None
+    return {'metadata': {'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                         'python_version': platform.python_version(),
+                         'platform': platform.platform(),
+                         'tapisservice_version': getattr(tapisservice, '__version__', None),
+                         'tapipy_version': tapipy_version,
+                         'tenants': args.tenants,
+                         'sites': args.sites,
+                         'distinct_inputs': args.distinct,
+                         'iterations': args.iterations,
+                         'warmup': args.warmup,
+                         'seed': args.seed,
+                         'workers': args.workers,
+                         'token_cache_size': auth.token_cache.max_size},
+            'benchmarks': results}
+
+
+def compare(results, baseline, fail_threshold=None):
+    """
+    Prints the change in mean latency for each benchmark relative to `baseline` and returns the names of the
+    benchmarks that got slower by more than `fail_threshold` percent.
+    """
+    regressions = []
+    print(f"\ncompared to baseline from {baseline['metadata'].get('timestamp')}:")
+    for name, stats in results['benchmarks'].items():
+        base = baseline['benchmarks'].get(name)
+        if not base:
+            print(f"{name:45s} (not in baseline)")
+            continue
+        change = (stats['mean_us'] - base['mean_us']) / base['mean_us'] * 100
+        print(f"{name:45s} {base['mean_us']:10.2f}us -> {stats['mean_us']:10.2f}us  {change:+7.1f}%")
+        if fail_threshold is not None and change > fail_threshold:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tenants', type=int, default=100, help='number of user tenants in the fake registry.')
+    parser.add_argument('--sites', type=int, default=3, help='number of sites in the fake registry.')
+    parser.add_argument('--iterations', type=int, default=2000, help='timed calls per benchmark.')
+    parser.add_argument('--warmup', type=int, default=200, help='untimed calls per benchmark.')
+    parser.add_argument('--distinct', type=int, default=50,
+                        help='number of distinct tenants/tokens each benchmark cycles through.')
+    parser.add_argument('--workers', type=int, default=4, help='pool size for the validate_tokens benchmarks.')
+    parser.add_argument('--seed', type=int, default=0, help='seed for choosing the sampled tenants.')
+    parser.add_argument('--only', nargs='+', help='run only these benchmarks.')
+    parser.add_argument('--output', help='path of the JSON file to write the results to.')
+    parser.add_argument('--compare', help='path of a previous JSON results file to compare against.')
+    parser.add_argument('--fail-threshold', type=float,
+                        help='with --compare, exit non-zero if any mean latency grew by more than this percent.')
+    args = parser.parse_args(argv)
+
+    results = run(args)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nwrote results to {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.fail_threshold)
+        if regressions:
+            print(f"regressions above {args.fail_threshold}%: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
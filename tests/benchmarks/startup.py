@@ -0,0 +1,134 @@
+"""
+Startup time of a service process: the time to import tapisservice and load its config, broken down by step (see
+tapisservice.config.load_timings). Each run is a fresh interpreter, like a gunicorn worker starting. The runs are
+done without the config cache, then with an empty TAPIS_CONFIG_CACHE_DIR (the first run fills it) and then with the
+filled cache. It also compares loading the tapipy specs the way a client built with a spec_dir does with loading
+the specs compiled by tapisservice.specs, cold and warm, by time and by the growth of the peak RSS. No
+network access is needed.
+
+Usage:
+    python tests/benchmarks/startup.py --runs 20 --output startup.json
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+import fakes
+
+# run in each child process; prints the timings as JSON.
+CHILD = """
+import json, sys, time
+start = time.perf_counter()
+import tapisservice.auth
+imported = time.perf_counter()
+from tapisservice.config import conf, load_timings
+conf.get('service_name')
+loaded = time.perf_counter()
+timings = {step: value for step, value in load_timings.items() if not step == 'cache'}
+timings.update({'import': imported - start, 'load_config': loaded - imported, 'startup': loaded - start})
+print(json.dumps({'cache': load_timings['cache'], 'timings': timings}))
+"""
+
+
+# run in each child process for the spec scenarios; prints the time and the memory taken to load the specs.
+SPEC_CHILD = """
+import json, resource, sys, time
+from tapipy.tapis import RESOURCES, _get_specs
+from tapisservice import specs
+from tapisservice.config import conf
+mode, spec_dir, cache_dir, resource_names = sys.argv[1], sys.argv[2], sys.argv[3], sys.argv[4:]
+# a service has loaded its config before it builds clients.
+conf.get('service_name')
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+start = time.perf_counter()
+if mode == 'tapipy':
+    loaded, _ = _get_specs(RESOURCES['tapipy'], spec_dir=spec_dir)
+else:
+    loaded = specs.get_compiled_specs(spec_dir=spec_dir, resource_names=resource_names, cache_dir=cache_dir)
+elapsed = time.perf_counter() - start
+# the growth of the peak RSS, in KB on linux.
+memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss
+print(json.dumps({'cache': mode, 'timings': {'load_specs': elapsed}, 'memory_kb': memory,
+                  'resources': len(loaded)}))
+"""
+
+
+def run_child(env, code=CHILD, args=()):
+    result = subprocess.run([sys.executable, '-c', code, *args], env=env, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+def summarize(runs):
+    steps = {}
+    for run in runs:
+        for step, value in run['timings'].items():
+            steps.setdefault(step, []).append(value * 1000)
+    summary = {'runs': len(runs),
+               'cache': sorted(set(run['cache'] for run in runs)),
+               'mean_ms': {step: round(statistics.mean(values), 3) for step, values in steps.items()},
+               'p50_ms': {step: round(statistics.median(values), 3) for step, values in steps.items()}}
+    if 'memory_kb' in runs[0]:
+        summary['memory_kb'] = round(statistics.mean(run['memory_kb'] for run in runs), 1)
+        summary['resources'] = runs[0]['resources']
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10, help='processes started per scenario.')
+    parser.add_argument('--spec-resources', nargs='*', default=['systems', 'files', 'apps', 'jobs'],
+                        help='resources to compile in the compiled_specs_subset scenario.')
+    parser.add_argument('--output', help='path of the JSON file to write the results to.')
+    args = parser.parse_args(argv)
+
+    work_dir = tempfile.mkdtemp(prefix='tapisservice-startup-')
+    try:
+        # the fake server is never started: importing and loading the config must not need the network.
+        fakes.configure_environment('http://127.0.0.1:1', config_dir=work_dir)
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join([os.path.dirname(os.path.dirname(HERE)),
+                                                            os.environ.get('PYTHONPATH', '')]))
+        env.pop('TAPIS_CONFIG_CACHE_DIR', None)
+        cache_env = dict(env, TAPIS_CONFIG_CACHE_DIR=os.path.join(work_dir, 'config-cache'))
+        results = {'no_cache': summarize([run_child(env) for _ in range(args.runs)]),
+                   'cold_cache': summarize([run_child(cache_env)]),
+                   'warm_cache': summarize([run_child(cache_env) for _ in range(args.runs)])}
+        spec_dir = os.path.join(work_dir, 'specs')
+        spec_cache_dir = os.path.join(work_dir, 'spec-cache')
+
+        def run_spec_child(mode, *resource_names):
+            return run_child(env, SPEC_CHILD, [mode, spec_dir, spec_cache_dir, *resource_names])
+
+        # the first run copies the specs shipped with tapipy to spec_dir.
+        run_spec_child('tapipy')
+        results.update({
+            'tapipy_specs': summarize([run_spec_child('tapipy') for _ in range(args.runs)]),
+            'compiled_specs_cold': summarize([run_spec_child('compiled')]),
+            'compiled_specs_warm': summarize([run_spec_child('compiled') for _ in range(args.runs)]),
+            'compiled_specs_subset': summarize([run_spec_child('compiled', *args.spec_resources)
+                                                for _ in range(args.runs + 1)][1:])})
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    for scenario, summary in results.items():
+        print(f"{scenario} ({summary['runs']} runs, cache {'/'.join(summary['cache'])}):")
+        for step, value in summary['mean_ms'].items():
+            print(f"    {step:20s} {value:10.3f}ms")
+        if 'memory_kb' in summary:
+            print(f"    {'memory':20s} {summary['memory_kb']:10.1f}KB for {summary['resources']} resources")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nwrote results to {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
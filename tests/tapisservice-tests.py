@@ -2,14 +2,26 @@
 # Build the test docker image: docker build -t tapis/pysdk-tests -f Dockerfile-tests .
 # Run these tests using the built docker image: docker run -it --rm  tapis/pysdk-tests
 
+import asyncio
+import base64
+import datetime
+import json
+import logging
+import os
 import subprocess
+import threading
 import time
 
+import jwt
 import pytest
 from tapipy.tapis import Tapis, TapisResult
-from tapisservice.config import conf
+from tapisservice.config import conf, Config, load_timings
 from tapisservice.tenants import TenantCache
-from tapisservice.auth import get_service_tapis_client
+from tapisservice.auth import get_service_tapis_client, validate_token, TokenCache, decode_jwt, check_jwt_claims, \
+    verify_jwt_signature
+from tapisservice.logs import get_logger, get_lazy_logger, format_fields
+from tapisservice.metrics import MetricsRegistry
+from tapisservice import auth, errors, metrics
 
 Tenants = TenantCache()
 
@@ -283,6 +295,763 @@ def test_debug_flag_tenants(client):
     assert hasattr(debug.response, 'content')
 
 
+# -----------------------
+# Service token tests -
+# -----------------------
+
+def test_service_token_timings(client):
+    # get_service_tokens records how long minting took for every tenant
+    assert set(client.service_token_timings.keys()) == set(client.service_tokens.keys())
+    for elapsed in client.service_token_timings.values():
+        assert elapsed > 0
+
+def test_service_token_failures_are_collected():
+    from tapisservice import errors
+    client = get_service_tapis_client(tenants=Tenants, generate_tokens=False)
+    with pytest.raises(errors.ServiceTokenError) as e:
+        client.get_tokens(tenant_id='no-such-tenant')
+    assert 'no-such-tenant' in e.value.failures
+
+def test_concurrent_calls_across_token_expiry_refresh_once():
+    client = get_service_tapis_client(tenants=Tenants)
+    refresh_calls = []
+    refresh_token_op = client.tokens.refresh_token
+
+    def counting_refresh_token(**kwargs):
+        refresh_calls.append(kwargs)
+        return refresh_token_op(**kwargs)
+
+    client.tokens.refresh_token = counting_refresh_token
+    # move the service token to within the 5 second refresh window of preprocess_service_request
+    access_token = client.service_tokens[client.tenant_id]['access_token']
+    access_token.expires_at = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=2)
+    errors = []
+
+    def call():
+        try:
+            client.tenants.list_tenants(_tapis_set_x_headers_from_service=True)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(20)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors
+    assert len(refresh_calls) == 1
+    assert client.service_tokens[client.tenant_id]['access_token'].expires_in() > datetime.timedelta(seconds=5)
+
+def test_service_token_refresher():
+    client = get_service_tapis_client(tenants=Tenants)
+    access_token = client.service_tokens[client.tenant_id]['access_token']
+    refresher = client.start_service_token_refresher(refresh_fraction=0.8)
+    try:
+        # a token past 80% of its TTL is refreshed on the next pass
+        access_token.expires_at = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=60)
+        refresher.refresh_due_tokens()
+        assert refresher.refreshes >= 1
+        assert client.service_tokens[client.tenant_id]['access_token'] is not access_token
+    finally:
+        refresher.stop()
+
+def test_shared_service_tokens(tmp_path, monkeypatch):
+    monkeypatch.setitem(conf, 'tapisservice_service_token_shared_path', str(tmp_path / 'tokens'))
+    first = get_service_tapis_client(tenants=Tenants)
+    second = get_service_tapis_client(tenants=Tenants)
+    tenant_id = first.tenant_id
+    # the second worker reuses the tokens the first one minted --
+    assert not first.shared_service_tokens_reused
+    assert set(second.shared_service_tokens_reused) == set(second.service_tokens.keys())
+    assert second.service_tokens[tenant_id]['access_token'].access_token == \
+           first.service_tokens[tenant_id]['access_token'].access_token
+    # and the tokens one worker refreshes instead of refreshing them again --
+    access_token = first.refresh_service_tokens(tenant_id=tenant_id)
+    refresh_calls = []
+    second.tokens.refresh_token = lambda **kwargs: refresh_calls.append(kwargs)
+    assert second.refresh_service_tokens(tenant_id=tenant_id).access_token == access_token.access_token
+    assert not refresh_calls
+    # tokens that are due for a refresh are not reused --
+    monkeypatch.setitem(conf, 'tapisservice_service_token_refresh_fraction', 0)
+    third = get_service_tapis_client(tenants=Tenants)
+    assert not third.shared_service_tokens_reused
+
+
+def test_service_client_cache():
+    cache = auth.ServiceClientCache()
+    clients = []
+    threads = [threading.Thread(target=lambda: clients.append(cache.get_client(tenants=Tenants))) for _ in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    # concurrent callers share a single build
+    assert all(c is clients[0] for c in clients)
+    assert cache.get_stats()['misses'] == 1
+    # a client for another resource set has its own specs but shares the service tokens
+    other = cache.get_client(tenants=Tenants, resource_set='prod')
+    assert other is not clients[0]
+    assert other.service_tokens is clients[0].service_tokens
+    # minting new tokens through one of them updates the shared store in place, so the other one sees them too.
+    clients[0].get_tokens()
+    assert other.service_tokens is clients[0].service_tokens
+    assert other.shared_token_stores is clients[0].shared_token_stores
+    assert cache.invalidate(resource_set='prod') == 1
+    assert cache.get_client(tenants=Tenants) is clients[0]
+    cache.clear()
+    assert cache.get_client(tenants=Tenants) is not clients[0]
+
+def test_compiled_specs(tmp_path, monkeypatch):
+    import pickle
+    from tapipy.tapis import RESOURCES, get_file_info_from_url
+    from tapisservice import specs
+    monkeypatch.setattr(specs, '_loaded_specs', {})
+    spec_dir, cache_dir = str(tmp_path / 'specs'), str(tmp_path / 'cache')
+    compiled = specs.get_compiled_specs(spec_dir=spec_dir, resource_names=['systems'], cache_dir=cache_dir)
+    assert set(compiled) == {'systems', 'tenants', 'tokens'}
+    for path_desc in compiled['systems']['paths'].values():
+        for op in path_desc.values():
+            assert 'operationId' in op and set(op) <= set(specs.OPERATION_KEYS)
+    resources = specs.get_resources(resource_names=['systems'])
+    digest = specs.get_specs_digest(resources, spec_dir)
+    assert specs.read_compiled_specs(specs.get_spec_cache_path(cache_dir, digest), digest) == compiled
+    # changing a source spec changes the digest, so the specs are compiled again.
+    _, _, systems_path = get_file_info_from_url(RESOURCES['tapipy']['systems'], spec_dir)
+    with open(systems_path, 'rb') as f:
+        systems = pickle.load(f)
+    systems['paths']['/v3/systems/new'] = {'get': {'operationId': 'newOperation', 'description': 'new'}}
+    with open(systems_path, 'wb') as f:
+        pickle.dump(systems, f)
+    assert not specs.get_specs_digest(resources, spec_dir) == digest
+    recompiled = specs.get_compiled_specs(spec_dir=spec_dir, resource_names=['systems'], cache_dir=cache_dir)
+    assert recompiled['systems']['paths']['/v3/systems/new'] == {'get': {'operationId': 'newOperation'}}
+    assert len(os.listdir(cache_dir)) == 2
+
+# -----------------------
+# Token validation tests -
+# -----------------------
+
+def test_validate_token_cache_skips_verification(client, monkeypatch):
+    token = client.service_tokens[client.tenant_id]['access_token'].access_token
+    verifications = []
+    verify_jwt_signature = auth.verify_jwt_signature
+    monkeypatch.setattr(auth, 'verify_jwt_signature',
+                        lambda decoded, public_key: verifications.append(1) or verify_jwt_signature(decoded, public_key))
+    # without a cache, every call verifies the signature -
+    iterations = 20
+    for _ in range(iterations):
+        full_claims = validate_token(token, Tenants, token_cache=None)
+    assert len(verifications) == iterations
+    # with the verified-claims cache, only the first call (a miss) does -
+    cache = TokenCache(max_size=10)
+    for _ in range(iterations):
+        cached_claims = validate_token(token, Tenants, token_cache=cache)
+    assert len(verifications) == iterations + 1
+    assert cached_claims == full_claims
+    assert cache.hits == iterations - 1
+    assert cache.misses == 1
+
+def test_token_cache_eviction(client):
+    token = client.service_tokens[client.tenant_id]['access_token'].access_token
+    cache = TokenCache(max_size=1)
+    validate_token(token, Tenants, token_cache=cache)
+    validate_token(token, Tenants, expected_aud=['*'], token_cache=cache)
+    assert cache.evictions == 1
+    assert cache.stats()['size'] == 1
+
+
+def test_decode_jwt_single_pass(client):
+    token = client.service_tokens[client.tenant_id]['access_token'].access_token
+    decoded = decode_jwt(token)
+    public_key = Tenants.get_public_key(decoded.claims['tapis/tenant_id'])
+    check_jwt_claims(decoded)
+    verify_jwt_signature(decoded, public_key)
+    assert decoded.claims == jwt.decode(token, public_key, algorithms=['RS256'])
+    # the signature covers the segments exactly as they were parsed --
+    header, payload, signature = token.split('.')
+    claims = dict(decoded.claims, **{'tapis/username': 'someone_else'})
+    tampered = _unsigned_token(claims).split('.')[1]
+    with pytest.raises(jwt.InvalidSignatureError):
+        verify_jwt_signature(decode_jwt(f'{header}.{tampered}.{signature}'), public_key)
+
+def test_validate_token_rejects_before_signature_check(monkeypatch):
+    def verify_jwt_signature(decoded, public_key):
+        raise AssertionError("the signature should not have been checked.")
+    monkeypatch.setattr(auth, 'verify_jwt_signature', verify_jwt_signature)
+    now = int(time.time())
+    claims = {'tapis/tenant_id': 'admin', 'tapis/username': 'testuser', 'exp': now + 300}
+    for token in [_unsigned_token(dict(claims, exp=now - 1)),
+                  _unsigned_token(dict(claims, nbf=now + 300)),
+                  _unsigned_token(dict(claims, aud='some_client')),
+                  _unsigned_token(claims).replace(_unsigned_token({}).split('.')[0],
+                                                  base64.urlsafe_b64encode(b'{"alg": "none"}').decode().rstrip('=')),
+                  'not.a.jwt',
+                  'header.payload']:
+        with pytest.raises(errors.AuthenticationError):
+            validate_token(token, Tenants, token_cache=None)
+    with pytest.raises(jwt.ExpiredSignatureError):
+        check_jwt_claims(decode_jwt(_unsigned_token(dict(claims, exp=now - 1))))
+    with pytest.raises(jwt.InvalidAudienceError):
+        check_jwt_claims(decode_jwt(_unsigned_token(dict(claims, aud='some_client'))), expected_aud=['other_client'])
+    check_jwt_claims(decode_jwt(_unsigned_token(dict(claims, aud='some_client'))), expected_aud=['*'])
+    check_jwt_claims(decode_jwt(_unsigned_token(dict(claims, aud='some_client'))), expected_aud=['some_client'])
+
+def test_validate_tokens_batch(client):
+    from concurrent.futures import ThreadPoolExecutor
+    token = client.service_tokens['admin']['access_token'].access_token
+    expired = _unsigned_token({'tapis/tenant_id': 'admin', 'tapis/username': 'testuser', 'exp': int(time.time()) - 1})
+    tokens = [token, '', 'not.a.jwt', expired, token]
+    with ThreadPoolExecutor(2) as executor:
+        for kwargs in [{}, {'token_cache': None}, {'token_cache': None, 'executor': executor}]:
+            results = auth.validate_tokens(tokens, Tenants, **kwargs)
+            assert len(results) == len(tokens)
+            assert results[0] == results[4] == validate_token(token, Tenants, token_cache=None)
+            assert isinstance(results[1], errors.NoTokenError)
+            assert isinstance(results[2], errors.AuthenticationError)
+            assert isinstance(results[3], errors.AuthenticationError)
+    assert auth.validate_tokens([], Tenants) == []
+
+class EvictingTenantCache(TenantCache):
+    """TenantCache that drops its parsed public keys right after handing one out, as a concurrent reload can."""
+    def get_public_key_entry(self, tenant_id):
+        entry = super().get_public_key_entry(tenant_id)
+        self.public_keys.clear()
+        return entry
+
+
+def test_validate_tokens_in_process_pool(client, monkeypatch):
+    from concurrent.futures import ProcessPoolExecutor
+    monkeypatch.setattr(auth, 'BULK_VALIDATION_CHUNK_SIZE', 1)
+    tenants = EvictingTenantCache()
+    token = client.service_tokens['admin']['access_token'].access_token
+    tampered = token[:-4] + ('AAAA' if not token.endswith('AAAA') else 'BBBB')
+    # the PEMs sent to the worker processes come from the tokens being verified, not from the tenant cache --
+    with ProcessPoolExecutor(2) as executor:
+        results = auth.validate_tokens([token, tampered], tenants, token_cache=None, executor=executor)
+    assert results[0] == validate_token(token, Tenants, token_cache=None)
+    assert isinstance(results[1], errors.AuthenticationError)
+
+# -----------------------
+# Tenant cache tests -
+# -----------------------
+
+class SlowTenantCache(TenantCache):
+    """TenantCache whose reloads take reload_delay seconds, to simulate a slow Tenants API."""
+    reload_delay = 0
+
+    def get_tenants(self):
+        time.sleep(self.reload_delay)
+        return super().get_tenants()
+
+
+def test_concurrent_unknown_tenant_lookups_reload_once():
+    from tapisservice import errors
+    tenants = SlowTenantCache()
+    tenants.reload_delay = 0.5
+    tenants.tenant_reload_min_interval = datetime.timedelta(seconds=0)
+
+    def lookup():
+        with pytest.raises(errors.BaseTapisError):
+            tenants.get_tenant_config(tenant_id='no-such-tenant')
+
+    threads = [threading.Thread(target=lookup) for _ in range(10)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    stats = tenants.get_reload_stats()
+    assert stats['reloads'] == 1
+    assert stats['coalesced'] == 9
+    # the unknown tenant id is now negatively cached; further lookups do not reload
+    lookup()
+    assert tenants.get_reload_stats()['reloads'] == 1
+    assert tenants.get_reload_stats()['unknown_tenant_hits'] >= 1
+
+def test_tenant_reloads_are_rate_limited():
+    tenants = TenantCache()
+    tenants.tenant_reload_min_interval = datetime.timedelta(seconds=60)
+    # the first reload after the cache is built is not suppressed, but a second one within the interval is --
+    assert tenants.reload_tenants() is True
+    assert tenants.reload_tenants() is False
+    assert tenants.get_reload_stats()['suppressed'] == 1
+    # a miss whose reload was suppressed is not negatively cached, as the tenant could have been created since --
+    with pytest.raises(errors.BaseTapisError):
+        tenants.get_tenant_config(tenant_id='no-such-tenant')
+    assert tenants.get_reload_stats()['suppressed'] == 2
+    assert tenants.get_reload_stats()['unknown_tenants'] == 0
+    assert tenants.reload_tenants(force=True) is True
+
+def test_unknown_tenants_and_reload_stats_are_thread_safe():
+    tenants = TenantCache()
+    tenants.unknown_tenants_max_size = 50
+    errors_seen = []
+
+    def work(n):
+        try:
+            for i in range(2000):
+                tenants.add_unknown_tenant(f'bogus-{n}-{i}')
+                tenants.is_unknown_tenant(f'bogus-{n}-{i}')
+                tenants.count_reload_stat('coalesced')
+        except Exception as e:
+            errors_seen.append(e)
+
+    coalesced = tenants.get_reload_stats()['coalesced']
+    threads = [threading.Thread(target=work, args=(n,)) for n in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors_seen == []
+    stats = tenants.get_reload_stats()
+    assert stats['coalesced'] == coalesced + 8 * 2000
+    assert stats['unknown_tenants'] <= 50
+
+def test_tenant_host_index():
+    from tapisservice.tenants import get_url_host
+    for tenant in Tenants.tenants.values():
+        assert Tenants.tenants_by_host[get_url_host(tenant.base_url)] is not None
+        assert Tenants.get_tenant_config(url=f"{tenant.base_url}/v3/systems").base_url == tenant.base_url
+    assert Tenants.get_tenant_config(url='https://dev.develop.tapis.io:443/v3/systems').tenant_id == 'dev'
+    # a bad tenant record only leaves that tenant's primary-site URL out of the index, not the ones after it --
+    from types import SimpleNamespace
+    tenants = {'bad': SimpleNamespace(base_url=None), 'other': SimpleNamespace(tenant_id='other', base_url=None)}
+    index = Tenants.build_host_index(tenants)
+    assert index == {get_url_host(Tenants.get_base_url_for_tenant_primary_site('other')): tenants['other']}
+
+def test_tenant_registry_is_published_at_once():
+    tenants = TenantCache()
+    full = dict(tenants.tenants)
+    subset = dict(list(full.items())[:1])
+    done = threading.Event()
+    mixed = []
+
+    def swap():
+        for i in range(200):
+            tenants.set_tenants(subset if i % 2 else full)
+        done.set()
+
+    thread = threading.Thread(target=swap)
+    thread.start()
+    # a reader that takes one reference to the registry sees the tenants, keys and host index of the same version --
+    while not done.is_set():
+        registry = tenants.registry
+        if not registry.public_keys.keys() == registry.tenants.keys() or \
+                not all(t.tenant_id in registry.tenants for t in registry.tenants_by_host.values()):
+            mixed.append(registry.generation)
+    thread.join()
+    assert mixed == []
+    with pytest.raises(AttributeError):
+        tenants.registry.tenants = {}
+
+def test_site_admin_tenant_index():
+    for tenant in Tenants.tenants.values():
+        assert Tenants.get_site_admin_tenant_id(tenant.site_id) == tenant.site.site_admin_tenant_id
+    assert Tenants.get_site_admin_tenant_id('no-such-site') is None
+    admin_tenants = Tenants.get_site_admin_tenants_for_service()
+    assert admin_tenants == Tenants.compute_site_admin_tenants_for_service(Tenants.tenants)
+    # callers get a copy of the precomputed list
+    admin_tenants.append('foo')
+    assert 'foo' not in Tenants.get_site_admin_tenants_for_service()
+
+def test_tenant_background_refresh():
+    tenants = TenantCache()
+    generation = tenants.tenants_generation
+    tenants.start_background_refresh(interval=datetime.timedelta(seconds=0.5))
+    try:
+        time.sleep(2)
+        stats = tenants.get_reload_stats()
+        assert stats['background_refresh_running']
+        assert stats['refresh_failures'] == 0
+        assert stats['snapshot_age'] < 1
+        assert tenants.tenants_generation > generation
+    finally:
+        tenants.stop_background_refresh()
+    assert not tenants.get_reload_stats()['background_refresh_running']
+
+
+def test_tenants_snapshot(tmp_path):
+    tenants = TenantCache()
+    tenants.snapshot_path = str(tmp_path / 'tenants.json')
+    # a successful load from the Tenants API writes the snapshot --
+    assert tenants.reload_tenants(force=True)
+    tenants_data, sites_data, created_at = tenants.read_snapshot()
+    assert tenants.build_tenants(tenants_data, sites_data).keys() == tenants.tenants.keys()
+    # snapshots older than the max age are ignored --
+    tenants.snapshot_max_age = datetime.timedelta(seconds=0)
+    assert tenants.read_snapshot() is None
+    tenants.snapshot_max_age = datetime.timedelta(days=1)
+    # as are snapshots that fail the integrity check --
+    with open(tenants.snapshot_path) as f:
+        snapshot = json.load(f)
+    snapshot['payload']['tenants'][0]['base_url'] = 'https://attacker.example.com'
+    with open(tenants.snapshot_path, 'w') as f:
+        json.dump(snapshot, f)
+    assert tenants.read_snapshot() is None
+
+def test_tenants_snapshot_startup_without_tenants_api(tmp_path, monkeypatch):
+    monkeypatch.setitem(conf, 'tapisservice_tenants_snapshot_path', str(tmp_path / 'tenants.json'))
+    TenantCache()
+    def tenants_api_down(self):
+        raise errors.BaseTapisError("Unable to retrieve sites and tenants from the Tenants API.")
+    monkeypatch.setattr(TenantCache, 'fetch_tenants_data', tenants_api_down)
+    tenants = TenantCache()
+    assert tenants.loaded_from_snapshot
+    assert tenants.get_tenant_config(tenant_id='admin').tenant_id == 'admin'
+
+def test_shared_tenants(tmp_path, monkeypatch):
+    monkeypatch.setitem(conf, 'tapisservice_tenants_shared_path', str(tmp_path / 'tenants'))
+    fetches = []
+    fetch_tenants_data = TenantCache.fetch_tenants_data
+    monkeypatch.setattr(TenantCache, 'fetch_tenants_data', lambda self: fetches.append(1) or fetch_tenants_data(self))
+    owner = TenantCache()
+    worker = TenantCache()
+    try:
+        # the second worker uses the registry published by the first instead of calling the Tenants API --
+        assert len(fetches) == 1
+        assert owner.get_reload_stats()['shared_owner'] and not worker.get_reload_stats()['shared_owner']
+        assert worker.shared_generation == owner.shared_generation > 0
+        assert worker.tenants.keys() == owner.tenants.keys()
+        # and picks up new versions published by the owner by comparing the generation --
+        owner.tenant_reload_min_interval = datetime.timedelta(seconds=0)
+        assert owner.reload_tenants(force=True)
+        assert len(fetches) == 2
+        worker._next_shared_check = 0
+        assert worker.get_tenant_config(tenant_id='admin').tenant_id == 'admin'
+        assert worker.shared_generation == owner.shared_generation
+        assert worker.get_reload_stats()['adopted'] == 1
+        # the refreshes are taken over when the owner exits --
+        owner.stop_background_refresh()
+        owner.shared_tenants.release_ownership()
+        assert worker.take_shared_ownership()
+    finally:
+        for tenants in (owner, worker):
+            tenants.stop_background_refresh()
+            tenants.shared_tenants.release_ownership()
+
+
+# -----------------------
+# FastAPI middleware tests -
+# -----------------------
+
+def _unsigned_token(claims):
+    def b64(d):
+        return base64.urlsafe_b64encode(json.dumps(d).encode()).decode().rstrip('=')
+    return f"{b64({'alg': 'RS256', 'typ': 'JWT'})}.{b64(claims)}.c2ln"
+
+
+class BlockingTenantCache(TenantCache):
+    """
+    TenantCache whose reloads, once `released` is set to an event, block until the event is set or reload_timeout
+    passes. Records the threads the reloads ran on and whether they were released.
+    """
+    released = None
+    reload_timeout = 0
+
+    def get_tenants(self):
+        if self.released is not None:
+            self.reload_threads.append(threading.get_ident())
+            self.reload_started.set()
+            self.released_during_reload = self.released.wait(self.reload_timeout)
+        return super().get_tenants()
+
+
+def _reload_during_request(offload_auth, reload_timeout):
+    """
+    Sends a request with a token for an unknown tenant (which forces a tenant reload) through the TapisMiddleware. The
+    reload blocks until a task on the event loop, standing in for unrelated concurrent requests, releases it. Returns
+    whether it was released, i.e. whether the event loop kept running other tasks during the reload, and whether the
+    reload ran on the event loop's thread.
+    """
+    from tapisservice.tapisfastapi.auth import TapisMiddleware
+    from tapisservice import errors
+    tenants = BlockingTenantCache()
+    tenants.reload_threads = []
+    tenants.reload_started = threading.Event()
+    tenants.released = threading.Event()
+    tenants.reload_timeout = reload_timeout
+
+    async def app(scope, receive, send):
+        pass
+
+    middleware = TapisMiddleware(app, tenant_cache=tenants, offload_auth=offload_auth)
+    token = _unsigned_token({'tapis/tenant_id': 'no-such-tenant', 'exp': int(time.time()) + 600})
+    scope = {'type': 'http', 'method': 'GET', 'scheme': 'https', 'server': ('dev.develop.tapis.io', 443),
+             'path': '/v3/systems', 'root_path': '', 'query_string': b'',
+             'headers': [(b'host', b'dev.develop.tapis.io'), (b'x-tapis-token', token.encode())]}
+
+    async def releaser():
+        while not tenants.reload_started.is_set():
+            await asyncio.sleep(0.001)
+        tenants.released.set()
+
+    async def main():
+        release = asyncio.create_task(releaser())
+        with pytest.raises(errors.AuthenticationError):
+            await middleware(scope, None, None)
+        await release
+        return threading.get_ident()
+
+    loop_thread = asyncio.run(main())
+    assert len(tenants.reload_threads) == 1
+    return tenants.released_during_reload, tenants.reload_threads[0] == loop_thread
+
+
+def test_middleware_does_not_block_event_loop_during_reload():
+    # inline, the reload runs on the event loop and blocks it, so nothing else runs until it is done --
+    released, on_loop_thread = _reload_during_request(offload_auth=False, reload_timeout=0.2)
+    assert on_loop_thread and not released
+    # offloaded, it runs in the auth executor while the event loop keeps running other tasks --
+    released, on_loop_thread = _reload_during_request(offload_auth=True, reload_timeout=30)
+    assert released and not on_loop_thread
+
+
+def test_middleware_public_paths_preflight_and_lifespan_skip_authentication():
+    from tapisservice.tapisfastapi.auth import TapisMiddleware
+    from tapisservice import errors
+    reached = []
+
+    async def app(scope, receive, send):
+        reached.append((scope['type'], scope.get('path')))
+
+    middleware = TapisMiddleware(app, tenant_cache=TenantCache(), public_paths=['/v3/kg/hello', '/metrics*'],
+                                 skip_preflight=True)
+
+    def scope(path, method='GET', headers=()):
+        return {'type': 'http', 'method': method, 'scheme': 'https', 'server': ('dev.develop.tapis.io', 443),
+                'path': path, 'root_path': '', 'query_string': b'',
+                'headers': [(b'host', b'dev.develop.tapis.io')] + list(headers)}
+
+    async def main():
+        await middleware({'type': 'lifespan'}, None, None)
+        await middleware(scope('/v3/kg/hello'), None, None)
+        await middleware(scope('/metrics/tenants'), None, None)
+        await middleware(scope('/v3/kg/things', 'OPTIONS', [(b'access-control-request-method', b'POST')]), None, None)
+        # an OPTIONS request that is not a preflight and any other path still need a token.
+        for request_scope in (scope('/v3/kg/things', 'OPTIONS'), scope('/v3/kg/hello/world')):
+            with pytest.raises(errors.NoTokenError):
+                await middleware(request_scope, None, None)
+
+    asyncio.run(main())
+    assert reached == [('lifespan', None), ('http', '/v3/kg/hello'), ('http', '/metrics/tenants'),
+                       ('http', '/v3/kg/things')]
+
+
+def test_scope_request_base_url():
+    from tapisservice.tapisfastapi.auth import ScopeRequest
+    scope = {'type': 'http', 'method': 'GET', 'scheme': 'https', 'server': ('10.0.0.1', 8443), 'path': '/v3/kg',
+             'root_path': '', 'query_string': b'', 'headers': [(b'x-tapis-token', b'abc')]}
+    request = ScopeRequest(scope)
+    assert request.base_url == 'https://10.0.0.1:8443/'
+    assert request.headers.get('X-Tapis-Token') == 'abc'
+    scope['headers'].append((b'host', b'dev.develop.tapis.io'))
+    assert ScopeRequest(scope).base_url == 'https://dev.develop.tapis.io/'
+    assert str(ScopeRequest(scope).url) == 'https://dev.develop.tapis.io/v3/kg'
+
+
+def test_fastapi_globals_request_context():
+    from tapisservice.tapisfastapi.utils import GlobalsMiddleware, RequestContext, g, get_request_context
+    seen = []
+
+    async def app(scope, receive, send):
+        assert g.x_tapis_token is None and g.foo is None
+        g.x_tapis_token = scope['path']
+        g.foo = 'bar'
+        seen.append((get_request_context(), g.x_tapis_token, g.foo))
+
+    middleware = GlobalsMiddleware(app)
+
+    async def main():
+        # two requests in the same task; the second must get a fresh context.
+        await middleware({'type': 'http', 'path': '/first'}, None, None)
+        await middleware({'type': 'http', 'path': '/second'}, None, None)
+
+    asyncio.run(main())
+    assert [(token, foo) for _, token, foo in seen] == [('/first', 'bar'), ('/second', 'bar')]
+    assert seen[0][0] is not seen[1][0] and isinstance(seen[0][0], RequestContext)
+    # the known attributes are slots; only the extra one went in the instance dictionary.
+    assert seen[0][0].__dict__ == {'foo': 'bar'}
+
+# -----------------------
+# Site connection pool tests -
+# -----------------------
+
+@pytest.fixture
+def local_server():
+    """
+    A local stand-in for a Tapis site: a keep-alive HTTP/1.1 server answering every GET with an empty JSON object
+    after a short delay. Yields its base URL.
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            time.sleep(0.02)
+            self.send_response(200)
+            self.send_header('Content-Length', '2')
+            self.end_headers()
+            self.wfile.write(b'{}')
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_port}'
+    server.shutdown()
+    server.server_close()
+
+
+class PoolClient(object):
+    # the attributes of a service client used by tapisservice.sessions.
+    def __init__(self):
+        import requests
+        self.requests_session = requests.Session()
+        self.site_pool_adapters = {}
+
+
+def test_site_pool_reuses_connections(local_server):
+    from tapisservice.sessions import get_site_pool_stats, use_site_pool
+    client = PoolClient()
+    host_url = local_server.replace('127.0.0.1', 'localhost')
+    use_site_pool(client, 'tacc', local_server)
+    use_site_pool(client, 'tacc', host_url)
+    for _ in range(5):
+        client.requests_session.get(f'{local_server}/v3/systems')
+    client.requests_session.get(f'{host_url}/v3/systems')
+    # both base URLs of the site share its adapter, with one kept-alive connection per host.
+    assert client.requests_session.get_adapter(f'{host_url}/v3/systems') is client.site_pool_adapters['tacc']
+    stats = get_site_pool_stats(client)['tacc']
+    assert stats['requests'] == 6
+    assert stats['hosts'] == 2
+    assert stats['connections_opened'] == 2
+    assert stats['in_use'] == 0 and stats['peak_in_use'] == 1
+    # every request checked out one connection; closing the pools drains them without counting as checkouts.
+    assert stats['connection_waits'] == 6
+    client.site_pool_adapters['tacc'].close()
+    assert get_site_pool_stats(client)['tacc']['connection_waits'] == 6
+
+
+def test_site_pool_block_waits_for_connection(local_server, monkeypatch):
+    from concurrent.futures import ThreadPoolExecutor
+    from tapisservice.sessions import get_site_pool_stats, use_site_pool
+    monkeypatch.setitem(conf, 'tapisservice_site_pool_maxsize', 2)
+    monkeypatch.setitem(conf, 'tapisservice_site_pool_block', True)
+    client = PoolClient()
+    use_site_pool(client, 'tacc', local_server)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        responses = list(executor.map(lambda _: client.requests_session.get(f'{local_server}/v3/systems'), range(16)))
+    assert all(r.status_code == 200 for r in responses)
+    stats = get_site_pool_stats(client)['tacc']
+    assert stats['pool_maxsize'] == 2
+    assert stats['connections_opened'] == 2
+    assert stats['peak_in_use'] > 2
+    assert stats['connection_waits'] == 16
+    # the requests beyond the first two had to wait for one of the two connections.
+    assert stats['wait_seconds_max'] > 0.01
+
+
+# -----------------------
+# Metrics tests -
+# -----------------------
+
+def test_metrics_registry_render():
+    registry = MetricsRegistry(enabled=True)
+    counter = registry.counter('test_lookups_total', 'Test lookups.', ['result'])
+    counter.labels(result='hit').inc()
+    counter.labels('hit').inc(2)
+    histogram = registry.histogram('test_seconds', 'Test latency.', buckets=(0.1, 1))
+    histogram.observe(0.05)
+    histogram.observe(5)
+    registry.gauge('test_age_seconds', 'Test age.', callback=lambda: 1.5)
+    text = registry.render()
+    assert '# TYPE test_lookups_total counter' in text
+    assert 'test_lookups_total{result="hit"} 3' in text
+    assert 'test_seconds_bucket{le="0.1"} 1' in text
+    assert 'test_seconds_bucket{le="+Inf"} 2' in text
+    assert 'test_seconds_count 2' in text
+    assert 'test_age_seconds 1.5' in text
+    # registering the same metric again returns the existing one
+    assert registry.counter('test_lookups_total', 'Test lookups.', ['result']) is counter
+    # the base class is abstract
+    with pytest.raises(TypeError):
+        metrics.Metric('test_metric', 'Test metric.')
+
+def test_token_validation_metrics(client):
+    metrics.registry.enabled = True
+    try:
+        token = client.service_tokens['admin']['access_token'].access_token
+        histogram = metrics.registry.get('tapisservice_token_validation_seconds')
+        ok_count = histogram.labels('ok').count
+        validate_token(token, Tenants)
+        assert histogram.labels('ok').count == ok_count + 1
+        with pytest.raises(errors.AuthenticationError):
+            validate_token('not-a-token', Tenants)
+        assert histogram.labels('malformed').count >= 1
+        assert 'tapisservice_service_token_expires_in_seconds{tenant_id="admin"}' in metrics.registry.render()
+    finally:
+        metrics.registry.enabled = False
+
+
+# -----------------------
+# Logging tests -
+# -----------------------
+
+def test_lazy_logger_below_level_does_no_work(monkeypatch):
+    lazy_logger = get_lazy_logger('test_lazy_logger_below_level')
+    lazy_logger.setLevel(logging.ERROR)
+    emitted, evaluated = [], []
+
+    class Arg(object):
+        def __str__(self):
+            evaluated.append('arg')
+            return 'arg'
+
+    monkeypatch.setattr(lazy_logger.logger, 'log', lambda level, msg, **kwargs: emitted.append((level, msg)))
+    for _ in range(100):
+        lazy_logger.debug("top of validate_request_token %s", Arg(),
+                          attrs=lambda: evaluated.append('attrs') or 'attrs')
+    # below the level, nothing is formatted, evaluated or passed on to the logger -
+    assert emitted == [] and evaluated == []
+    lazy_logger.setLevel(logging.DEBUG)
+    lazy_logger.debug("top of validate_request_token %s", Arg(), attrs=lambda: evaluated.append('attrs') or 'attrs')
+    assert evaluated == ['arg', 'attrs']
+    assert emitted == [(logging.DEBUG, "top of validate_request_token arg attrs=attrs")]
+
+def test_lazy_logger_fields():
+    calls = []
+    lazy_logger = get_lazy_logger('test_lazy_logger_fields')
+    lazy_logger.setLevel(logging.ERROR)
+    lazy_logger.debug("not emitted", value=lambda: calls.append(1))
+    assert calls == []
+    assert format_fields({'tenant_id': 'dev', 'keys': lambda: ['a', 'b'], 'msg': 'a b'}) == \
+        "tenant_id=dev keys=['a', 'b'] msg='a b'"
+
+
+# -----------------------
+# Config tests -
+# -----------------------
+
+def test_config_cache(tmp_path, monkeypatch):
+    monkeypatch.setenv('TAPIS_CONFIG_CACHE_DIR', str(tmp_path))
+    monkeypatch.delenv('dev_iss', raising=False)
+    config = Config.load_config()
+    assert load_timings['cache'] == 'miss'
+    cache_files = list(tmp_path.glob('config-*.json'))
+    assert len(cache_files) == 1
+    # the config contains secrets --
+    assert cache_files[0].stat().st_mode & 0o077 == 0
+    assert Config.load_config() == config
+    assert load_timings['cache'] == 'hit'
+    assert 'validate' not in load_timings
+    # schema properties can be supplied through environment variables, so they are part of the cache key --
+    monkeypatch.setenv('dev_iss', 'https://dev.develop.tapis.io/v3/tokens')
+    assert Config.load_config()['dev_iss'] == 'https://dev.develop.tapis.io/v3/tokens'
+    assert load_timings['cache'] == 'miss'
+
+
 # -----------------------
 # Tapipy import timing test -
 # -----------------------
@@ -294,6 +1063,35 @@ def test_import_timing():
     assert import_time <= .8
 
 
+def test_tapisservice_import_timing():
+    # importing the library must not load the config, call the Tenants API or pull in tapipy.tapis, so point it
+    # at a config that does not exist; the import only fails if something touches conf or tenant_cache.
+    code = ("import json, sys, time\n"
+            "start = time.perf_counter()\n"
+            "import tapisservice.auth, tapisservice.tenants, tapisservice.config, tapisservice.metrics\n"
+            "import tapisservice.tapisfastapi.auth\n"
+            "import_time = time.perf_counter() - start\n"
+            "from tapisservice.utils import is_initialized\n"
+            "print(json.dumps({'import_time': import_time,\n"
+            "                  'conf': type(tapisservice.config.conf).__name__,\n"
+            "                  'tenant_cache': is_initialized(tapisservice.tenants.tenant_cache),\n"
+            "                  'auth_executor': is_initialized(tapisservice.tapisfastapi.auth.auth_executor),\n"
+            "                  'modules': [m for m in ('tapipy.tapis', 'Crypto', 'lib2to3', 'jsonschema')\n"
+            "                              if m in sys.modules]}))\n")
+    env = dict(os.environ, TAPIS_CONFIG_PATH='/nonexistent/config.json',
+               TAPIS_CONFIGSCHEMA_PATH='/nonexistent/configschema.json')
+    result = subprocess.run(['python', '-c', code], env=env, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    imported = json.loads(result.stdout.splitlines()[-1])
+    # a generous budget for the imports alone, which take about a quarter of it on a laptop.
+    import_time = imported['import_time']
+    assert import_time <= .8
+    assert imported['conf'] == 'LazyConfig'
+    assert not imported['tenant_cache']
+    assert not imported['auth_executor']
+    assert imported['modules'] == []
+
+
 # -----------------------
 # Download spec tests -
 # -----------------------